@@ -0,0 +1,29 @@
+"""Performance benchmarks
+
+C{benchmarks.run} times individual kernels of the C++ core on synthetic
+meshes and particle clouds of controlled size, without setting up a full
+driver run. C{benchmarks.regression} compares shortened runs of the
+example setups against a stored baseline. Run them with
+
+    python -m benchmarks.run --help
+    python -m benchmarks.regression --help
+
+from the top of the source tree.
+"""
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
@@ -0,0 +1,449 @@
+"""Synthetic problems and kernel definitions for the micro-benchmarks"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+import numpy
+
+
+
+
+# problem setup ---------------------------------------------------------------
+def make_discretization(rcon, dimensions, element_count, order):
+    """Return a discretization of the cube M{[-1,1]^d} with roughly
+    C{element_count} elements of order C{order}.
+    """
+    from hedge.mesh import make_rect_mesh, make_box_mesh
+
+    if dimensions == 2:
+        mesh = make_rect_mesh((-1,-1), (1,1),
+                max_area=4/element_count)
+    elif dimensions == 3:
+        mesh = make_box_mesh((-1,-1,-1), (1,1,1),
+                max_volume=8/element_count)
+    else:
+        raise ValueError, "invalid benchmark dimension"
+
+    return rcon.make_discretization(mesh, order=order)
+
+
+
+
+class BenchmarkProblem(object):
+    """A L{pyrticle.cloud.PicMethod} on C{discr} using C{depositor} and
+    C{pusher}, and a state holding C{particle_count} particles distributed
+    uniformly over the inner 90% of the mesh, with velocities of up to a
+    tenth of the speed of light in random directions.
+
+    The particle cloud only depends on C{seed}, so that problems with
+    different depositors or pushers see the same particles.
+    """
+
+    def __init__(self, discr, depositor, pusher, particle_count, seed=0):
+        from pyrticle.units import SIUnitsWithNaturalConstants
+        from pyrticle.cloud import PicMethod, guess_shape_bandwidth
+
+        self.discr = discr
+        self.units = units = SIUnitsWithNaturalConstants()
+        self.dimensions = dim = discr.dimensions
+
+        self.method = method = PicMethod(discr, units,
+                depositor, pusher,
+                dimensions_pos=dim, dimensions_velocity=dim)
+
+        self.state = method.make_state()
+
+        rng = numpy.random.RandomState(seed)
+        positions = rng.uniform(-0.9, 0.9, (particle_count, dim))
+        directions = rng.normal(size=(particle_count, dim))
+        directions /= numpy.sqrt(numpy.sum(directions**2, axis=1))[:, None]
+        velocities = (0.1*units.VACUUM_LIGHT_SPEED()
+                * rng.uniform(size=(particle_count, 1))
+                * directions)
+
+        method.add_particles(self.state,
+                ((pos, vel, -units.EL_CHARGE, units.EL_MASS)
+                    for pos, vel in zip(positions, velocities)),
+                particle_count)
+
+        guess_shape_bandwidth(method, self.state, 2)
+
+        # one field per component the pusher may look at
+        self.fields = [numpy.asarray(rng.normal(size=len(discr)))
+                for i in range(6)]
+
+    def __len__(self):
+        return len(self.state)
+
+    def field_args(self):
+        """Return the field arguments of L{pyrticle.pusher.Pusher.forces}
+        as the driver would pass them for this dimension, i.e. the TE mode
+        in 2D and all components in 3D.
+        """
+        from pyrticle._internal import ZeroVector
+        ex, ey, ez, bx, by, bz = self.fields
+
+        if self.dimensions == 2:
+            return (ex, ey, ZeroVector(), ZeroVector(), ZeroVector(), bz)
+        else:
+            return (ex, ey, ez, bx, by, bz)
+
+    def element_size(self):
+        return (2**self.dimensions
+                / self.method.mesh_data.element_count())**(1/self.dimensions)
+
+
+
+
+# timing ----------------------------------------------------------------------
+class KernelTiming(object):
+    def __init__(self, repeats, t_min, t_mean, phases):
+        self.repeats = repeats
+        self.t_min = t_min
+        self.t_mean = t_mean
+        self.phases = phases
+
+
+
+
+def time_kernel(run, setup=None, min_time=0.5, min_repeats=3):
+    """Call C{run} until at least C{min_repeats} calls taking at least
+    C{min_time} seconds in total have been made. C{setup} is called
+    before each call of C{run} and is not timed.
+
+    If the C++ core was built with phase timing, the per-phase totals
+    over all calls are returned along with the timing.
+    """
+    from time import time
+    from pyrticle._internal import phase_timing_enabled, \
+            reset_phase_timings, get_phase_timings
+
+    if phase_timing_enabled():
+        reset_phase_timings()
+
+    times = []
+    while len(times) < min_repeats or sum(times) < min_time:
+        if setup is not None:
+            setup()
+
+        start = time()
+        run()
+        times.append(time()-start)
+
+    if phase_timing_enabled():
+        phases = dict(
+                (name, {"t": t, "calls": calls, "items": items})
+                for name, (t, calls, items) in get_phase_timings().iteritems()
+                if calls)
+    else:
+        phases = None
+
+    return KernelTiming(len(times), min(times), sum(times)/len(times), phases)
+
+
+
+
+# kernels ---------------------------------------------------------------------
+class Kernel(object):
+    """A kernel to be timed on a L{BenchmarkProblem}.
+
+    C{category} is "common" for kernels that do not depend on the choice
+    of depositor and pusher, "depositor" or "pusher" otherwise.
+    C{touches_nodes} indicates that the work of the kernel also scales
+    with the number of mesh nodes, so that a node throughput is reported.
+    """
+
+    category = "common"
+    touches_nodes = False
+
+    def applies_to(self, problem):
+        return True
+
+    def prepare(self, problem):
+        """Return a tuple C{(setup, run, teardown)} of callables, where
+        C{setup} and C{teardown} may be C{None}.
+        """
+        raise NotImplementedError
+
+
+
+
+class FindContainingElements(Kernel):
+    """Moves every particle by half an element diameter in a random direction
+    (staying inside the mesh) and updates the containing elements.
+    """
+
+    name = "update_containing_elements"
+
+    def prepare(self, problem):
+        from pyrticle._internal import update_containing_elements, \
+                FindEventCounters, BoundaryHitListener, kill_particle
+
+        state = problem.state
+        pstate = state.particle_state
+        n = len(state)
+
+        orig_elements = pstate.containing_elements[:n].copy()
+        orig_positions = pstate.positions[:n].copy()
+
+        rng = numpy.random.RandomState(1)
+        directions = rng.normal(size=orig_positions.shape)
+        directions /= numpy.sqrt(numpy.sum(directions**2, axis=1))[:, None]
+        moved_positions = numpy.clip(
+                orig_positions + 0.5*problem.element_size()*directions,
+                -0.95, 0.95)
+
+        class BHitListener(BoundaryHitListener):
+            def note_boundary_hit(subself, pn):
+                kill_particle(pstate, pn, state.particle_number_shift_signaller)
+
+        listener = BHitListener()
+
+        def setup():
+            if pstate.particle_count != n:
+                raise RuntimeError, "particles were lost during element search"
+            pstate.containing_elements[:n] = orig_elements
+            pstate.positions[:n] = moved_positions
+            # time the lookups, not hits left over from the previous run
+            state.reset_margin_cache()
+
+        def run():
+            update_containing_elements(problem.method.mesh_data, pstate,
+                    listener, FindEventCounters())
+
+        def teardown():
+            pstate.containing_elements[:n] = orig_elements
+            pstate.positions[:n] = orig_positions
+
+        return setup, run, teardown
+
+
+
+
+class GetVelocities(Kernel):
+    name = "get_velocities"
+
+    def prepare(self, problem):
+        from pyrticle._internal import get_velocities
+        pstate = problem.state.particle_state
+        c = problem.units.VACUUM_LIGHT_SPEED()
+
+        def run():
+            get_velocities(pstate, c)
+
+        return None, run, None
+
+
+
+
+class Diagnostic(Kernel):
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def prepare(self, problem):
+        func = self.func
+
+        def run():
+            func(problem)
+
+        return None, run, None
+
+
+
+
+def _make_diagnostics():
+    import pyrticle._internal as _internal
+
+    def c(problem):
+        return problem.units.VACUUM_LIGHT_SPEED()
+
+    def max_energy(problem):
+        # kinetic energy at the problem's top speed of c/10
+        return (problem.units.EL_MASS * c(problem)**2
+                * (1/numpy.sqrt(1-0.1**2) - 1))
+
+    # the histogram ranges cover the particle cloud of BenchmarkProblem, and
+    # the bin counts are the defaults of pyrticle.phase_space
+    return [
+            Diagnostic("rms_beam_size", lambda p:
+                _internal.rms_beam_size(p.state.particle_state, 0)),
+            Diagnostic("rms_beam_emittance", lambda p:
+                _internal.rms_beam_emittance(p.state.particle_state,
+                    0, p.dimensions-1)),
+            Diagnostic("rms_energy_spread", lambda p:
+                _internal.rms_energy_spread(p.state.particle_state, c(p))),
+            Diagnostic("kinetic_energies", lambda p:
+                _internal.kinetic_energies(p.state.particle_state, c(p))),
+            Diagnostic("particle_momentum", lambda p:
+                _internal.particle_momentum(p.state.particle_state)),
+            Diagnostic("particle_current", lambda p:
+                _internal.particle_current(p.state.particle_state,
+                    p.method.velocities(p.state), 2)),
+            Diagnostic("get_beam_moments", lambda p:
+                _internal.get_beam_moments(p.state.particle_state,
+                    c(p), p.dimensions-1)),
+            Diagnostic("position_histogram", lambda p:
+                _internal.position_histogram(p.state.particle_state,
+                    0, -1, 1, 256)),
+            Diagnostic("energy_histogram", lambda p:
+                _internal.energy_histogram(p.state.particle_state,
+                    c(p), 0, max_energy(p), 256)),
+            Diagnostic("trace_space_histogram", lambda p:
+                _internal.trace_space_histogram(p.state.particle_state,
+                    0, p.dimensions-1, -1, 1, 64, -4, 4, 64)),
+            ]
+
+
+
+
+class DepositRho(Kernel):
+    name = "deposit_rho"
+    category = "depositor"
+    touches_nodes = True
+
+    def prepare(self, problem):
+        state = problem.state
+        depositor = problem.method.depositor
+
+        def run():
+            depositor.deposit_rho(state)
+
+        return state.derived_quantity_cache.clear, run, None
+
+
+
+
+class DepositJ(Kernel):
+    name = "deposit_j"
+    category = "depositor"
+    touches_nodes = True
+
+    def prepare(self, problem):
+        state = problem.state
+        depositor = problem.method.depositor
+        velocities = problem.method.velocities(state)
+
+        def run():
+            depositor.deposit_j(state, velocities)
+
+        return state.derived_quantity_cache.clear, run, None
+
+
+
+
+class GridRemap(Kernel):
+    """Remap of a charge density deposited on the grid of a grid-based
+    depositor to the mesh.
+    """
+
+    name = "grid_remap"
+    category = "depositor"
+    touches_nodes = True
+
+    def applies_to(self, problem):
+        return hasattr(problem.method.depositor, "remap_grid_to_mesh")
+
+    def prepare(self, problem):
+        depositor = problem.method.depositor
+        q_grid = numpy.array(depositor.deposit_grid_rho(problem.state))
+
+        def run():
+            depositor.remap_grid_to_mesh(q_grid)
+
+        return None, run, None
+
+
+
+
+class Forces(Kernel):
+    name = "forces"
+    category = "pusher"
+    touches_nodes = True
+
+    def prepare(self, problem):
+        state = problem.state
+        pusher = problem.method.pusher
+        velocities = problem.method.velocities(state)
+        field_args = problem.field_args()
+
+        def run():
+            pusher.forces(state, velocities, *field_args)
+
+        return None, run, None
+
+
+
+
+def get_kernels():
+    return [
+            FindContainingElements(),
+            GetVelocities(),
+            ] + _make_diagnostics() + [
+            DepositRho(),
+            DepositJ(),
+            GridRemap(),
+            Forces(),
+            ]
+
+
+
+
+def benchmark_kernel(kernel, problem, depositor_name, pusher_name,
+        min_time=0.5, min_repeats=3):
+    """Time C{kernel} on C{problem} and return a dictionary suitable for
+    JSON output.
+
+    The throughput is given in particle-steps per second, where a step is
+    one call of the kernel, and, for kernels that touch the field, in mesh
+    nodes per second.
+    """
+    setup, run, teardown = kernel.prepare(problem)
+    try:
+        timing = time_kernel(run, setup, min_time, min_repeats)
+    finally:
+        if teardown is not None:
+            teardown()
+
+    particle_count = len(problem)
+    node_count = len(problem.discr)
+
+    if kernel.touches_nodes:
+        nodes_per_s = node_count/timing.t_min
+    else:
+        nodes_per_s = None
+
+    return {
+            "kernel": kernel.name,
+            "dimensions": problem.dimensions,
+            "elements": problem.method.mesh_data.element_count(),
+            "nodes": node_count,
+            "particles": particle_count,
+            "depositor": depositor_name,
+            "pusher": pusher_name,
+            "repeats": timing.repeats,
+            "t_min": timing.t_min,
+            "t_mean": timing.t_mean,
+            "particle_steps_per_s": particle_count/timing.t_min,
+            "nodes_per_s": nodes_per_s,
+            "phases": timing.phases,
+            }
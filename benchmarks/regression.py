@@ -0,0 +1,301 @@
+"""Throughput regression checks on shortened runs of the example setups
+
+Each example from C{examples/pic} is run for a fixed number of steps in a
+separate process. The time spent in each timer recorded in the log file
+(C{t_step}, C{t_deposit}, C{t_force}, ..., and the C{t_ph_*} phase timers
+if the C++ core was built with C{PHASE_TIMING}) and the peak memory use of
+the process are compared with a stored baseline:
+
+    python -m benchmarks.regression --update     # record the baseline
+    python -m benchmarks.regression              # compare with it
+
+The examples seed their random number generators, so successive runs see
+the same particles. Baselines are only meaningful on the machine they were
+recorded on.
+"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+DEFAULT_EXAMPLES = ["kv2d", "kv3d", "gauss2d", "apsgun", "a6magnetron"]
+
+# log quantities starting with "t_" that are not timers
+_NON_TIMER_QUANTITIES = set(["t_sim", "t_eta", "t_wall"])
+
+
+
+
+# running ---------------------------------------------------------------------
+def get_examples_dir():
+    import os.path
+    return os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "examples", "pic")
+
+
+
+
+def read_log_timers(filename, skip_steps=1):
+    """Return a dictionary mapping the name of each timer in the log file
+    C{filename} to the total time it recorded, leaving out the first
+    C{skip_steps} steps, which include one-time setup costs.
+    """
+    from pytools.log import LogManager
+    mgr = LogManager(filename, "r")
+    try:
+        result = {}
+        for name in mgr.quantity_data:
+            if not name.startswith("t_") or name in _NON_TIMER_QUANTITIES:
+                continue
+
+            description, unit, data = mgr.get_expr_dataset(name)
+            result[name] = sum(value for step, value in data
+                    if step >= skip_steps and value is not None)
+
+        return result
+    finally:
+        mgr.close()
+
+
+
+
+def run_example(name, steps, overrides=[], skip_steps=1, python=None):
+    """Run the example C{name} for C{steps} steps in a separate process
+    and return a dictionary with its timers (see L{read_log_timers}), its
+    wall time and its peak resident set size in MiB.
+
+    C{overrides} is a list of C{"variable=value"} strings applied after
+    the example's setup file.
+    """
+    import os
+    import sys
+    from subprocess import Popen, STDOUT
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from time import time
+
+    if python is None:
+        python = sys.executable
+
+    output_path = mkdtemp(prefix="pyrticle-regression-")
+    try:
+        args = [python, "-c",
+                "from pyrticle.driver import PICRunner; PICRunner().run()",
+                name+".cpy",
+                "max_steps=%d" % steps,
+                "output_path=%r" % output_path,
+                "checkpoint_on_signal=False",
+                ] + list(overrides)
+
+        outf = open(os.path.join(output_path, "output.txt"), "w")
+        try:
+            start = time()
+            proc = Popen(args, cwd=get_examples_dir(),
+                    stdout=outf, stderr=STDOUT)
+            # wait4 yields the resource usage of this child alone
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            wall_time = time() - start
+        finally:
+            outf.close()
+
+        if not (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0):
+            output = open(os.path.join(output_path, "output.txt")).read()
+            raise RuntimeError("example '%s' failed (status %d), "
+                    "output ends with:\n%s" % (name, status, output[-2000:]))
+
+        return {
+                "timers": read_log_timers(
+                    os.path.join(output_path, "pic.dat"), skip_steps),
+                "wall_time": wall_time,
+                # ru_maxrss is in KiB on Linux
+                "peak_rss_mb": rusage.ru_maxrss/1024,
+                }
+    finally:
+        rmtree(output_path)
+
+
+
+
+def best_of(results):
+    """Combine the results of several runs of the same example by taking
+    the minimum of each quantity, which is least affected by noise.
+    """
+    timer_names = set()
+    for result in results:
+        timer_names.update(result["timers"])
+
+    return {
+            "timers": dict(
+                (name, min(result["timers"].get(name, 0) for result in results))
+                for name in timer_names),
+            "wall_time": min(result["wall_time"] for result in results),
+            "peak_rss_mb": min(result["peak_rss_mb"] for result in results),
+            }
+
+
+
+
+# comparison ------------------------------------------------------------------
+def compare_to_baseline(baseline, current, tolerance=0.2,
+        memory_tolerance=0.1, min_seconds=0.05):
+    """Compare the results of one example against its baseline and return
+    a list of human-readable descriptions of the regressions found.
+
+    A timer regresses if it grew by more than the fraction C{tolerance}.
+    Timers that stayed below C{min_seconds} in the baseline are too noisy
+    to judge and are ignored. The peak memory use regresses if it grew by
+    more than C{memory_tolerance}.
+    """
+    regressions = []
+
+    for name, base_value in sorted(baseline["timers"].iteritems()):
+        if base_value < min_seconds:
+            continue
+
+        value = current["timers"].get(name)
+        if value is None:
+            continue
+
+        if value > (1+tolerance)*base_value:
+            regressions.append("%s: %.3f s -> %.3f s (%+.0f%%)" % (
+                name, base_value, value, 100*(value/base_value-1)))
+
+    base_rss = baseline["peak_rss_mb"]
+    rss = current["peak_rss_mb"]
+    if rss > (1+memory_tolerance)*base_rss:
+        regressions.append("peak memory: %.1f MiB -> %.1f MiB (%+.0f%%)" % (
+            base_rss, rss, 100*(rss/base_rss-1)))
+
+    return regressions
+
+
+
+
+# user interface --------------------------------------------------------------
+def main():
+    from optparse import OptionParser
+    import os.path
+
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--examples", default=",".join(DEFAULT_EXAMPLES),
+            help="comma-separated examples from examples/pic "
+            "[default: %default]")
+    parser.add_option("--steps", type="int", default=20,
+            help="number of time steps per run [default: %default]")
+    parser.add_option("--skip-steps", type="int", default=1,
+            help="number of initial steps not counted [default: %default]")
+    parser.add_option("--repeat", type="int", default=1,
+            help="number of runs per example, the best of which counts "
+            "[default: %default]")
+    parser.add_option("--set", dest="overrides", action="append", default=[],
+            metavar="VARIABLE=VALUE",
+            help="override a setup variable in all examples (repeatable)")
+    parser.add_option("--baseline",
+            default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "regression-baseline.json"),
+            help="baseline file [default: %default]")
+    parser.add_option("--update", action="store_true",
+            help="record the results as the new baseline")
+    parser.add_option("--tolerance", type="float", default=0.2,
+            help="allowed relative growth of a timer [default: %default]")
+    parser.add_option("--memory-tolerance", type="float", default=0.1,
+            help="allowed relative growth of the peak memory use "
+            "[default: %default]")
+    parser.add_option("--min-seconds", type="float", default=0.05,
+            help="ignore timers below this many seconds in the baseline "
+            "[default: %default]")
+    options, args = parser.parse_args()
+
+    if args:
+        parser.error("no positional arguments expected")
+
+    import sys
+    from json import load, dump
+
+    examples = [name for name in options.examples.split(",") if name]
+
+    if not options.update:
+        if not os.path.exists(options.baseline):
+            parser.error("baseline '%s' does not exist--record one "
+                    "with --update" % options.baseline)
+        inf = open(options.baseline)
+        try:
+            baseline = load(inf)
+        finally:
+            inf.close()
+
+        if (baseline["steps"] != options.steps
+                or baseline["skip_steps"] != options.skip_steps
+                or baseline["overrides"] != options.overrides):
+            parser.error("baseline was recorded with different --steps, "
+                    "--skip-steps or --set options")
+
+    results = {}
+    regression_count = 0
+    for name in examples:
+        print "running %s..." % name
+        sys.stdout.flush()
+
+        result = results[name] = best_of([
+            run_example(name, options.steps, options.overrides,
+                options.skip_steps)
+            for i in range(options.repeat)])
+
+        print "  wall time %.2f s, peak memory %.1f MiB" % (
+                result["wall_time"], result["peak_rss_mb"])
+
+        if not options.update:
+            if name not in baseline["examples"]:
+                print "  not in baseline"
+                continue
+
+            regressions = compare_to_baseline(
+                    baseline["examples"][name], result,
+                    options.tolerance, options.memory_tolerance,
+                    options.min_seconds)
+            for regression in regressions:
+                print "  REGRESSION %s" % regression
+            regression_count += len(regressions)
+
+    if options.update:
+        outf = open(options.baseline, "w")
+        try:
+            dump({
+                "steps": options.steps,
+                "skip_steps": options.skip_steps,
+                "overrides": options.overrides,
+                "examples": results,
+                }, outf, indent=2, sort_keys=True)
+        finally:
+            outf.close()
+        print "baseline written to %s" % options.baseline
+    elif regression_count:
+        print "%d regression(s) found" % regression_count
+        sys.exit(1)
+    else:
+        print "no regressions found"
+
+
+
+
+if __name__ == "__main__":
+    main()
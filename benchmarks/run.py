@@ -0,0 +1,173 @@
+"""Run the kernel micro-benchmarks and write the results as JSON lines"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+def get_depositor_classes():
+    from pyrticle.deposition.shape import \
+            ShapeFunctionDepositor, \
+            NormalizedShapeFunctionDepositor
+    from pyrticle.deposition.advective import AdvectiveDepositor
+    from pyrticle.deposition.grid import GridDepositor
+    from pyrticle.deposition.grid_find import GridFindDepositor
+
+    return {
+            "shape": ShapeFunctionDepositor,
+            "normshape": NormalizedShapeFunctionDepositor,
+            "advective": AdvectiveDepositor,
+            "grid": GridDepositor,
+            "gridfind": GridFindDepositor,
+            }
+
+
+
+
+def get_pusher_classes():
+    from pyrticle.pusher import \
+            MonomialParticlePusher, \
+            AverageParticlePusher
+
+    return {
+            "monomial": MonomialParticlePusher,
+            "average": AverageParticlePusher,
+            }
+
+
+
+
+def _parse_list(s, type=str):
+    return [type(item) for item in s.split(",") if item]
+
+
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--dimensions", default="2,3",
+            help="comma-separated mesh dimensions [default: %default]")
+    parser.add_option("--elements", default="1000",
+            help="comma-separated approximate element counts "
+            "[default: %default]")
+    parser.add_option("--particles", default="10000,100000",
+            help="comma-separated particle counts [default: %default]")
+    parser.add_option("--order", type="int", default=3,
+            help="element order [default: %default]")
+    parser.add_option("--depositors", default="shape,normshape,advective,grid",
+            help="comma-separated depositors out of %s [default: %%default]"
+            % ", ".join(sorted(get_depositor_classes())))
+    parser.add_option("--pushers", default="monomial,average",
+            help="comma-separated pushers out of %s [default: %%default]"
+            % ", ".join(sorted(get_pusher_classes())))
+    parser.add_option("--kernels", default=None,
+            help="only run kernels whose name matches this regular expression")
+    parser.add_option("--min-time", type="float", default=0.5,
+            help="minimum total time per kernel in seconds [default: %default]")
+    parser.add_option("--min-repeats", type="int", default=3,
+            help="minimum number of calls per kernel [default: %default]")
+    parser.add_option("--seed", type="int", default=0,
+            help="seed of the particle cloud [default: %default]")
+    parser.add_option("-o", "--output", default=None,
+            help="append JSON lines to this file instead of printing them")
+    options, args = parser.parse_args()
+
+    if args:
+        parser.error("no positional arguments expected")
+
+    import re
+    from json import dumps
+    from hedge.backends import guess_run_context
+    from benchmarks.kernels import make_discretization, BenchmarkProblem, \
+            get_kernels, benchmark_kernel
+
+    depositor_classes = get_depositor_classes()
+    pusher_classes = get_pusher_classes()
+
+    depositor_names = _parse_list(options.depositors)
+    pusher_names = _parse_list(options.pushers)
+    for name in depositor_names:
+        if name not in depositor_classes:
+            parser.error("unknown depositor '%s'" % name)
+    for name in pusher_names:
+        if name not in pusher_classes:
+            parser.error("unknown pusher '%s'" % name)
+    if not depositor_names or not pusher_names:
+        parser.error("need at least one depositor and one pusher")
+
+    kernels = get_kernels()
+    if options.kernels is not None:
+        kernels = [k for k in kernels if re.search(options.kernels, k.name)]
+
+    # The common kernels run with the first depositor and pusher, the
+    # depositor kernels with each depositor and the first pusher, and
+    # the pusher kernels with each pusher and the first depositor.
+    combinations = [(depositor_names[0], pusher_names[0], ["common"])]
+    for dep_name in depositor_names:
+        combinations.append((dep_name, pusher_names[0], ["depositor"]))
+    for push_name in pusher_names:
+        combinations.append((depositor_names[0], push_name, ["pusher"]))
+
+    if options.output is not None:
+        outf = open(options.output, "a")
+    else:
+        import sys
+        outf = sys.stdout
+
+    rcon = guess_run_context([])
+
+    try:
+        for dim in _parse_list(options.dimensions, int):
+            for element_count in _parse_list(options.elements, int):
+                discr = make_discretization(rcon, dim, element_count,
+                        options.order)
+
+                for particle_count in _parse_list(options.particles, int):
+                    for dep_name, push_name, categories in combinations:
+                        run_kernels = [k for k in kernels
+                                if k.category in categories]
+                        if not run_kernels:
+                            continue
+
+                        problem = BenchmarkProblem(discr,
+                                depositor_classes[dep_name](),
+                                pusher_classes[push_name](),
+                                particle_count, options.seed)
+
+                        for kernel in run_kernels:
+                            if not kernel.applies_to(problem):
+                                continue
+
+                            result = benchmark_kernel(kernel, problem,
+                                    dep_name, push_name,
+                                    options.min_time, options.min_repeats)
+                            outf.write(dumps(result) + "\n")
+                            outf.flush()
+    finally:
+        if options.output is not None:
+            outf.close()
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Checkpointing and restart of the PIC state"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+import numpy
+
+
+
+
+# file format -----------------------------------------------------------------
+# A checkpoint file consists of
+#
+# - a preamble: the magic string, the format version (uint32) and the
+#   length of the header (uint64), all little-endian,
+# - the header: a pickled dictionary with the keys "metadata" (an arbitrary
+#   picklable object) and "arrays", which maps array names to tuples
+#   (dtype string, shape, offset). Offsets are relative to the start of the
+#   data section.
+# - the data section, starting at the first multiple of ALIGNMENT after the
+#   header. Each array is stored as a raw, C-contiguous block starting at a
+#   multiple of ALIGNMENT, so that it can be memory-mapped.
+
+MAGIC = "PYRTCKPT"
+FORMAT_VERSION = 1
+ALIGNMENT = 4096
+
+_PREAMBLE_FORMAT = "<8sIQ"
+
+
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+
+
+def write_checkpoint(filename, metadata, arrays):
+    """Write the picklable C{metadata} and C{arrays}, a dictionary mapping
+    names to numpy arrays, to C{filename}.
+
+    The file is first written under a temporary name and then moved into
+    place, so that an interrupted write never leaves a truncated checkpoint
+    behind.
+    """
+    from struct import pack, calcsize
+    from cPickle import dumps
+    import os
+
+    arrays = [(name, numpy.ascontiguousarray(ary))
+            for name, ary in sorted(arrays.iteritems())]
+
+    array_info = {}
+    offset = 0
+    for name, ary in arrays:
+        array_info[name] = (ary.dtype.str, ary.shape, offset)
+        offset = _align(offset + ary.nbytes)
+
+    header = dumps({"metadata": metadata, "arrays": array_info}, 2)
+    data_start = _align(calcsize(_PREAMBLE_FORMAT) + len(header))
+
+    tmp_filename = filename + ".tmp"
+    outf = open(tmp_filename, "wb")
+    try:
+        outf.write(pack(_PREAMBLE_FORMAT, MAGIC, FORMAT_VERSION, len(header)))
+        outf.write(header)
+
+        for name, ary in arrays:
+            outf.seek(data_start + array_info[name][2])
+            ary.tofile(outf)
+
+        # make sure the file extends to the end of the last aligned block
+        outf.seek(data_start + offset)
+        outf.truncate()
+
+        outf.flush()
+        os.fsync(outf.fileno())
+    finally:
+        outf.close()
+
+    os.rename(tmp_filename, filename)
+
+
+
+
+class Checkpoint(object):
+    """Read access to a checkpoint written by L{write_checkpoint}.
+
+    Arrays are memory-mapped copy-on-write by default, so they are only
+    paged in when they are touched, and may be modified without affecting
+    the file.
+    """
+
+    def __init__(self, filename):
+        from struct import unpack, calcsize
+        from cPickle import loads
+
+        self.filename = filename
+
+        inf = open(filename, "rb")
+        try:
+            preamble_size = calcsize(_PREAMBLE_FORMAT)
+            magic, version, header_len = unpack(_PREAMBLE_FORMAT,
+                    inf.read(preamble_size))
+
+            if magic != MAGIC:
+                raise ValueError("'%s' is not a pyrticle checkpoint" % filename)
+            if version != FORMAT_VERSION:
+                raise ValueError("checkpoint '%s' has unsupported format "
+                        "version %d" % (filename, version))
+
+            header = loads(inf.read(header_len))
+        finally:
+            inf.close()
+
+        self.metadata = header["metadata"]
+        self.array_info = header["arrays"]
+        self.data_start = _align(preamble_size + header_len)
+
+    def array_names(self):
+        return self.array_info.keys()
+
+    def __contains__(self, name):
+        return name in self.array_info
+
+    def get_array(self, name, mmap=True):
+        dtype, shape, offset = self.array_info[name]
+        dtype = numpy.dtype(dtype)
+
+        count = 1
+        for s in shape:
+            count *= s
+
+        if count == 0:
+            return numpy.zeros(shape, dtype=dtype)
+
+        if mmap:
+            return numpy.memmap(self.filename, dtype=dtype, mode="c",
+                    offset=self.data_start+offset, shape=shape)
+        else:
+            inf = open(self.filename, "rb")
+            try:
+                inf.seek(self.data_start+offset)
+                return numpy.fromfile(inf, dtype=dtype,
+                        count=count).reshape(shape)
+            finally:
+                inf.close()
+
+    def get_arrays_with_prefix(self, prefix, mmap=True):
+        return dict(
+                (name[len(prefix):], self.get_array(name, mmap))
+                for name in self.array_info
+                if name.startswith(prefix))
+
+
+
+
+# PIC state -------------------------------------------------------------------
+def write_pic_checkpoint(filename, method, state, fields, step, t):
+    """Write the particle state C{state}, the depositor and pusher state
+    it carries, and the field vector C{fields} to C{filename}.
+    """
+    pcount = len(state)
+    pstate = state.particle_state
+    sf = method.depositor.shape_function
+
+    metadata = {
+            "step": step,
+            "t": t,
+            "particle_count": pcount,
+            "dimensionality": method.get_dimensionality_suffix(),
+            "element_count": method.mesh_data.element_count(),
+            "mesh_hash": method.mesh_data.mesh_hash(),
+            "depositor": method.depositor.__class__.__name__,
+            "pusher": method.pusher.__class__.__name__,
+            "shape_radius": sf.radius,
+            "shape_exponent": sf.exponent,
+            "field_count": len(fields),
+            }
+
+    arrays = {
+            "containing_elements": pstate.containing_elements[:pcount],
+            "positions": pstate.positions[:pcount],
+            "momenta": pstate.momenta[:pcount],
+            "species": pstate.species[:pcount],
+            "species_charges": pstate.species_charges,
+            "species_masses": pstate.species_masses,
+            }
+    if state.weights is not None:
+        arrays["weights"] = state.weights
+
+    for i, field in enumerate(fields):
+        arrays["field_%d" % i] = field
+
+    for name, ary in method.depositor.get_checkpoint_data(state).iteritems():
+        arrays["dep_"+name] = ary
+    for name, ary in method.pusher.get_checkpoint_data(state).iteritems():
+        arrays["push_"+name] = ary
+
+    write_checkpoint(filename, metadata, arrays)
+
+
+
+
+def read_pic_checkpoint(checkpoint, method, state):
+    """Restore the particle, depositor and pusher state from C{checkpoint},
+    a L{Checkpoint} instance, into the freshly made C{state}.
+
+    The particle arrays are memory-mapped rather than read. The depositor's
+    shape function is set up from the stored radius and exponent.
+
+    Returns a tuple C{(fields, step, t)}.
+    """
+    md = checkpoint.metadata
+
+    if md["dimensionality"] != method.get_dimensionality_suffix():
+        raise ValueError("checkpoint has dimensionality %s, expected %s" % (
+            md["dimensionality"], method.get_dimensionality_suffix()))
+    if md["element_count"] != method.mesh_data.element_count():
+        raise ValueError("checkpoint was written for a mesh with %d elements, "
+                "current mesh has %d" % (
+                    md["element_count"], method.mesh_data.element_count()))
+    # element numbers in the particle and field data are only meaningful
+    # for the same element order, which mesh_reorder changes
+    if md["mesh_hash"] != method.mesh_data.mesh_hash():
+        raise ValueError("checkpoint was written for a different mesh or "
+                "element order (check that mesh_reorder is unchanged)")
+    if md["depositor"] != method.depositor.__class__.__name__:
+        raise ValueError("checkpoint was written with depositor %s, "
+                "not %s" % (md["depositor"], method.depositor.__class__.__name__))
+
+    # particles ---------------------------------------------------------------
+    pstate = state.particle_state
+    pstate.containing_elements = checkpoint.get_array("containing_elements")
+    pstate.positions = checkpoint.get_array("positions")
+    pstate.momenta = checkpoint.get_array("momenta")
+    pstate.particle_count = md["particle_count"]
+    pstate.species = checkpoint.get_array("species")
+    pstate.species_charges = checkpoint.get_array("species_charges")
+    pstate.species_masses = checkpoint.get_array("species_masses")
+    if "weights" in checkpoint:
+        pstate.weights = checkpoint.get_array("weights")
+    state.reset_margin_cache()
+
+    method.check_containment(state)
+    state.particle_number_shift_signaller.note_change_size(
+            pstate.particle_count)
+    state.derived_quantity_cache.clear()
+
+    # depositor and pusher ----------------------------------------------------
+    from pyrticle._internal import PolynomialShapeFunction
+    method.depositor.set_shape_function(state,
+            PolynomialShapeFunction(
+                md["shape_radius"],
+                method.mesh_data.dimensions,
+                md["shape_exponent"]))
+
+    method.depositor.set_checkpoint_data(state,
+            checkpoint.get_arrays_with_prefix("dep_"))
+    method.pusher.set_checkpoint_data(state,
+            checkpoint.get_arrays_with_prefix("push_"))
+
+    # fields ------------------------------------------------------------------
+    from hedge.tools import make_obj_array
+    fields = make_obj_array([
+        numpy.array(checkpoint.get_array("field_%d" % i))
+        for i in range(md["field_count"])])
+
+    return fields, md["step"], md["t"]
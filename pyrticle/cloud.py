@@ -32,18 +32,39 @@ from pyrticle.meshdata import MeshData
 
 
 
+SPECIES_DTYPE = numpy.uint16
+MAX_SPECIES = 1 << 16
+
+
+
+
 class PicState(object):
+    """
+    Particles do not carry their own charge and mass. Instead, each
+    particle refers to a species in a short table of charges and masses,
+    see L{find_species}. A state may additionally give each particle a
+    weight, by which its species' charge and mass are multiplied.
+
+    C{capture_diagnostics} determines whether per-particle diagnostics
+    computed on this state are recorded, see
+    L{PicMethod.set_diagnostic_capture}. States derived by time stepping
+    inherit it.
+    """
+
     def __init__(self, method,
             particle_count=None,
             containing_elements=None,
             positions=None,
             momenta=None,
-            charges=None,
-            masses=None,
+            species=None,
+            weights=None,
+            species_table=None,
+            margin_cache=None,
             depositor_state=None,
             pusher_state=None,
             pnss=None,
             vis_listener=None,
+            capture_diagnostics=True,
             ):
         state_class = getattr(_internal, "ParticleState%s" %
             method.get_dimensionality_suffix())
@@ -64,15 +85,24 @@ class PicState(object):
             pstate.containing_elements = numpy.zeros((0,), dtype=numpy.uint32)
             pstate.positions = numpy.zeros((0, pstate.xdim), dtype=float)
             pstate.momenta = numpy.zeros((0, pstate.vdim), dtype=float)
-            pstate.charges = numpy.zeros((0,), dtype=float)
-            pstate.masses = numpy.zeros((0,), dtype=float)
+            pstate.species = numpy.zeros((0,), dtype=SPECIES_DTYPE)
+            pstate.weights = numpy.zeros((0,), dtype=float)
+            pstate.species_charges = numpy.zeros((0,), dtype=float)
+            pstate.species_masses = numpy.zeros((0,), dtype=float)
         else:
             pstate.particle_count = particle_count
             pstate.containing_elements = containing_elements
             pstate.positions = positions
             pstate.momenta = momenta
-            pstate.charges = charges
-            pstate.masses = masses
+            pstate.species = species
+            pstate.weights = weights
+            pstate.species_charges, pstate.species_masses = species_table
+
+        if margin_cache is None:
+            self.reset_margin_cache()
+        else:
+            (pstate.margin_elements, pstate.margin_centers,
+                    pstate.margins) = margin_cache
 
         self.derived_quantity_cache = {}
 
@@ -90,6 +120,7 @@ class PicState(object):
                     self.particle_number_shift_signaller)
         else:
             self.vis_listener = vis_listener
+        self.capture_diagnostics = capture_diagnostics
 
 
     def __len__(self):
@@ -103,13 +134,74 @@ class PicState(object):
     def momenta(self):
         return self.particle_state.momenta[:self.particle_state.particle_count]
 
+    @property
+    def species(self):
+        return self.particle_state.species[:self.particle_state.particle_count]
+
+    @property
+    def weights(self):
+        """The particle weights, or C{None} if the particles are
+        unweighted."""
+        pstate = self.particle_state
+        if not len(pstate.weights):
+            return None
+        return pstate.weights[:pstate.particle_count]
+
     @property
     def masses(self):
-        return self.particle_state.masses[:self.particle_state.particle_count]
+        result = self.particle_state.species_masses[self.species]
+        if self.weights is not None:
+            result *= self.weights
+        return result
 
     @property
     def charges(self):
-        return self.particle_state.charges[:self.particle_state.particle_count]
+        result = self.particle_state.species_charges[self.species]
+        if self.weights is not None:
+            result *= self.weights
+        return result
+
+    def find_species(self, charges, masses):
+        """Return the species numbers of particles with C{charges} and
+        C{masses} (of unit weight), adding species that are not yet in
+        the species table.
+        """
+        pstate = self.particle_state
+
+        keys, key_indices = numpy.unique(
+                numpy.asarray(charges, dtype=numpy.float64)
+                + 1j*numpy.asarray(masses, dtype=numpy.float64),
+                return_inverse=True)
+
+        table = dict((complex(q, m), i) for i, (q, m) in enumerate(
+            zip(pstate.species_charges, pstate.species_masses)))
+        species_count = len(table)
+
+        numbers = numpy.empty((len(keys),), dtype=SPECIES_DTYPE)
+        for i, key in enumerate(keys):
+            if key not in table:
+                table[key] = len(table)
+            numbers[i] = table[key]
+
+        if len(table) > species_count:
+            if len(table) > MAX_SPECIES:
+                raise ValueError, "too many species (%d), " \
+                        "use particle weights instead" % len(table)
+
+            new_keys = sorted(table, key=table.get)[species_count:]
+            pstate.species_charges = numpy.hstack((pstate.species_charges,
+                [key.real for key in new_keys]))
+            pstate.species_masses = numpy.hstack((pstate.species_masses,
+                [key.imag for key in new_keys]))
+
+        return numbers[key_indices]
+
+    def make_weighted(self):
+        """Start keeping particle weights, with the existing particles
+        given unit weight."""
+        pstate = self.particle_state
+        if not len(pstate.weights):
+            pstate.weights = numpy.ones((len(pstate.species),), dtype=float)
 
     def resize(self, newsize):
         pstate = self.particle_state
@@ -120,8 +212,27 @@ class PicState(object):
                 pstate.positions, (newsize, pstate.xdim))
         pstate.momenta = numpy.resize(
                 pstate.momenta, (newsize, pstate.vdim))
-        pstate.charges = numpy.resize(pstate.charges, (newsize,))
-        pstate.masses = numpy.resize(pstate.masses, (newsize,))
+        pstate.species = numpy.resize(pstate.species, (newsize,))
+        if len(pstate.weights):
+            pstate.weights = numpy.resize(pstate.weights, (newsize,))
+        self.reset_margin_cache()
+
+    def get_margin_cache(self):
+        pstate = self.particle_state
+        return pstate.margin_elements, pstate.margin_centers, pstate.margins
+
+    def reset_margin_cache(self):
+        """Empty the cache of balls known to lie inside the particles'
+        containing elements and size it to match the particle arrays.
+        See C{particle_base_state} in C{src/cpp/particle_state.hpp}.
+        """
+        pstate = self.particle_state
+        size = len(pstate.containing_elements)
+
+        pstate.margin_elements = numpy.empty((size,), dtype=numpy.uint32)
+        pstate.margin_elements.fill(MeshData.INVALID_ELEMENT)
+        pstate.margin_centers = numpy.zeros((size, pstate.xdim), dtype=float)
+        pstate.margins = numpy.zeros((size,), dtype=float)
 
     def clear(self):
         pstate = self.particle_state
@@ -156,6 +267,29 @@ class PicState(object):
 
 
 
+class ParticleVisSnapshot(object):
+    """The particle data written to a visualization file, taken from a
+    L{PicState}. Positions, momenta and velocities have the layout of the
+    particle state, i.e. shape C{(particle_count, dim)}.
+
+    C{particle_vis_vars} is a list of tuples C{(name, value)}, where
+    C{value} has shape C{(particle_count,)} for scalars and
+    C{(particle_count, dim)} for vectors.
+    """
+
+    def __init__(self, particle_count, positions, momenta, velocities,
+            charges, masses, particle_vis_vars):
+        self.particle_count = particle_count
+        self.positions = positions
+        self.momenta = momenta
+        self.velocities = velocities
+        self.charges = charges
+        self.masses = masses
+        self.particle_vis_vars = particle_vis_vars
+
+
+
+
 class TimesteppablePicState(object):
     def __init__(self, method, state):
         self.method = method
@@ -330,12 +464,22 @@ class PicMethod(object):
       - interactive: Allow debug measures that require user interaction.
       - vis_files: Allow debug measures that write extra visualization
         files.
+
+    @arg startup_timer: A L{pyrticle.log.StartupTimer} or C{None}. If given,
+      the construction of the mesh data and the initialization of depositor
+      and pusher are timed as separate phases.
+    @arg mesh_data_cache_dir: A directory in which the mesh-dependent part
+      of the mesh data is cached, or C{None}.
+      See L{pyrticle.meshdata.get_cached_mesh_arrays}.
+    @arg emitters: A list of L{pyrticle.emission.Emitter} instances that
+      inject particles in L{upkeep}.
     """
 
     def __init__(self, discr, units,
             depositor, pusher,
             dimensions_pos, dimensions_velocity,
-            debug=set()):
+            debug=set(), startup_timer=None, mesh_data_cache_dir=None,
+            emitters=[]):
 
         self.units = units
         self.discretization = discr
@@ -350,31 +494,58 @@ class PicMethod(object):
 
         dims = (dimensions_pos, dimensions_velocity)
 
+        if startup_timer is not None:
+            startup_timer.start("mesh_data")
         self.mesh_data = _internal.MeshData(discr.dimensions)
-        self.mesh_data.fill_from_hedge(discr)
+        self.mesh_data.fill_from_hedge(discr, mesh_data_cache_dir)
 
         # subsystem init
+        if startup_timer is not None:
+            startup_timer.start("depositor_init")
         self.depositor.initialize(self)
+        if startup_timer is not None:
+            startup_timer.start("pusher_init")
         self.pusher.initialize(self)
 
+        self.emitters = emitters[:]
+        if self.emitters and startup_timer is not None:
+            startup_timer.start("emitter_init")
+        for emitter in self.emitters:
+            emitter.initialize(self)
+
+        # set by note_logged_diagnostics
+        self.log_needs_diagnostics = False
+
         # instrumentation
         from pytools.log import IntervalTimer, EventCounter
 
         self.find_el_timer = IntervalTimer(
                 "t_find",
                 "Time spent finding new elements")
+        self.find_by_margin_counter = EventCounter(
+                "n_find_margin",
+                "#Particles known to be in same element by distance to faces")
         self.find_same_counter = EventCounter(
                 "n_find_same",
                 "#Particles found in same element")
         self.find_by_neighbor_counter = EventCounter(
                 "n_find_neighbor",
                 "#Particles found through neighbor")
+        self.find_by_walk_counter = EventCounter(
+                "n_find_walk",
+                "#Particles found by walking across several faces")
         self.find_by_vertex_counter = EventCounter(
                 "n_find_by_vertex",
                 "#Particles found by vertex")
         self.find_global_counter = EventCounter(
                 "n_find_global",
                 "#Particles found by global search")
+        self.emit_timer = IntervalTimer(
+                "t_emit",
+                "Time spent emitting particles")
+        self.emitted_counter = EventCounter(
+                "n_emitted",
+                "#Particles emitted")
 
 
     def make_state(self):
@@ -414,10 +585,14 @@ class PicMethod(object):
 
     def add_instrumentation(self, mgr, observer):
         mgr.add_quantity(self.find_el_timer)
+        mgr.add_quantity(self.find_by_margin_counter)
         mgr.add_quantity(self.find_same_counter)
         mgr.add_quantity(self.find_by_neighbor_counter)
+        mgr.add_quantity(self.find_by_walk_counter)
         mgr.add_quantity(self.find_by_vertex_counter)
         mgr.add_quantity(self.find_global_counter)
+        mgr.add_quantity(self.emit_timer)
+        mgr.add_quantity(self.emitted_counter)
 
         self.depositor.add_instrumentation(mgr, observer)
         self.pusher.add_instrumentation(mgr, observer)
@@ -454,6 +629,8 @@ class PicMethod(object):
             if pstate.particle_count+maxcount >= len(pstate.containing_elements):
                 state.resize(pstate.particle_count+maxcount)
 
+        species_cache = {}
+
         for pos, vel, charge, mass in iterable:
             if maxcount is not None:
                 if maxcount == 0:
@@ -479,8 +656,14 @@ class PicMethod(object):
             pstate.containing_elements[pstate.particle_count] = cont_el
             pstate.positions[pstate.particle_count] = pos
             pstate.momenta[pstate.particle_count] = mom
-            pstate.charges[pstate.particle_count] = charge
-            pstate.masses[pstate.particle_count] = mass
+            try:
+                species = species_cache[charge, mass]
+            except KeyError:
+                species = species_cache[charge, mass] = \
+                        state.find_species([charge], [mass])[0]
+            pstate.species[pstate.particle_count] = species
+            if len(pstate.weights):
+                pstate.weights[pstate.particle_count] = 1
 
             pstate.particle_count += 1
 
@@ -489,6 +672,109 @@ class PicMethod(object):
                 pstate.particle_count)
         state.derived_quantity_cache.clear()
 
+    def add_particle_arrays(self, state, positions, velocities, charges, masses,
+            containing_elements=None, weights=None):
+        """Add particles given as arrays to the cloud.
+
+        C{positions} and C{velocities} have one row per particle,
+        C{charges} and C{masses} are of shape C{(count,)} or C{(count, 1)}.
+        They are looked up in (or added to) the species table of C{state}.
+        If C{weights} are given, C{charges} and C{masses} are those of a
+        particle of unit weight, and the particles are scaled by their
+        weights. If the caller already knows the element each particle is
+        in, it may pass them as C{containing_elements}, and the element
+        search is skipped. Particles outside the mesh are dropped. Return the
+        number of particles added.
+        """
+
+        pstate = state.particle_state
+
+        positions = numpy.asarray(positions, dtype=numpy.float64)
+        velocities = numpy.asarray(velocities, dtype=numpy.float64)
+        charges = numpy.asarray(charges, dtype=numpy.float64).reshape(-1)
+        masses = numpy.asarray(masses, dtype=numpy.float64).reshape(-1)
+
+        if weights is not None:
+            weights = numpy.asarray(weights, dtype=numpy.float64).reshape(-1)
+            state.make_weighted()
+        elif len(pstate.weights):
+            weights = numpy.ones((len(positions),))
+
+        assert positions.shape[1] == self.dimensions_pos
+        assert velocities.shape[1] == self.dimensions_velocity
+
+        if containing_elements is None:
+            cont_els = self.mesh_data.find_containing_elements(positions)
+        else:
+            cont_els = numpy.asarray(containing_elements)
+        inside = cont_els != MeshData.INVALID_ELEMENT
+        if not inside.all():
+            print "%d particles not in valid element" % (
+                    len(inside)-numpy.sum(inside))
+
+            cont_els = cont_els[inside]
+            positions = positions[inside]
+            velocities = velocities[inside]
+            charges = charges[inside]
+            masses = masses[inside]
+            if weights is not None:
+                weights = weights[inside]
+
+        c = self.units.VACUUM_LIGHT_SPEED()
+        beta_squared = numpy.sum(velocities**2, axis=1)/c**2
+        if (beta_squared >= 1).any():
+            raise RuntimeError, "particle velocity >= speed of light"
+        gamma_masses = masses/numpy.sqrt(1-beta_squared)
+        if weights is not None:
+            gamma_masses *= weights
+        momenta = gamma_masses[:, numpy.newaxis] * velocities
+
+        species = state.find_species(charges, masses)
+
+        start = pstate.particle_count
+        end = start + len(positions)
+        if end > len(pstate.containing_elements):
+            state.resize(max(128, end, 2*start))
+
+        pstate.containing_elements[start:end] = cont_els
+        pstate.positions[start:end] = positions
+        pstate.momenta[start:end] = momenta
+        pstate.species[start:end] = species
+        if weights is not None:
+            pstate.weights[start:end] = weights
+
+        pstate.particle_count = end
+
+        state.particle_number_shift_signaller.note_change_size(end)
+        state.derived_quantity_cache.clear()
+
+        return end-start
+
+    def add_particle_chunks(self, state, chunks, maxcount=None):
+        """Add the particles from C{chunks} to the cloud.
+
+        C{chunks} is expected to yield tuples of arrays
+        C{(positions, velocities, charges, masses)}, as passed to
+        L{add_particle_arrays}. If C{maxcount} is specified, maximally
+        C{maxcount} particles are obtained from the chunks, and room for
+        them is made beforehand, so that the particle arrays are not
+        copied while they grow.
+        """
+
+        if maxcount is not None:
+            pstate = state.particle_state
+            if pstate.particle_count+maxcount > len(pstate.containing_elements):
+                state.resize(pstate.particle_count+maxcount)
+
+        for chunk in chunks:
+            if maxcount is not None:
+                if maxcount == 0:
+                    break
+                chunk = [component[:maxcount] for component in chunk]
+                maxcount -= len(chunk[0])
+
+            self.add_particle_arrays(state, *chunk)
+
     def check_containment(self, state):
         """Check that a containing element is known for each particle.
 
@@ -504,8 +790,24 @@ class PicMethod(object):
         """
         self.depositor.upkeep(state)
         self.pusher.upkeep(state)
+        self.emit_particles(state)
 
-        state.vis_listener.clear()
+    def emit_particles(self, state):
+        """Add the particles injected by each of the L{emitters} in this
+        time step to the cloud, all in one go.
+        """
+        if not self.emitters:
+            return
+
+        sub_timer = self.emit_timer.start_sub_timer()
+
+        chunks = [emitter.emit(state) for emitter in self.emitters]
+        chunks = [chunk for chunk in chunks if len(chunk[0])]
+        if chunks:
+            self.emitted_counter.add(self.add_particle_arrays(state,
+                *[numpy.concatenate(components) for components in zip(*chunks)]))
+
+        sub_timer.stop().submit()
 
 
 
@@ -547,6 +849,53 @@ class PicMethod(object):
 
         return state.get_derived_quantity_from_cache("rho", rho_getter)
 
+    def _get_particle_groups(self, state, groups, group_count):
+        if groups is None:
+            groups = state.species
+            if group_count is None:
+                group_count = len(state.particle_state.species_charges)
+        else:
+            groups = numpy.asarray(groups)
+            assert len(groups) >= len(state)
+            groups = groups[:len(state)]
+
+            if len(groups) and (groups.min() < 0 or groups.max() >= MAX_SPECIES):
+                raise ValueError, "group numbers must lie between 0 and %d" % (
+                        MAX_SPECIES-1)
+            if group_count is None:
+                group_count = int(groups.max())+1 if len(groups) else 0
+            groups = numpy.asarray(groups, dtype=SPECIES_DTYPE)
+
+        return groups, group_count
+
+    def deposit_grouped_densities(self, state, groups=None, group_count=None):
+        """Return a tuple C{(rho, j)} with the charge and current densities
+        of each group of particles, obtained in a single deposition.
+        C{rho} has shape C{(group_count, n)} and C{j} has shape
+        C{(group_count, d, n)}, see L{deposit_densities}.
+
+        C{groups} gives each particle's group number and defaults to
+        the particle species (see L{PicState.find_species}).
+        C{group_count} defaults to the number of species or the largest
+        group number plus one. Particles in groups beyond C{group_count}
+        are left out.
+        """
+        groups, group_count = self._get_particle_groups(
+                state, groups, group_count)
+        rho, j = self.depositor.deposit_grouped_densities(
+                state, self.velocities(state), groups, group_count)
+        return rho, numpy.asarray(j.transpose(0, 2, 1), order="C")
+
+    def deposit_grouped_rho(self, state, groups=None, group_count=None):
+        """Return the charge density of each group of particles as an
+        array of shape C{(group_count, n)}, see
+        L{deposit_grouped_densities}.
+        """
+        groups, group_count = self._get_particle_groups(
+                state, groups, group_count)
+        return self.depositor.deposit_grouped_rho(
+                state, groups, group_count)
+
 
 
 
@@ -566,13 +915,16 @@ class PicMethod(object):
                 containing_elements=pstate.containing_elements,
                 positions=positions,
                 momenta=momenta,
-                charges=pstate.charges,
-                masses=pstate.masses,
+                species=pstate.species,
+                weights=pstate.weights,
+                species_table=(pstate.species_charges, pstate.species_masses),
+                margin_cache=state.get_margin_cache(),
                 depositor_state=self.depositor.advance_state(
                     state, ddep),
                 pusher_state=self.pusher.advance_state(state),
                 pnss=state.particle_number_shift_signaller,
                 vis_listener=state.vis_listener,
+                capture_diagnostics=state.capture_diagnostics,
                 )
 
         from pyrticle._internal import FindEventCounters
@@ -591,10 +943,14 @@ class PicMethod(object):
                 BHitListener(), find_counters)
         sub_timer.stop().submit()
 
+        self.find_by_margin_counter.transfer(
+                find_counters.find_by_margin)
         self.find_same_counter.transfer(
                 find_counters.find_same)
         self.find_by_neighbor_counter.transfer(
                 find_counters.find_by_neighbor)
+        self.find_by_walk_counter.transfer(
+                find_counters.find_by_walk)
         self.find_by_vertex_counter.transfer(
                 find_counters.find_by_vertex)
         self.find_global_counter.transfer(
@@ -603,20 +959,118 @@ class PicMethod(object):
         return new_state
 
     # visualization -----------------------------------------------------------
+    def set_diagnostic_capture(self, state, enabled):
+        """Turn on or off the capture of per-particle diagnostics, such as
+        the fields and forces at the particles recorded by the pusher,
+        for C{state} and the states advanced from it.
+
+        These are stored in C{state.vis_listener} and cost several
+        particle-sized vectors per force evaluation, so a time loop should
+        only enable them for steps whose results are visualized or logged,
+        see L{note_logged_diagnostics}. Turning capture off discards
+        previously captured data.
+        """
+        state.capture_diagnostics = enabled
+        if not enabled:
+            state.vis_listener.clear()
+
+    def note_logged_diagnostics(self):
+        """Record that a log quantity reading captured diagnostics has
+        been added, so that a time loop needs to capture them on every
+        logged step. Called from the C{add_instrumentation} methods.
+        """
+        self.log_needs_diagnostics = True
+
+    def get_vis_listener(self, state):
+        """Return the visualization listener that diagnostics computed on
+        C{state} should be stored in, or C{None} if capture is turned off
+        by L{set_diagnostic_capture}.
+        """
+        if state.capture_diagnostics:
+            return state.vis_listener
+        else:
+            return None
+
     def get_mesh_vis_vars(self):
         return self.vis_listener.mesh_vis_map.items()
 
     def add_to_vis(self, visualizer, vis_file, state, time=None, step=None, beamaxis=None,
             vis_listener=None):
+        return self.write_vis_snapshot(visualizer, vis_file,
+                self.make_vis_snapshot(state, vis_listener, copy=False),
+                time, step, beamaxis)
+
+    def make_vis_snapshot(self, state, vis_listener=None, copy=True):
+        """Gather the particle data visualized by L{add_to_vis} from C{state}.
+
+        If C{copy} is true, the returned L{ParticleVisSnapshot} shares no
+        storage with C{state} and may be passed to L{write_vis_snapshot}
+        while the simulation proceeds, e.g. from a background thread.
+        Otherwise, it refers to the particle state's arrays.
+        """
+        pcount = len(state)
+
+        if copy:
+            get_array = numpy.array
+        else:
+            get_array = numpy.asarray
+
+        particle_vis_vars = []
+        if pcount and vis_listener is not None:
+            from pyrticle.tools import NumberShiftableVector
+            for name, value in vis_listener.particle_vis_map.iteritems():
+                value = NumberShiftableVector.unwrap(value)
+                dim, remainder = divmod(len(value), pcount)
+                assert remainder == 0, (
+                        "particle vis value '%s' had invalid number of entries: "
+                        "%d (#particles=%d)" % (name, len(value), pcount))
+                if dim == 1:
+                    particle_vis_vars.append((name, get_array(value)))
+                else:
+                    particle_vis_vars.append((name,
+                        get_array(value).reshape(pcount, dim)))
+
+        return ParticleVisSnapshot(
+                particle_count=pcount,
+                positions=get_array(state.positions),
+                momenta=get_array(state.momenta),
+                velocities=get_array(self.velocities(state)),
+                charges=get_array(state.charges),
+                masses=get_array(state.masses),
+                particle_vis_vars=particle_vis_vars)
+
+    def write_vis_snapshot(self, visualizer, vis_file, snapshot,
+            time=None, step=None, beamaxis=None):
+        """Write C{snapshot}, as obtained from L{make_vis_snapshot}, to
+        C{vis_file}. Does not access the particle state.
+        """
         from hedge.visualization import VtkVisualizer, SiloVisualizer
         if isinstance(visualizer, VtkVisualizer):
-            return self._add_to_vtk(visualizer, vis_file, state, time, step)
+            return self._add_to_vtk(visualizer, vis_file, snapshot, time, step)
         elif isinstance(visualizer, SiloVisualizer):
-            return self._add_to_silo(visualizer, vis_file, state, time, step, beamaxis, vis_listener)
+            return self._add_to_silo(visualizer, vis_file, snapshot, time, step, beamaxis)
         else:
             raise ValueError, "unknown visualizer type `%s'" % type(visualizer)
 
-    def _add_to_silo(self, visualizer, db, state, time, step, beamaxis, vis_listener=None):
+    def _add_to_vtk(self, visualizer, vis_file, snapshot, time, step):
+        """Write the particles to a separate VTK XML file next to
+        C{vis_file}, named like it with C{-particles} appended.
+        """
+        from os.path import splitext
+        from pyrticle.vtk_output import write_particle_vtu
+
+        point_data = [
+                ("charge", snapshot.charges),
+                ("mass", snapshot.masses),
+                ("momentum", snapshot.momenta),
+                ("velocity", snapshot.velocities),
+                ] + snapshot.particle_vis_vars
+
+        write_particle_vtu(
+                splitext(vis_file.pathname)[0] + "-particles.vtu",
+                snapshot.positions, point_data, time, step)
+
+    def _add_to_silo(self, visualizer, db, snapshot, time, step, beamaxis):
         from pylo import DBOPT_DTIME, DBOPT_CYCLE
         optlist = {}
         if time is not None:
@@ -624,31 +1078,23 @@ class PicMethod(object):
         if step is not None:
             optlist[DBOPT_CYCLE] = step
 
-        pcount = len(state)
-
-        if pcount:
+        if snapshot.particle_count:
             # real-space ------------------------------------------------------
             db.put_pointmesh("particles",
-                    numpy.asarray(state.positions.T, order="C"), optlist)
-            db.put_pointvar1("charge", "particles", state.charges)
-            db.put_pointvar1("mass", "particles", state.masses)
+                    numpy.asarray(snapshot.positions.T, order="C"), optlist)
+            db.put_pointvar1("charge", "particles", snapshot.charges)
+            db.put_pointvar1("mass", "particles", snapshot.masses)
             db.put_pointvar("momentum", "particles",
-                    numpy.asarray(state.momenta.T, order="C"))
+                    numpy.asarray(snapshot.momenta.T, order="C"))
             db.put_pointvar("velocity", "particles",
-                    numpy.asarray(self.velocities(state).T, order="C"))
-
-            if vis_listener is not None:
-                for name, value in self.vis_listener.particle_vis_map.iteritems():
-                    from pyrticle.tools import NumberShiftableVector
-                    value = NumberShiftableVector.unwrap(value)
-                    dim, remainder = divmod(len(value), pcount)
-                    assert remainder == 0, (
-                            "particle vis value '%s' had invalid number of entries: "
-                            "%d (#particles=%d)" % (name, len(value), pcount))
-                    if dim == 1:
-                        db.put_pointvar1(name, "particles", value)
-                    else:
-                        db.put_pointvar(name, "particles", [value[i::dim] for i in range(dim)])
+                    numpy.asarray(snapshot.velocities.T, order="C"))
+
+            for name, value in snapshot.particle_vis_vars:
+                if len(value.shape) == 1:
+                    db.put_pointvar1(name, "particles", value)
+                else:
+                    db.put_pointvar(name, "particles",
+                            [value[:, i] for i in range(value.shape[1])])
 
             # phase-space -----------------------------------------------------
             axes_names = ["x", "y", "z"]
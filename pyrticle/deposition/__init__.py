@@ -114,6 +114,23 @@ class Depositor(object):
             len(self.method.discretization),
             pslice)
 
+    def _deposit_grouped_densities(self, state, velocities,
+            groups, group_count, pslice):
+        return _internal.deposit_grouped_densities(
+                self.backend,
+                state.depositor_state,
+                state.particle_state,
+                len(self.method.discretization),
+                velocities, groups, group_count, pslice)
+
+    def _deposit_grouped_rho(self, state, groups, group_count, pslice):
+        return _internal.deposit_grouped_rho(
+                self.backend,
+                state.depositor_state,
+                state.particle_state,
+                len(self.method.discretization),
+                groups, group_count, pslice)
+
     def deposit_densites(self, state, velocities):
         self.deposit_hook()
         rho, j =  self._deposit_densities(state, velocities, slice(None))
@@ -133,9 +150,53 @@ class Depositor(object):
 
         return rho
 
+    def deposit_grouped_densities(self, state, velocities, groups, group_count):
+        """Return a tuple C{(rho, j)} of arrays of shape C{(group_count, n)}
+        and C{(group_count, n, d)} holding the charge and current density
+        of each group of particles, deposited in one pass.
+
+        C{groups} holds the group number of each particle. Particles whose
+        group number is C{group_count} or more are not deposited.
+        """
+        self.deposit_hook()
+        return self._deposit_grouped_densities(state, velocities,
+                groups, group_count, slice(None))
+
+    def deposit_grouped_rho(self, state, groups, group_count):
+        """Return an array of shape C{(group_count, n)} holding the charge
+        density of each group of particles, see
+        L{deposit_grouped_densities}.
+        """
+        self.deposit_hook()
+        return self._deposit_grouped_rho(state,
+                groups, group_count, slice(None))
+
     def upkeep(self, state):
         pass
 
+    def tune(self, state):
+        """Called once before time stepping starts, when the particles and
+        the shape function are in place, to let the depositor pick
+        settings that suit them.
+        """
+        pass
+
+    # checkpointing -----------------------------------------------------------
+    def get_checkpoint_data(self, state):
+        """Return a dictionary mapping names to numpy arrays that, together
+        with the particle state and the shape function, suffice to restore
+        C{state.depositor_state}.
+        """
+        return {}
+
+    def set_checkpoint_data(self, state, data):
+        """Restore C{state.depositor_state} from C{data}, as obtained from
+        L{get_checkpoint_data}. The shape function has already been set
+        when this is called.
+        """
+        pass
+
+    # time advance ------------------------------------------------------------
     def rhs(self, state):
         return 0
 
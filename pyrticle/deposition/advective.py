@@ -181,6 +181,26 @@ class AdvectiveDepositor(Depositor):
                 state.depositor_state,
                 state.particle_state)
 
+    _checkpoint_fields = ["element_starts", "element_numbers",
+            "start_indices", "min_lives", "connections", "freelist", "rho"]
+
+    def get_checkpoint_data(self, state):
+        cd = self.backend.get_checkpoint_data(state.depositor_state)
+        result = dict((name, getattr(cd, name))
+                for name in self._checkpoint_fields)
+        result["active_elements"] = numpy.array(
+                [cd.active_elements], dtype=numpy.uint32)
+        return result
+
+    def set_checkpoint_data(self, state, data):
+        cd = self.backend.CheckpointData()
+        for name in self._checkpoint_fields:
+            setattr(cd, name, numpy.array(data[name]))
+        cd.active_elements = int(data["active_elements"][0])
+
+        self.backend.set_checkpoint_data(
+                state.depositor_state, self.shape_function, cd)
+
     def rhs(self, state):
         from pyrticle.tools import NumberShiftableVector
         sub_timer = self.advective_rhs_timer.start_sub_timer()
@@ -816,6 +816,23 @@ class GridDepositor(Depositor, GridVisualizer):
         return self.remap_grid_to_mesh(
                 self.deposit_grid_rho(state, pslice))
 
+    def _deposit_grouped_densities(self, state, velocities,
+            groups, group_count, pslice):
+        grid_rhos, grid_js = self.backend.deposit_grouped_grid_densities(
+                state.depositor_state, state.particle_state,
+                velocities, groups, group_count, pslice)
+
+        return tuple(
+                numpy.array([self.remap_grid_to_mesh(q_grid)
+                    for q_grid in grid_qs])
+                for grid_qs in [grid_rhos, grid_js])
+
+    def _deposit_grouped_rho(self, state, groups, group_count, pslice):
+        return numpy.array([self.remap_grid_to_mesh(grid_rho)
+            for grid_rho in self.backend.deposit_grouped_grid_rho(
+                state.depositor_state, state.particle_state,
+                groups, group_count, pslice)])
+
     # deposition onto grid ------------------------------------------------
     def deposit_grid_densities(self, state, velocities, pslice=slice(None)):
         self.deposit_hook()
@@ -149,3 +149,16 @@ class GridFindDepositor(Depositor, GridVisualizer):
             state.particle_state,
             pslice)
 
+    def _deposit_grouped_densities(self, state, velocities,
+            groups, group_count, pslice):
+        return self.backend.deposit_grouped_densities(
+                state.depositor_state,
+                state.particle_state,
+                velocities, groups, group_count, pslice)
+
+    def _deposit_grouped_rho(self, state, groups, group_count, pslice):
+        return self.backend.deposit_grouped_rho(
+                state.depositor_state,
+                state.particle_state,
+                groups, group_count, pslice)
+
@@ -28,15 +28,105 @@ import pyrticle._internal as _internal
 
 
 
-class ShapeFunctionDepositor(Depositor):
-    name = "Shape"
+ELEMENT_FINDERS = ["heuristic", "face_based", "hyperplane"]
+
+
+
+
+class ElementFindingDepositor(Depositor):
+    """Base for depositors that search outward from a particle's containing
+    element for the elements covered by its shape function.
+
+    C{element_finder} is one of L{ELEMENT_FINDERS} or C{"autotune"}. In the
+    latter case, L{tune} deposits a sample of the actual particle cloud with
+    each finder and keeps the fastest one whose charge density agrees with
+    that of C{"face_based"} to a relative tolerance of C{autotune_rtol}.
+    """
+
+    def __init__(self, element_finder="face_based", 
+            autotune_sample=5000, autotune_rtol=1e-8):
+        Depositor.__init__(self)
+
+        if element_finder != "autotune" and element_finder not in ELEMENT_FINDERS:
+            raise ValueError, "invalid element finder '%s'" % element_finder
+
+        self.element_finder = element_finder
+        self.autotune_sample = autotune_sample
+        self.autotune_rtol = autotune_rtol
+        self.finder_timings = {}
 
     def initialize(self, method):
         Depositor.initialize(self, method)
 
+        self.backend = self.make_backend(method)
+
+        if self.element_finder == "autotune":
+            self.set_element_finder("face_based")
+        else:
+            self.set_element_finder(self.element_finder)
+
+    def make_backend(self, method):
+        raise NotImplementedError
+
+    def set_element_finder(self, name):
+        self.backend.element_finder = getattr(_internal.ElementFinder, name)
+        self.log_constants["element_finder"] = name
+
+    def tune(self, state, repeats=3):
+        if self.element_finder != "autotune" or len(state) == 0:
+            return
+
+        from numpy.linalg import norm
+        from time import time
+
+        # a strided sample sees the whole extent of the cloud
+        sample = slice(0, len(state), 
+                max(1, len(state) // self.autotune_sample))
+
+        def deposit_sample():
+            return _internal.deposit_rho(
+                    self.backend,
+                    self.make_state(state),
+                    state.particle_state,
+                    len(self.method.discretization),
+                    sample)
+
+        self.deposit_hook()
+
+        reference_rho = None
+        self.finder_timings = {}
+
+        for name in ["face_based"] + [
+                fname for fname in ELEMENT_FINDERS if fname != "face_based"]:
+            self.backend.element_finder = getattr(_internal.ElementFinder, name)
+
+            times = []
+            for i in range(repeats):
+                start = time()
+                rho = deposit_sample()
+                times.append(time()-start)
+
+            if reference_rho is None:
+                reference_rho = rho
+            elif norm(rho-reference_rho) > self.autotune_rtol*norm(reference_rho):
+                # misses part of some footprints
+                continue
+
+            self.finder_timings[name] = min(times)
+
+        self.set_element_finder(
+                min(self.finder_timings, key=self.finder_timings.get))
+
+
+
+
+class ShapeFunctionDepositor(ElementFindingDepositor):
+    name = "Shape"
+
+    def make_backend(self, method):
         backend_class = getattr(_internal, "InterpolatingDepositor" 
                 + method.get_dimensionality_suffix())
-        self.backend = backend_class(method.mesh_data)
+        return backend_class(method.mesh_data)
 
     def make_state(self, state):
         return self.backend.DepositorState()
@@ -55,21 +145,19 @@ class ShapeFunctionDepositor(Depositor):
 
 
 
-class NormalizedShapeFunctionDepositor(Depositor):
+class NormalizedShapeFunctionDepositor(ElementFindingDepositor):
     name = "NormShape"
 
-    def initialize(self, method):
-        Depositor.initialize(self, method)
-
+    def make_backend(self, method):
         eg, = method.discretization.element_groups
         ldis = eg.local_discretization
 
         backend_class = getattr(_internal, "NormalizingInterpolatingDepositor" 
                 + method.get_dimensionality_suffix())
-        self.backend = backend_class(method.mesh_data, ldis.mass_matrix())
+        return backend_class(method.mesh_data, ldis.mass_matrix())
 
     def add_instrumentation(self, mgr, observer):
-        Depositor.add_instrumentation(self, mgr, observer)
+        ElementFindingDepositor.add_instrumentation(self, mgr, observer)
 
         from pyrticle.log import StatsGathererLogQuantity
         mgr.add_quantity(StatsGathererLogQuantity(
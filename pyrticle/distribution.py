@@ -45,8 +45,28 @@ class ParticleDistribution(object):
         return (0,0,0,0)
 
     def make_particle(self):
-        return ([],[],[],[])
-        
+        """Return a single particle as a 4-tuple of lists
+        C{(position, velocity, charge, mass)}.
+
+        Subclasses override this or L{make_particles} (or both).
+        """
+        return tuple(list(component[0]) 
+                for component in self.make_particles(1))
+
+    def make_particles(self, count, rng=None):
+        """Return C{count} particles as a 4-tuple of arrays
+        C{(positions, velocities, charges, masses)}, each of shape
+        C{(count, axis_count)} with the axis counts from L{count_axes}.
+
+        C{rng} is a seed or a C{numpy.random.RandomState}, see
+        L{pyrticle.tools.make_random_state}.
+        """
+        particles = [self.make_particle() for i in xrange(count)]
+        return tuple(
+                numpy.array([p[component] for p in particles], 
+                    dtype=numpy.float64).reshape(count, axis_count)
+                for component, axis_count in enumerate(self.count_axes()))
+
     def mean(self):
         return ([],[],[],[])
 
@@ -67,10 +87,36 @@ class ParticleDistribution(object):
 
         return rho_norm_1 * total_charge
 
-    def generate_particles(self):
+    def generate_particle_chunks(self, seed=None, chunk_size=10000):
+        """Yield an endless sequence of particle arrays as returned by
+        L{make_particles}, C{chunk_size} particles at a time.
+        """
+        from pyrticle.tools import make_random_state
+        rng = make_random_state(seed)
+
         while True:
-            pos, vel, charge, mass = self.make_particle()
-            yield pos, vel, charge[0], mass[0]
+            yield self.make_particles(chunk_size, rng)
+
+    def generate_particles(self, seed=None, chunk_size=10000):
+        """Yield the particles from L{generate_particle_chunks} one by one,
+        as tuples C{(position, velocity, charge, mass)}.
+        """
+        for positions, velocities, charges, masses in \
+                self.generate_particle_chunks(seed, chunk_size):
+            for i in xrange(len(positions)):
+                yield positions[i], velocities[i], charges[i,0], masses[i,0]
+
+
+
+
+def _constant_particles(count, *components):
+    """Return a 4-tuple of C{(count, len(component))} arrays repeating
+    each of the lists C{components}.
+    """
+    return tuple(
+            numpy.tile(numpy.array(component, dtype=numpy.float64), (count, 1))
+            .reshape(count, len(component))
+            for component in components)
 
 
 
@@ -89,17 +135,16 @@ class JointParticleDistribution(ParticleDistribution):
 
         return reduce(add_tuples, (d.count_axes() for d in self.distributions))
 
-    def make_particle(self):
-        def catlists(lists):
-            result = []
-            for l in lists:
-                result.extend(l)
-            return result
+    def make_particles(self, count, rng=None):
+        from pyrticle.tools import make_random_state
+        rng = make_random_state(rng)
 
-        dist_to_part = dict((d, d.make_particle()) for d in self.distributions)
+        dist_to_part = dict((d, d.make_particles(count, rng)) 
+                for d in self.distributions)
         return tuple(
-                catlists(dist_to_part[d][component] 
-                    for d in self.contributors[component])
+                numpy.hstack([numpy.zeros((count, 0))] + [
+                    dist_to_part[d][component] 
+                    for d in self.contributors[component]])
                 for component in range(4))
 
     def mean(self):
@@ -136,6 +181,176 @@ class JointParticleDistribution(ParticleDistribution):
 
 
 
+# quiet start -----------------------------------------------------------------
+class QuietStart(ParticleDistribution):
+    """Draws the particles of C{distribution} from a scrambled Halton
+    sequence instead of pseudo-random numbers.
+
+    The low-discrepancy points pass through the same transforms (KV,
+    Gaussian, uniform) as random numbers would, but fill phase space far
+    more evenly, which reduces the noise in the deposited densities for a
+    given particle count. If C{mirror} is set, particles are loaded in
+    pairs placed symmetrically in phase space (see
+    L{pyrticle.tools.QuasiRandomDraws}).
+    """
+
+    def __init__(self, distribution, mirror=True):
+        self.distribution = distribution
+        self.mirror = mirror
+
+    def count_axes(self):
+        return self.distribution.count_axes()
+
+    def mean(self):
+        return self.distribution.mean()
+
+    def get_rho_distrib(self):
+        return self.distribution.get_rho_distrib()
+
+    def _make_particles(self, sequence, start, count):
+        from pyrticle.tools import QuasiRandomDraws
+        return self.distribution.make_particles(count, 
+                QuasiRandomDraws(sequence, start, count, self.mirror))
+
+    def make_particles(self, count, rng=None):
+        """Return the particles for the first C{count} points of a
+        sequence scrambled by C{rng}.
+        """
+        from pyrticle.tools import HaltonSequence
+        # the point with index 0 lies on the boundary of the unit cube
+        return self._make_particles(HaltonSequence(rng), 1, count)
+
+    def generate_particle_chunks(self, seed=None, chunk_size=10000):
+        from pyrticle.tools import HaltonSequence
+        sequence = HaltonSequence(seed)
+
+        start = 1
+        while True:
+            yield self._make_particles(sequence, start, chunk_size)
+
+            if self.mirror:
+                start += (chunk_size+1)//2
+            else:
+                start += chunk_size
+
+
+
+
+# imported particles ----------------------------------------------------------
+def make_particle_record_dtype(dimensions_pos, dimensions_velocity, 
+        float_type="<f8"):
+    """Return the record type of the particle files read by
+    L{ParticleFile}, with fields C{position}, C{velocity}, C{charge} and
+    C{mass} stored as C{float_type}.
+    """
+    return numpy.dtype([
+        ("position", float_type, (dimensions_pos,)),
+        ("velocity", float_type, (dimensions_velocity,)),
+        ("charge", float_type),
+        ("mass", float_type),
+        ])
+
+
+
+
+def write_particle_file(filename, positions, velocities, charges, masses):
+    """Write particles to a C{.npy} file readable by L{ParticleFile}."""
+    positions = numpy.asarray(positions)
+    velocities = numpy.asarray(velocities)
+
+    records = numpy.empty((len(positions),), dtype=make_particle_record_dtype(
+        positions.shape[1], velocities.shape[1]))
+    records["position"] = positions
+    records["velocity"] = velocities
+    records["charge"] = numpy.asarray(charges).reshape(-1)
+    records["mass"] = numpy.asarray(masses).reshape(-1)
+
+    numpy.save(filename, records)
+
+
+
+
+class ParticleFile(ParticleDistribution):
+    """Particles read from a file, e.g. one exported by another code.
+
+    The file holds one record per particle, with the fields of
+    L{make_particle_record_dtype}, in SI units. If C{dtype} is C{None}, it
+    is a C{.npy} file as written by L{write_particle_file}. Otherwise it is
+    a raw binary file of records of type C{dtype}, following C{offset}
+    bytes of header.
+
+    The file is memory-mapped and handed out in chunks by
+    L{generate_particle_chunks}, so only one chunk at a time is held in
+    memory in addition to the particle cloud. Unlike the other
+    distributions, this one is finite: set C{nparticles} to at most
+    C{len(ParticleFile(...))}.
+    """
+
+    def __init__(self, filename, dtype=None, offset=0):
+        self.filename = filename
+        self.dtype = dtype
+        self.offset = offset
+
+    @property
+    def records(self):
+        try:
+            return self._records
+        except AttributeError:
+            if self.dtype is None:
+                self._records = numpy.load(self.filename, mmap_mode="r")
+            else:
+                self._records = numpy.memmap(self.filename, 
+                        dtype=self.dtype, mode="r", offset=self.offset)
+
+            missing = set(["position", "velocity", "charge", "mass"]) \
+                    - set(self._records.dtype.names or [])
+            if missing:
+                raise ValueError("particle file '%s' lacks the fields %s" % (
+                    self.filename, ", ".join(sorted(missing))))
+
+            return self._records
+
+    def __len__(self):
+        return len(self.records)
+
+    def count_axes(self):
+        fields = self.records.dtype.fields
+        return (fields["position"][0].shape[0], 
+                fields["velocity"][0].shape[0], 1, 1)
+
+    def _get_arrays(self, start, end):
+        chunk = self.records[start:end]
+        count = len(chunk)
+        return tuple(
+                numpy.array(chunk[name], dtype=numpy.float64).reshape(count, -1)
+                for name in ["position", "velocity", "charge", "mass"])
+
+    def make_particles(self, count, rng=None):
+        """Return the first C{count} particles of the file."""
+        if count > len(self):
+            raise ValueError("particle file '%s' holds only %d particles" % (
+                self.filename, len(self)))
+        return self._get_arrays(0, count)
+
+    def generate_particle_chunks(self, seed=None, chunk_size=100000):
+        for start in xrange(0, len(self), chunk_size):
+            yield self._get_arrays(start, start+chunk_size)
+
+    def mean(self):
+        try:
+            return self._mean
+        except AttributeError:
+            sums = [0, 0, 0, 0]
+            for chunk in self.generate_particle_chunks():
+                sums = [s+numpy.sum(component, axis=0)
+                        for s, component in zip(sums, chunk)]
+
+            self._mean = tuple(list(s/len(self)) for s in sums)
+            return self._mean
+
+
+
+
 # delta distributions ---------------------------------------------------------
 class DeltaVelocity(ParticleDistribution):
     def __init__(self, velocity):
@@ -144,9 +359,11 @@ class DeltaVelocity(ParticleDistribution):
     def count_axes(self):
         return (0, len(self.velocity), 0, 0)
 
-    def make_particle(self):
+    def make_particles(self, count, rng=None):
+        return _constant_particles(count, [], self.velocity, [], [])
+
+    def mean(self):
         return ([], self.velocity, [], [])
-    mean = make_particle
         
 
 
@@ -159,9 +376,11 @@ class DeltaCharge(ParticleDistribution):
     def count_axes(self):
         return (0, 0, 1, 0)
 
-    def make_particle(self):
+    def make_particles(self, count, rng=None):
+        return _constant_particles(count, [], [], [self.particle_charge], [])
+
+    def mean(self):
         return ([], [], [self.particle_charge], [])
-    mean = make_particle
 
 
 
@@ -172,9 +391,11 @@ class DeltaMass(ParticleDistribution):
     def count_axes(self):
         return (0, 0, 0, 1)
 
-    def make_particle(self):
+    def make_particles(self, count, rng=None):
+        return _constant_particles(count, [], [], [], [self.particle_mass])
+
+    def mean(self):
         return ([], [], [], [self.particle_mass])
-    mean = make_particle
 
 
 
@@ -186,9 +407,12 @@ class DeltaChargeMass(ParticleDistribution):
     def count_axes(self):
         return (0, 0, 1, 1)
 
-    def make_particle(self):
+    def make_particles(self, count, rng=None):
+        return _constant_particles(count, [], [], 
+                [self.particle_charge], [self.particle_mass])
+
+    def mean(self):
         return ([], [], [self.particle_charge], [self.particle_mass])
-    mean = make_particle
 
 
 
@@ -203,9 +427,14 @@ class UniformPos(ParticleDistribution):
     def count_axes(self):
         return (len(self.lower), 0, 0, 0)
 
-    def make_particle(self, count=None):
-        from random import uniform
-        return [[uniform(l, h) for l, h in self.zipped], [], [], []]
+    def make_particles(self, count, rng=None):
+        from pyrticle.tools import make_random_state
+        rng = make_random_state(rng)
+
+        lower = numpy.array(self.lower, dtype=numpy.float64)
+        upper = numpy.array(self.upper, dtype=numpy.float64)
+        return (lower + (upper-lower)*rng.random_sample((count, len(lower))),
+                ) + _constant_particles(count, [], [], [])
 
     def mean(self):
         return [[(l+h)/2 for l, h in self.zipped], [], [], []]
@@ -263,35 +492,33 @@ class KV(ParticleDistribution):
                 len(self.emittances)+next_axes[1],
                 ) + next_axes[2:]
 
-    def make_particle(self):
-        """Return (position, velocity) for a random particle
+    def make_particles(self, count, rng=None):
+        """Return positions and velocities of C{count} random particles
         according to a Kapchinskij-Vladimirskij distribution.
         """
-        from pyrticle.tools import uniform_on_unit_sphere
+        from pyrticle.tools import make_random_state, uniform_on_unit_sphere
+        rng = make_random_state(rng)
 
-        s = uniform_on_unit_sphere(len(self.radii) + len(self.emittances))
-        x = [x_i*r_i for x_i, r_i in zip(s[:len(self.radii)], self.radii)] \
-        # xp like xprime
-        xp = [s_i/r_i*eps_i 
-                for s_i, r_i, eps_i in 
-                zip(s[len(self.radii):], self.radii, self.emittances)]
+        radii = numpy.array(self.radii, dtype=numpy.float64)
+        emittances = numpy.array(self.emittances, dtype=numpy.float64)
 
-        one = sum(x_i**2/r_i**2 for x_i, r_i in zip(x, self.radii)) + \
-                sum(xp_i**2*r_i**2/eps_i**2 
-                for xp_i, r_i, epsi in zip(xp, self.radii, self.emittances))
-        assert abs(one-1) < 1e-15
+        s = uniform_on_unit_sphere(len(radii) + len(emittances), count, rng)
+        x = s[:, :len(radii)]*radii
+        # xp like xprime
+        xp = s[:, len(radii):]/radii*emittances
 
-        z, vz, charge, mass = self.next.make_particle()
+        z, vz, charge, mass = self.next.make_particles(count, rng)
 
-        norm_vz = la.norm(vz)
-        pos = [xi+ci for xi, ci in zip(x, self.center)]
-        vel = [xp_i*norm_vz for xp_i in xp]
+        norm_vz = numpy.sqrt(numpy.sum(vz**2, axis=1))[:, numpy.newaxis]
+        pos = x + numpy.asarray(self.center, dtype=numpy.float64)
+        vel = xp*norm_vz
 
-        # caution: these pluses are list extensions, not vector additions
         if self.axis_first:
-            return (z + pos, vz + vel, charge, mass)
+            return (numpy.hstack((z, pos)), numpy.hstack((vz, vel)), 
+                    charge, mass)
         else:
-            return (pos + z, vel + vz, charge, mass)
+            return (numpy.hstack((pos, z)), numpy.hstack((vel, vz)), 
+                    charge, mass)
 
     def mean(self):
         next_mean = self.next.mean()
@@ -478,10 +705,14 @@ class GaussianPos(ParticleDistribution):
     def count_axes(self):
         return (len(self.mean_x), 0, 0, 0)
 
-    def make_particle(self):
-        from random import gauss
-        return ([gauss(m, s) for m, s in zip(self.mean_x, self.sigma_x)],
-                [],[],[])
+    def make_particles(self, count, rng=None):
+        from pyrticle.tools import make_random_state
+        rng = make_random_state(rng)
+
+        return (numpy.asarray(self.mean_x, dtype=numpy.float64)
+                + numpy.asarray(self.sigma_x, dtype=numpy.float64)
+                * rng.standard_normal((count, len(self.mean_x))),
+                ) + _constant_particles(count, [], [], [])
 
     def mean(self):
         return (self.mean_x, [],[],[])
@@ -520,14 +751,22 @@ class GaussianMomentum(ParticleDistribution):
                 len(self.mean_p)+next_axes[1],
                 ) + next_axes[2:]
 
-    def make_particle(self):
-        x, v, q, m = self.next.make_particle()
+    def make_particles(self, count, rng=None):
+        from pyrticle.tools import make_random_state
+        rng = make_random_state(rng)
+
+        x, v, q, m = self.next.make_particles(count, rng)
+
+        p = (numpy.asarray(self.mean_p, dtype=numpy.float64)
+                + numpy.asarray(self.sigma_p, dtype=numpy.float64)
+                * rng.standard_normal((count, len(self.mean_p))))
 
-        from random import gauss
-        velocity = self.units.v_from_p(m[0], numpy.array(
-                [gauss(mean, sigma) for mean, sigma in zip(self.mean_p, self.sigma_p)]))
+        # vectorized version of units.v_from_p
+        c = self.units.VACUUM_LIGHT_SPEED()
+        velocity = c*p/numpy.sqrt(
+                numpy.sum(p**2, axis=1) + (c*m[:, 0])**2)[:, numpy.newaxis]
 
-        return (x, list(velocity)+v, q, m)
+        return (x, numpy.hstack((velocity, v)), q, m)
 
     def mean(self):
         next_mean = self.next.mean()
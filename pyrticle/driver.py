@@ -59,6 +59,8 @@ class PICCPyUserInterface(pytools.CPyUserInterface):
                 "mesh": None,
                 "dimensions_pos": None,
                 "dimensions_velocity": None,
+                "mesh_data_cache_dir": None,
+                "mesh_reorder": None,
 
                 "beam_axis": None,
                 "beam_diag_axis": None,
@@ -78,18 +80,37 @@ class PICCPyUserInterface(pytools.CPyUserInterface):
                 "potential_bc": hedge.data.ConstantGivenFunction(),
 
                 "final_time": None,
+                "max_steps": None,
 
                 "nparticles": 20000,
                 "distribution": None,
+                "quiet_start": False,
+                "emitters": [],
 
                 "vis_interval": 100,
                 "vis_pattern": "pic-%04d",
                 "vis_order": None,
+                "vis_async": True,
+                "vis_format": "silo",
+                "diagnostics_capture_interval": None,
                 "output_path": ".",
 
+                "particle_dump_interval": None,
+                "particle_dump_path": "particles.pdh",
+                "particle_dump_compress": True,
+
+                "phase_space_interval": None,
+                "phase_space_histograms": None,
+                "phase_space_path": "phase_space.psh",
+
+                "checkpoint_interval": None,
+                "checkpoint_pattern": "checkpoint-%06d.pcp",
+                "checkpoint_on_signal": True,
+
                 "debug": set(["ic", "poisson", "shape_bw"]),
                 "dg_debug": set(),
                 "profile_output_filename": None,
+                "phase_timing_json": None,
 
                 "watch_vars": ["step", "t_sim", 
                     ("W_field", "W_el+W_mag"), 
@@ -103,7 +124,7 @@ class PICCPyUserInterface(pytools.CPyUserInterface):
                     ("h", observer.h), 
                     ("j", observer.method.deposit_j(observer.state)), 
                     ],
-                "hook_visualize": lambda runner, vis, visf, observer: None,
+                "hook_visualize": None,
 
                 "timestepper_maker": lambda dt: LSRK4TimeStepper(),
                 "dt_scale": 1,
@@ -112,11 +133,55 @@ class PICCPyUserInterface(pytools.CPyUserInterface):
         doc = {
                 "chi": "relative speed of hyp. cleaning (None for no cleaning)",
                 "nparticles": "how many particles",
+                "distribution": "the initial particle distribution, e.g. a "
+                    "pyrticle.distribution.KVZIntervalBeam, or a "
+                    "pyrticle.distribution.ParticleFile to read the particles "
+                    "from a file",
+                "quiet_start": "draw the particles from a scrambled Halton "
+                    "sequence with mirrored loading instead of random numbers "
+                    "(see pyrticle.distribution.QuietStart)",
+                "emitters": "a list of pyrticle.emission.Emitter instances "
+                    "injecting particles in every time step",
+                "mesh_data_cache_dir": "directory in which the element geometry "
+                    "and connectivity derived from the mesh are cached "
+                    "(None for no caching)",
+                "mesh_reorder": "renumber the mesh elements before discretizing "
+                    "so that neighbors are stored close together: 'rcm' "
+                    "(reverse Cuthill-McKee), 'hilbert', 'morton' or None",
+                "max_steps": "stop after this many steps, keeping the time step "
+                    "derived from final_time (None for running to final_time)",
                 "vis_interval": "how often a visualization of the fields is written",
+                "vis_format": "'silo' or 'vtk'",
+                "diagnostics_capture_interval": "how often per-particle diagnostics "
+                    "(fields and forces at particles) are captured, in addition "
+                    "to the steps that are visualized (None for only those). "
+                    "They are captured on every step if logged quantities "
+                    "need them, such as those of the averaging pusher.",
+                "vis_async": "write visualization files in a background thread "
+                    "(ignored if hook_visualize is given)",
+                "hook_visualize": "None or a function (runner, vis, visf, observer) "
+                    "adding data to each visualization file",
                 "max_volume_inner": "max. tet volume in inner mesh [m^3]",
                 "max_volume_outer": "max. tet volume in outer mesh [m^3]",
                 "shape_bandwidth": "either 'optimize', 'guess' or a positive real number",
                 "phi_filter": "a tuple (min_amp, order) or None, describing the filtering applied to phi in hypclean mode",
+                "particle_dump_interval": "how often (in steps) the particles are "
+                    "appended to the particle history (None for never)",
+                "particle_dump_path": "directory holding the particle history, "
+                    "see pyrticle.particle_history",
+                "phase_space_interval": "how often (in steps) histograms of the "
+                    "particle distribution are appended to the phase space "
+                    "history (None for never)",
+                "phase_space_histograms": "a list of pyrticle.phase_space.Histogram "
+                    "instances (None for the longitudinal density, the energy "
+                    "distribution and the transverse trace spaces, see "
+                    "pyrticle.phase_space.make_default_histograms)",
+                "phase_space_path": "directory holding the phase space history, "
+                    "see pyrticle.phase_space",
+                "phase_timing_json": "file receiving a per-step JSON breakdown "
+                    "of the C++ core phase timings (needs PHASE_TIMING)",
+                "checkpoint_interval": "how often (in steps) a checkpoint is written (None for never)",
+                "checkpoint_on_signal": "write a checkpoint on SIGUSR1, write one and stop on SIGTERM",
                 }
 
         pytools.CPyUserInterface.__init__(self, variables, constants, doc)
@@ -144,27 +209,81 @@ class PICCPyUserInterface(pytools.CPyUserInterface):
 
 
 
+def extract_restart_argument(argv):
+    """Remove C{--restart=FILE} or C{--restart FILE} from C{argv} (in place)
+    and return C{FILE}, or C{None} if no such argument is present.
+    """
+    for i, arg in enumerate(argv):
+        if arg.startswith("--restart="):
+            del argv[i]
+            return arg[len("--restart="):]
+        elif arg == "--restart":
+            if i+1 >= len(argv):
+                raise ValueError("--restart requires a checkpoint file name")
+            filename = argv[i+1]
+            del argv[i:i+2]
+            return filename
+
+    return None
+
+
+
+
+def continue_times_and_steps(step_it, start_step, start_time):
+    """Shift the tuples C{(step, t, dt)} yielded by hedge's
+    C{times_and_steps} iterator C{step_it}, which counts from zero, so
+    that they continue a run restarted at C{start_step} and C{start_time}.
+    """
+    for step, t, dt in step_it:
+        yield start_step+step, start_time+t, dt
+
+
+
+
 class PICRunner(object):
     def __init__(self):
         from pyrticle.units import SIUnitsWithNaturalConstants
         self.units = units = SIUnitsWithNaturalConstants()
 
+        import sys
+        restart_filename = extract_restart_argument(sys.argv)
+
+        from pyrticle.log import StartupTimer
+        self.startup_timer = startup_timer = StartupTimer()
+
+        # the setup file usually generates the mesh
+        startup_timer.start("setup_file")
         ui = PICCPyUserInterface(units)
         setup = self.setup = ui.gather()
 
+        if restart_filename is not None:
+            from pyrticle.checkpoint import Checkpoint
+            restart_checkpoint = Checkpoint(restart_filename)
+            log_name = "pic-restart-%06d.dat" % restart_checkpoint.metadata["step"]
+        else:
+            restart_checkpoint = None
+            log_name = "pic.dat"
+
         from pytools.log import LogManager
         import os.path
         self.logmgr = LogManager(os.path.join(
-            setup.output_path, "pic.dat"), "w")
+            setup.output_path, log_name), "w")
 
         from hedge.backends import guess_run_context
         self.rcon = guess_run_context([])
 
+        if self.rcon.is_head_rank and setup.mesh_reorder is not None:
+            startup_timer.start("mesh_reorder")
+            from pyrticle.geometry import reorder_mesh
+            setup.mesh = reorder_mesh(setup.mesh, setup.mesh_reorder)
+
+        startup_timer.start("mesh_distribution")
         if self.rcon.is_head_rank:
             mesh = self.rcon.distribute_mesh(setup.mesh)
         else:
             mesh = self.rcon.receive_mesh()
 
+        startup_timer.start("discretization")
         self.discr = discr = \
                 self.rcon.make_discretization(mesh, 
                         order=setup.element_order,
@@ -175,6 +294,7 @@ class PICRunner(object):
         self.logmgr.set_constant("element_order", setup.element_order)
 
         # em operator ---------------------------------------------------------
+        startup_timer.start("maxwell_operator")
         maxwell_kwargs = {
                 "epsilon": units.EPSILON0, 
                 "mu": units.MU0, 
@@ -208,32 +328,88 @@ class PICRunner(object):
         goal_dt = self.maxwell_op.estimate_timestep(discr) * setup.dt_scale
         self.nsteps = int(setup.final_time/goal_dt)+1
         self.dt = setup.final_time/self.nsteps
+        if setup.max_steps is not None:
+            self.nsteps = min(self.nsteps, setup.max_steps)
 
         self.stepper = setup.timestepper_maker(self.dt)
 
         # particle setup ------------------------------------------------------
-        from pyrticle.cloud import PicMethod, PicState, \
-                optimize_shape_bandwidth, \
-                guess_shape_bandwidth
+        from pyrticle.cloud import PicMethod
 
         method = self.method = PicMethod(discr, units, 
                 setup.depositor, setup.pusher,
                 dimensions_pos=setup.dimensions_pos, 
                 dimensions_velocity=setup.dimensions_velocity, 
-                debug=setup.debug)
+                debug=setup.debug,
+                startup_timer=startup_timer,
+                mesh_data_cache_dir=setup.mesh_data_cache_dir,
+                emitters=setup.emitters)
 
         self.state = method.make_state()
-        method.add_particles( 
-                self.state,
-                setup.distribution.generate_particles(),
-                setup.nparticles)
-
         self.total_charge = setup.nparticles*setup.distribution.mean()[2][0]
+
+        if restart_checkpoint is None:
+            self.start_step = 0
+            self.start_time = 0
+
+            startup_timer.start("particles")
+            distribution = setup.distribution
+            if setup.quiet_start:
+                from pyrticle.distribution import QuietStart
+                distribution = QuietStart(distribution)
+
+            method.add_particle_chunks(
+                    self.state,
+                    distribution.generate_particle_chunks(),
+                    setup.nparticles)
+
+            startup_timer.start("shape_function")
+            self.set_up_shape_function()
+            startup_timer.start("initial_condition")
+            self.set_up_initial_condition()
+        else:
+            startup_timer.start("checkpoint_read")
+            from pyrticle.checkpoint import read_pic_checkpoint
+            self.fields, self.start_step, self.start_time = \
+                    read_pic_checkpoint(restart_checkpoint, method, self.state)
+            self.logmgr.set_constant("restart_step", self.start_step)
+
+        startup_timer.start("depositor_tune")
+        method.depositor.tune(self.state)
+
+        # rhs calculators -----------------------------------------------------
+        startup_timer.start("rhs_setup")
+        from pyrticle.cloud import \
+                FieldRhsCalculator, \
+                FieldToParticleRhsCalculator, \
+                ParticleRhsCalculator, \
+                ParticleToFieldRhsCalculator
+        self.f_rhs_calculator = FieldRhsCalculator(self.method, self.maxwell_op)
+        self.p_rhs_calculator = ParticleRhsCalculator(self.method, self.maxwell_op)
+        self.f2p_rhs_calculator = FieldToParticleRhsCalculator(self.method, self.maxwell_op)
+        self.p2f_rhs_calculator = ParticleToFieldRhsCalculator(self.method, self.maxwell_op)
+
+        # instrumentation setup -----------------------------------------------
+        startup_timer.start("instrumentation")
+        self.add_instrumentation(self.logmgr)
+
+        startup_timer.add_to_log(self.logmgr)
+        if self.rcon.is_head_rank:
+            startup_timer.print_summary()
+
+    def set_up_shape_function(self):
+        setup = self.setup
+        method = self.method
+
+        from pyrticle.cloud import \
+                optimize_shape_bandwidth, \
+                guess_shape_bandwidth
+
         if isinstance(setup.shape_bandwidth, str):
             if setup.shape_bandwidth == "optimize":
                 optimize_shape_bandwidth(method, self.state,
                         setup.distribution.get_rho_interpolant(
-                            discr, self.total_charge),
+                            self.discr, self.total_charge),
                         setup.shape_exponent)
             elif setup.shape_bandwidth == "guess":
                 guess_shape_bandwidth(method, self.state, setup.shape_exponent)
@@ -250,37 +426,26 @@ class PICRunner(object):
                         setup.shape_exponent,
                         ))
 
-        # initial condition ---------------------------------------------------
+    def set_up_initial_condition(self):
+        setup = self.setup
+
         if "no_ic" in setup.debug:
-            self.fields = self.maxwell_op.assemble_eh(discr=discr)
+            self.fields = self.maxwell_op.assemble_eh(discr=self.discr)
         else:
             from pyrticle.cloud import compute_initial_condition
-            self.fields = compute_initial_condition(self.rcon, discr, method, self.state,
+            self.fields = compute_initial_condition(self.rcon, self.discr, 
+                    self.method, self.state,
                     maxwell_op=self.maxwell_op, 
                     potential_bc=setup.potential_bc, 
                     force_zero=False)
 
-        # rhs calculators -----------------------------------------------------
-        from pyrticle.cloud import \
-                FieldRhsCalculator, \
-                FieldToParticleRhsCalculator, \
-                ParticleRhsCalculator, \
-                ParticleToFieldRhsCalculator
-        self.f_rhs_calculator = FieldRhsCalculator(self.method, self.maxwell_op)
-        self.p_rhs_calculator = ParticleRhsCalculator(self.method, self.maxwell_op)
-        self.f2p_rhs_calculator = FieldToParticleRhsCalculator(self.method, self.maxwell_op)
-        self.p2f_rhs_calculator = ParticleToFieldRhsCalculator(self.method, self.maxwell_op)
-
-        # instrumentation setup -----------------------------------------------
-        self.add_instrumentation(self.logmgr)
-
     def add_instrumentation(self, logmgr):
         from pytools.log import \
                 add_simulation_quantities, \
                 add_general_quantities, \
                 add_run_info, ETA
         from pyrticle.log import add_particle_quantities, add_field_quantities, \
-                add_beam_quantities, add_currents
+                add_beam_quantities, add_currents, add_phase_timing_quantities
 
         setup = self.setup
 
@@ -307,6 +472,16 @@ class PICRunner(object):
 
         self.method.add_instrumentation(logmgr, self.observer)
 
+        if setup.phase_timing_json is not None:
+            import os.path
+            phase_timing_json = os.path.join(
+                    setup.output_path, setup.phase_timing_json)
+            if len(self.rcon.ranks) > 1:
+                phase_timing_json += ".rank%d" % self.rcon.rank
+        else:
+            phase_timing_json = None
+        add_phase_timing_quantities(logmgr, phase_timing_json, self.start_step)
+
         self.f_rhs_calculator.add_instrumentation(logmgr)
 
         if hasattr(self.stepper, "add_instrumentation"):
@@ -329,15 +504,54 @@ class PICRunner(object):
         logmgr.set_constant("shape_exponent", self.method.depositor.shape_function.exponent)
 
         from pytools.log import IntervalTimer
-        self.vis_timer = IntervalTimer("t_vis", "Time spent visualizing")
+        self.vis_timer = IntervalTimer("t_vis",
+                "Time the time loop spent on visualization")
         logmgr.add_quantity(self.vis_timer)
+        self.particle_dump_timer = IntervalTimer("t_particle_dump",
+                "Time the time loop spent on particle history dumps")
+        logmgr.add_quantity(self.particle_dump_timer)
+        self.phase_space_timer = IntervalTimer("t_phase_space",
+                "Time the time loop spent on phase space histograms")
+        logmgr.add_quantity(self.phase_space_timer)
 
-        logmgr.add_quantity(ETA(self.nsteps))
+        logmgr.add_quantity(ETA(self.nsteps-self.start_step))
 
         logmgr.add_watches(setup.watch_vars)
 
+    def write_checkpoint(self, fields, state, step, t):
+        import os.path
+        filename = os.path.join(self.setup.output_path,
+                self.setup.checkpoint_pattern % step)
+        if len(self.rcon.ranks) > 1:
+            filename += ".rank%d" % self.rcon.rank
+
+        from pyrticle.checkpoint import write_pic_checkpoint
+        write_pic_checkpoint(filename, self.method, state, fields, step, t)
+
+    def install_checkpoint_signal_handlers(self):
+        """Request a checkpoint on C{SIGUSR1}, and a checkpoint followed
+        by a clean stop on C{SIGTERM}. Both are acted upon at the beginning
+        of the next time step.
+        """
+        self.checkpoint_requested = False
+        self.stop_requested = False
+
+        if not self.setup.checkpoint_on_signal:
+            return
+
+        def request_checkpoint(signum, frame):
+            self.checkpoint_requested = True
+
+        def request_checkpoint_and_stop(signum, frame):
+            self.checkpoint_requested = True
+            self.stop_requested = True
+
+        import signal
+        signal.signal(signal.SIGUSR1, request_checkpoint)
+        signal.signal(signal.SIGTERM, request_checkpoint_and_stop)
+
     def inner_run(self): 
-        t = 0
+        t = self.start_time
         
         setup = self.setup
         setup.hook_startup(self)
@@ -358,8 +572,14 @@ class PICRunner(object):
             def vis_proj(f):
                 return f
 
-        from hedge.visualization import SiloVisualizer
-        vis = SiloVisualizer(vis_discr)
+        if setup.vis_format == "silo":
+            from hedge.visualization import SiloVisualizer
+            vis = SiloVisualizer(vis_discr)
+        elif setup.vis_format == "vtk":
+            from hedge.visualization import VtkVisualizer
+            vis = VtkVisualizer(vis_discr, self.rcon)
+        else:
+            raise ValueError("invalid vis_format: %s" % setup.vis_format)
 
         fields = self.fields
         self.observer.set_fields_and_state(fields, self.state)
@@ -367,23 +587,100 @@ class PICRunner(object):
         from hedge.tools import make_obj_array
         from pyrticle.cloud import TimesteppablePicState
 
+        # hook_visualize needs the live state, so it forces synchronous output
+        from pyrticle.vis_output import snapshot_field
+        if setup.vis_async and setup.hook_visualize is None:
+            from pyrticle.vis_output import BackgroundVisualizationWriter
+            vis_writer = BackgroundVisualizationWriter()
+        else:
+            from pyrticle.vis_output import SynchronousVisualizationWriter
+            vis_writer = SynchronousVisualizationWriter()
+
         def visualize(observer):
             sub_timer = self.vis_timer.start_sub_timer()
             import os.path
-            visf = vis.make_file(os.path.join(
-                setup.output_path, setup.vis_pattern % step))
+            vis_filename = os.path.join(
+                setup.output_path, setup.vis_pattern % step)
+            vis_t = t
+            vis_step = step
+
+            particles = self.method.make_vis_snapshot(observer.state,
+                    observer.state.vis_listener)
+            vis_quantities = [(name, snapshot_field(fld))
+                    for name, fld in setup.hook_vis_quantities(observer)]
+
+            def write():
+                visf = vis.make_file(vis_filename)
+
+                self.method.write_vis_snapshot(vis, visf, particles,
+                        time=vis_t, step=vis_step)
+                vis.add_data(visf, 
+                        [(name, vis_proj(fld)) for name, fld in vis_quantities],
+                        time=vis_t, step=vis_step)
+                if setup.hook_visualize is not None:
+                    setup.hook_visualize(self, vis, visf, observer)
+
+                visf.close()
+
+            vis_writer.submit(write)
+            sub_timer.stop().submit()
 
-            self.method.add_to_vis(vis, visf, observer.state, time=t, step=step)
-            vis.add_data(visf, 
-                    [(name, vis_proj(fld))
-                        for name, fld in setup.hook_vis_quantities(observer)],
-                    time=t, step=step)
-            setup.hook_visualize(self, vis, visf, observer)
+        if setup.particle_dump_interval is not None:
+            import os.path
+            from pyrticle.particle_history import ParticleHistoryWriter
+            particle_dump_path = os.path.join(
+                    setup.output_path, setup.particle_dump_path)
+            if len(self.rcon.ranks) > 1:
+                particle_dump_path += ".rank%d" % self.rcon.rank
+
+            particle_history = ParticleHistoryWriter(particle_dump_path,
+                    compress=setup.particle_dump_compress,
+                    discard_from_step=self.start_step)
+
+        def dump_particles(state):
+            sub_timer = self.particle_dump_timer.start_sub_timer()
+            from pyrticle.particle_history import get_particle_quantities
+            quantities = get_particle_quantities(state)
+            dump_t = t
+            dump_step = step
+
+            vis_writer.submit(
+                    lambda: particle_history.append(dump_step, dump_t, quantities))
+            sub_timer.stop().submit()
 
-            visf.close()
+        if setup.phase_space_interval is not None:
+            import os.path
+            from pyrticle.phase_space import PhaseSpaceHistoryWriter
+            phase_space_path = os.path.join(
+                    setup.output_path, setup.phase_space_path)
+            if len(self.rcon.ranks) > 1:
+                phase_space_path += ".rank%d" % self.rcon.rank
+
+            phase_space_histograms = setup.phase_space_histograms
+            if phase_space_histograms is None:
+                from pyrticle.phase_space import make_default_histograms
+                phase_space_histograms = make_default_histograms(
+                        self.method.dimensions_pos,
+                        self.method.dimensions_velocity,
+                        setup.beam_axis)
+
+            phase_space_history = PhaseSpaceHistoryWriter(phase_space_path,
+                    phase_space_histograms,
+                    discard_from_step=self.start_step)
+
+        def write_phase_space(observer):
+            sub_timer = self.phase_space_timer.start_sub_timer()
+            record = phase_space_history.make_record(step, t, observer)
+            vis_writer.submit(lambda: phase_space_history.append(record))
             sub_timer.stop().submit()
 
         from hedge.timestep.multirate_ab import TwoRateAdamsBashforthTimeStepper 
+        if (self.start_step
+                and isinstance(self.stepper, TwoRateAdamsBashforthTimeStepper)):
+            from warnings import warn
+            warn("multi-step time stepper history is not checkpointed--"
+                    "restarting with empty history")
+
         if not isinstance(self.stepper, TwoRateAdamsBashforthTimeStepper): 
             def rhs(t, fields_and_state):
                 fields, ts_state = fields_and_state
@@ -418,19 +715,50 @@ class PICRunner(object):
             ])
         del self.state
 
+        self.install_checkpoint_signal_handlers()
+
         try:
             from hedge.timestep import times_and_steps
             step_it = times_and_steps(
-                    max_steps=self.nsteps,
+                    max_steps=self.nsteps-self.start_step,
                     logmgr=self.logmgr,
                     max_dt_getter=lambda t: self.dt)
+            if self.start_step:
+                step_it = continue_times_and_steps(step_it,
+                        self.start_step, self.start_time)
 
             for step, t, dt in step_it:
+                if step != self.start_step and (self.checkpoint_requested or (
+                        setup.checkpoint_interval is not None
+                        and step % setup.checkpoint_interval == 0)):
+                    self.write_checkpoint(y[0], y[1].state, step, t)
+                    self.checkpoint_requested = False
+
+                    if self.stop_requested:
+                        break
+
                 self.method.upkeep(y[1].state)
 
                 if step % setup.vis_interval == 0:
                     visualize(self.observer)
 
+                if (setup.particle_dump_interval is not None
+                        and step % setup.particle_dump_interval == 0):
+                    dump_particles(y[1].state)
+
+                if (setup.phase_space_interval is not None
+                        and step % setup.phase_space_interval == 0):
+                    write_phase_space(self.observer)
+
+                # capture particle diagnostics only while computing data that
+                # will be visualized or logged
+                next_step = step + 1
+                self.method.set_diagnostic_capture(y[1].state,
+                        self.method.log_needs_diagnostics
+                        or next_step % setup.vis_interval == 0
+                        or (setup.diagnostics_capture_interval is not None
+                            and next_step % setup.diagnostics_capture_interval == 0))
+
                 y = self.stepper(y, t, *step_args)
 
                 fields, ts_state = y
@@ -438,9 +766,12 @@ class PICRunner(object):
 
                 setup.hook_after_step(self, self.observer)
         finally:
-            vis.close()
-            self.discr.close()
-            self.logmgr.save()
+            try:
+                vis_writer.close()
+            finally:
+                vis.close()
+                self.discr.close()
+                self.logmgr.save()
 
         setup.hook_when_done(self)
 
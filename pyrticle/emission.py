@@ -0,0 +1,273 @@
+"""Particle sources that inject particles while the simulation runs"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+import numpy
+import numpy.linalg as la
+
+
+
+
+# simplex geometry ------------------------------------------------------------
+def get_simplex_measures(simplices):
+    """Return the length, area or volume of each of the simplices given by
+    the vertex coordinate array C{simplices} of shape
+    C{(count, vertices_per_simplex, dimensions)}.
+    """
+    from math import factorial
+
+    count, vertex_count, dim = simplices.shape
+    if vertex_count == 1:
+        return numpy.ones((count,))
+
+    edges = simplices[:, 1:, :] - simplices[:, :1, :]
+    gram = numpy.sum(edges[:, :, numpy.newaxis, :]*edges[:, numpy.newaxis, :, :],
+            axis=3)
+    return numpy.sqrt(numpy.abs(la.det(gram)))/factorial(vertex_count-1)
+
+
+
+
+def sample_simplices(simplices, simplex_numbers, rng):
+    """Return one point uniformly distributed in each of the simplices
+    C{simplices[simplex_numbers]}.
+    """
+    vertex_count = simplices.shape[1]
+
+    # normalized exponential variates are uniform on the unit simplex
+    weights = -numpy.log(1-rng.random_sample(
+        (len(simplex_numbers), vertex_count)))
+    weights /= numpy.sum(weights, axis=1)[:, numpy.newaxis]
+
+    return numpy.sum(weights[:, :, numpy.newaxis]*simplices[simplex_numbers],
+            axis=1)
+
+
+
+
+def get_face_sites(mesh, tag):
+    """Return a tuple C{(faces, elements, centroids, inward_normals)}
+    describing the boundary faces of C{mesh} tagged C{tag}: the vertex
+    coordinates of each face, the number of the element it belongs to,
+    that element's centroid and the unit normal pointing into it.
+    """
+    points = numpy.asarray(mesh.points, dtype=numpy.float64)
+    dim = points.shape[1]
+
+    bdry = mesh.tag_to_boundary.get(tag, [])
+    if not bdry:
+        return (numpy.zeros((0, dim, dim)), numpy.zeros((0,), dtype=numpy.intp),
+                numpy.zeros((0, dim)), numpy.zeros((0, dim)))
+
+    face_local_vertices = bdry[0][0].face_vertices(range(dim+1))
+
+    faces = numpy.array([
+        points[[el.vertex_indices[i] for i in face_local_vertices[fn]]]
+        for el, fn in bdry])
+    elements = numpy.array([el.id for el, fn in bdry], dtype=numpy.intp)
+    centroids = numpy.array([
+        numpy.average(points[list(el.vertex_indices)], axis=0)
+        for el, fn in bdry])
+
+    # remove the tangential part of the direction to the element centroid
+    inward = centroids - numpy.average(faces, axis=1)
+    if dim > 1:
+        tangents = faces[:, 1:, :] - faces[:, :1, :]
+        gram = numpy.sum(
+                tangents[:, :, numpy.newaxis, :]*tangents[:, numpy.newaxis, :, :],
+                axis=3)
+        coefficients = numpy.array([la.solve(g, numpy.dot(t, d))
+            for g, t, d in zip(gram, tangents, inward)])
+        inward -= numpy.sum(coefficients[:, :, numpy.newaxis]*tangents, axis=1)
+
+    inward /= numpy.sqrt(numpy.sum(inward**2, axis=1))[:, numpy.newaxis]
+
+    return faces, elements, centroids, inward
+
+
+
+
+def get_element_sites(mesh, tag):
+    """Return a tuple C{(simplices, elements)} with the vertex coordinates
+    and numbers of the elements of C{mesh} tagged C{tag}.
+    """
+    points = numpy.asarray(mesh.points, dtype=numpy.float64)
+    els = mesh.tag_to_elements.get(tag, [])
+
+    simplices = numpy.array([points[list(el.vertex_indices)] for el in els])
+    elements = numpy.array([el.id for el in els], dtype=numpy.intp)
+
+    if not els:
+        dim = points.shape[1]
+        simplices = numpy.zeros((0, dim+1, dim))
+
+    return simplices, elements
+
+
+
+
+# emitters --------------------------------------------------------------------
+class Emitter(object):
+    """Injects particles once per time step, through
+    L{pyrticle.cloud.PicMethod.upkeep}.
+
+    C{particles_per_step} may be fractional, in which case the fractions
+    accumulate over the steps. The particles have charge C{charge} and
+    mass C{mass}, and a Gaussian thermal velocity spread of standard
+    deviation C{thermal_velocity} in each component added to the velocity
+    given by the subclass. C{seed} is passed to
+    L{pyrticle.tools.make_random_state}.
+
+    Subclasses implement L{get_sites}. The emitters know the element each
+    new particle is placed in, so no element search is needed.
+    """
+
+    def __init__(self, particles_per_step, charge, mass,
+            thermal_velocity=0, seed=None):
+        self.particles_per_step = particles_per_step
+        self.charge = charge
+        self.mass = mass
+        self.thermal_velocity = thermal_velocity
+        self.seed = seed
+
+    def initialize(self, method):
+        from pyrticle.tools import make_random_state
+
+        self.method = method
+        self.rng = make_random_state(self.seed)
+        self.pending = 0
+
+        self.simplices, self.elements, self.drift_velocities = \
+                self.get_sites(method.discretization.mesh)
+
+        self.cumulative_measures = numpy.cumsum(
+                get_simplex_measures(self.simplices))
+
+    def get_sites(self, mesh):
+        """Return a tuple C{(simplices, elements, drift_velocities)}: the
+        vertex coordinates of the simplices particles are emitted from, the
+        element numbers particles placed in them end up in, and the mean
+        velocity of the particles emitted from each simplex.
+        """
+        raise NotImplementedError
+
+    def place_particles(self, simplex_numbers):
+        """Return positions for new particles in the simplices
+        C{simplex_numbers}.
+        """
+        return sample_simplices(self.simplices, simplex_numbers, self.rng)
+
+    def make_particles(self, count):
+        """Return C{count} new particles as a tuple of arrays
+        C{(positions, velocities, charges, masses, containing_elements)}.
+        """
+        if len(self.cumulative_measures):
+            simplex_numbers = numpy.searchsorted(self.cumulative_measures,
+                    self.cumulative_measures[-1]*self.rng.random_sample(count))
+            # guard against rounding at the upper end
+            simplex_numbers = numpy.minimum(simplex_numbers,
+                    len(self.cumulative_measures)-1)
+        else:
+            # this rank holds no part of the emitting site
+            simplex_numbers = numpy.zeros((0,), dtype=numpy.intp)
+            count = 0
+
+        vdim = self.method.dimensions_velocity
+        velocities = numpy.zeros((count, vdim))
+        drift = self.drift_velocities[simplex_numbers]
+        velocities[:, :drift.shape[1]] = drift
+        if self.thermal_velocity:
+            velocities += self.thermal_velocity \
+                    * self.rng.standard_normal((count, vdim))
+
+        return (self.place_particles(simplex_numbers),
+                velocities,
+                numpy.repeat(self.charge, count),
+                numpy.repeat(self.mass, count),
+                self.elements[simplex_numbers])
+
+    def emit(self, state):
+        """Return the particles to be injected in this time step, as
+        returned by L{make_particles}.
+        """
+        self.pending += self.particles_per_step
+        count = int(self.pending)
+        self.pending -= count
+
+        return self.make_particles(count)
+
+
+
+
+class SurfaceEmitter(Emitter):
+    """Emits particles from the boundary faces tagged C{tag}, uniformly
+    per unit area, at C{normal_velocity} into the domain.
+
+    The particles start a fraction C{inset} of the way from the face to
+    the centroid of the adjoining element, so that they lie strictly
+    inside it.
+    """
+
+    def __init__(self, tag, particles_per_step, charge, mass,
+            normal_velocity=0, thermal_velocity=0, inset=1e-3, seed=None):
+        Emitter.__init__(self, particles_per_step, charge, mass,
+                thermal_velocity, seed)
+        self.tag = tag
+        self.normal_velocity = normal_velocity
+        self.inset = inset
+
+    def get_sites(self, mesh):
+        faces, elements, self.centroids, inward_normals = \
+                get_face_sites(mesh, self.tag)
+        return faces, elements, self.normal_velocity*inward_normals
+
+    def place_particles(self, simplex_numbers):
+        on_face = Emitter.place_particles(self, simplex_numbers)
+        return ((1-self.inset)*on_face
+                + self.inset*self.centroids[simplex_numbers])
+
+
+
+
+class VolumeEmitter(Emitter):
+    """Emits particles uniformly distributed over the elements tagged
+    C{tag}, with mean velocity C{velocity}.
+    """
+
+    def __init__(self, tag, particles_per_step, charge, mass,
+            velocity=None, thermal_velocity=0, seed=None):
+        Emitter.__init__(self, particles_per_step, charge, mass,
+                thermal_velocity, seed)
+        self.tag = tag
+        self.velocity = velocity
+
+    def get_sites(self, mesh):
+        simplices, elements = get_element_sites(mesh, self.tag)
+
+        velocity = self.velocity
+        if velocity is None:
+            velocity = numpy.zeros((self.method.dimensions_velocity,))
+
+        return (simplices, elements,
+                numpy.tile(numpy.asarray(velocity, dtype=numpy.float64),
+                    (len(elements), 1)))
@@ -318,3 +318,217 @@ def make_cylinder_with_fine_core(r, inner_r, min_z, max_z,
             max_volume_inner=max_volume_inner,
             max_volume_outer=max_volume_outer,
             radial_subdiv=radial_subdiv)
+
+
+
+
+# element ordering ------------------------------------------------------------
+def get_element_adjacency(el_vertices):
+    """Return the face adjacency of the simplices given by the vertex
+    numbers C{el_vertices} (one row per element) in compressed row storage,
+    as a tuple C{(starts, neighbors)}: the neighbors of element C{i} are
+    C{neighbors[starts[i]:starts[i+1]]}.
+
+    Periodic neighbors do not share vertices and are not included.
+    """
+    from itertools import combinations
+
+    el_count, vertices_per_el = el_vertices.shape
+    face_local_vertices = numpy.array(
+            list(combinations(range(vertices_per_el), vertices_per_el-1)),
+            dtype=numpy.intp)
+    faces_per_el = len(face_local_vertices)
+
+    # shared faces have the same sorted vertex numbers
+    face_keys = numpy.sort(el_vertices[:, face_local_vertices],
+            axis=2).reshape(-1, vertices_per_el-1)
+    order = numpy.lexsort(face_keys.T[::-1])
+    sorted_keys = face_keys[order]
+    shared = numpy.all(sorted_keys[1:] == sorted_keys[:-1], axis=1)
+    first_els = order[:-1][shared] // faces_per_el
+    second_els = order[1:][shared] // faces_per_el
+
+    rows = numpy.concatenate([first_els, second_els])
+    cols = numpy.concatenate([second_els, first_els])
+
+    starts = numpy.zeros(el_count+1, dtype=numpy.intp)
+    starts[1:] = numpy.cumsum(numpy.bincount(rows, minlength=el_count))
+    return starts, cols[numpy.argsort(rows, kind="mergesort")]
+
+
+
+
+def _breadth_first_order(root, starts, neighbors, degree, visited):
+    """Visit the elements reachable from C{root} that are not yet
+    C{visited}, neighbors in order of increasing degree, and mark them
+    visited. Returns the list of elements in the order visited.
+    """
+    visited[root] = True
+    queue = [root]
+    head = 0
+    while head < len(queue):
+        el = queue[head]
+        head += 1
+
+        el_neighbors = neighbors[starts[el]:starts[el+1]]
+        el_neighbors = el_neighbors[~visited[el_neighbors]]
+        el_neighbors = el_neighbors[
+                numpy.argsort(degree[el_neighbors], kind="mergesort")]
+        visited[el_neighbors] = True
+        queue.extend(el_neighbors)
+
+    return queue
+
+
+
+
+def get_rcm_order(starts, neighbors):
+    """Return the reverse Cuthill-McKee ordering of the graph given in
+    compressed row storage (see L{get_element_adjacency}).
+
+    Each connected component is started from a pseudo-peripheral node,
+    found by restarting the breadth-first search from the last node it
+    reaches.
+    """
+    node_count = len(starts)-1
+    degree = numpy.diff(starts)
+    visited = numpy.zeros(node_count, dtype=numpy.bool_)
+
+    result = []
+    for seed in numpy.argsort(degree, kind="mergesort"):
+        if visited[seed]:
+            continue
+
+        root = seed
+        for i in range(2):
+            root = _breadth_first_order(root, starts, neighbors, degree,
+                    visited.copy())[-1]
+
+        result.extend(_breadth_first_order(
+            root, starts, neighbors, degree, visited))
+
+    return numpy.array(result[::-1], dtype=numpy.intp)
+
+
+
+
+def _quantize(points, bits):
+    """Map C{points} (one per row) to integer coordinates in
+    [0, 2**bits), using the same scale along all axes.
+    """
+    lower = numpy.min(points, axis=0)
+    extent = numpy.max(numpy.max(points, axis=0) - lower)
+    if extent == 0:
+        extent = 1
+    return ((points - lower) * ((2**bits-1)/extent)).astype(numpy.int64)
+
+
+
+
+def _interleave_bits(coords, bits):
+    """Return the integers whose bits are those of the columns of
+    C{coords}, interleaved from the most significant bit down, with the
+    first column in the highest position.
+    """
+    key = numpy.zeros(len(coords), dtype=numpy.int64)
+    for bit in range(bits-1, -1, -1):
+        for axis in range(coords.shape[1]):
+            key = (key << 1) | ((coords[:, axis] >> bit) & 1)
+    return key
+
+
+
+
+def get_morton_keys(coords, bits):
+    """Return the position of the integer points C{coords} (one per row,
+    each coordinate less than C{2**bits}) along the Morton (Z-order) curve.
+    """
+    return _interleave_bits(coords, bits)
+
+
+
+
+def get_hilbert_keys(coords, bits):
+    """Return the position of the integer points C{coords} (one per row,
+    each coordinate less than C{2**bits}) along the Hilbert curve.
+
+    Uses the transposition algorithm from J. Skilling, "Programming the
+    Hilbert curve", AIP Conf. Proc. 707 (2004), vectorized over the points.
+    """
+    x = numpy.array(coords, dtype=numpy.int64).T.copy()
+    dim = len(x)
+
+    # undo excess work
+    q = 1 << (bits-1)
+    while q > 1:
+        p = q - 1
+        for i in range(dim):
+            high = (x[i] & q) != 0
+            t = (x[0] ^ x[i]) & p
+            t[high] = 0
+            x[0] ^= numpy.where(high, p, t)
+            x[i] ^= t
+        q >>= 1
+
+    # Gray encode
+    for i in range(1, dim):
+        x[i] ^= x[i-1]
+    t = numpy.zeros_like(x[0])
+    q = 1 << (bits-1)
+    while q > 1:
+        t[(x[dim-1] & q) != 0] ^= q - 1
+        q >>= 1
+    for i in range(dim):
+        x[i] ^= t
+
+    return _interleave_bits(x.T, bits)
+
+
+
+
+ELEMENT_ORDERINGS = ["rcm", "hilbert", "morton"]
+
+def get_element_order(mesh, method):
+    """Return a permutation of the elements of C{mesh} that places
+    neighboring elements close together: C{order[i]} is the current number
+    of the element that should become element C{i}.
+
+    C{method} is one of
+      - C{"rcm"}: reverse Cuthill-McKee on the face adjacency graph,
+      - C{"hilbert"}: position of the element centroid along a Hilbert
+        curve,
+      - C{"morton"}: the same along a Morton (Z-order) curve.
+    """
+    from pyrticle.meshdata import get_element_vertices
+    el_vertices = get_element_vertices(mesh)
+
+    if method == "rcm":
+        return get_rcm_order(*get_element_adjacency(el_vertices))
+    elif method in ["hilbert", "morton"]:
+        points = numpy.asarray(mesh.points, dtype=numpy.float64)
+        centroids = numpy.average(points[el_vertices], axis=1)
+
+        # leave the sign bit alone
+        bits = 62 // centroids.shape[1]
+        coords = _quantize(centroids, bits)
+
+        if method == "hilbert":
+            keys = get_hilbert_keys(coords, bits)
+        else:
+            keys = get_morton_keys(coords, bits)
+
+        return numpy.argsort(keys, kind="mergesort")
+    else:
+        raise ValueError, "invalid element ordering method '%s'" % method
+
+
+
+
+def reorder_mesh(mesh, method):
+    """Return a copy of C{mesh} with its elements renumbered by
+    L{get_element_order}, or C{mesh} itself if C{method} is C{None}.
+    """
+    if method is None:
+        return mesh
+
+    return mesh.reordered(list(get_element_order(mesh, method)))
@@ -67,6 +67,26 @@ class StateObserver:
     def discr(self):
         return self.method.discretization
 
+    def beam_moments(self, beam_axis=None):
+        """Return the C{BeamMoments} of the current state, with slopes
+        taken relative to C{beam_axis} (by default the last velocity
+        axis).
+
+        The moments are computed in a single pass over the particles and
+        cached on the state, so that all quantities derived from them
+        share that pass.
+        """
+        if beam_axis is None:
+            beam_axis = self.method.dimensions_velocity - 1
+
+        def get_moments():
+            from pyrticle._internal import get_beam_moments
+            return get_beam_moments(self.state.particle_state,
+                    self.method.units.VACUUM_LIGHT_SPEED(), beam_axis)
+
+        return self.state.get_derived_quantity_from_cache(
+                ("beam_moments", beam_axis), get_moments)
+
 
 
 
@@ -129,8 +149,7 @@ class ParticleMomentum(MultiLogQuantity):
         self.observer = observer
 
     def __call__(self):
-        from pyrticle._internal import particle_momentum
-        return particle_momentum(self.observer.state.particle_state)
+        return self.observer.beam_moments().total_momentum
 
 
 
@@ -141,11 +160,7 @@ class KineticEnergy(LogQuantity):
         self.observer = observer
 
     def __call__(self):
-        from pyrticle._internal import kinetic_energies
-        total_kin_energy = numpy.sum(kinetic_energies(
-                self.observer.state.particle_state,
-                self.observer.method.units.VACUUM_LIGHT_SPEED()))
-        return total_kin_energy
+        return self.observer.beam_moments().total_kinetic_energy
 
 
 
@@ -156,8 +171,7 @@ class ParticleCharge(LogQuantity):
         self.observer = observer
 
     def __call__(self):
-        from pyrticle._internal import total_charge
-        return total_charge(self.observer.state.particle_state)
+        return self.observer.beam_moments().total_charge
 
 
 
@@ -242,6 +256,156 @@ def add_field_quantities(mgr, observer, deposit_interval=5):
 
 
 
+# C++ core phase timing -------------------------------------------------------
+class PhaseTimings(MultiLogQuantity):
+    """Time spent in and number of calls of each phase of the C++ core
+    since the previous time step, as recorded by the timers in
+    C{src/cpp/phase_timing.hpp}. Time is attributed exclusively, i.e.
+    a phase does not include the phases nested in it.
+
+    If C{json_filename} is given, the same breakdown, including the item
+    counts, is appended to that file as one JSON object per step.
+    """
+
+    def __init__(self, json_filename=None, start_step=0):
+        from pyrticle._internal import get_phase_names, get_phase_timings
+        self.phase_names = get_phase_names()
+
+        names = []
+        units = []
+        descriptions = []
+        for phase in self.phase_names:
+            names.extend(["t_ph_%s" % phase, "n_ph_%s" % phase])
+            units.extend(["s", "1"])
+            descriptions.extend([
+                "Time spent in core phase %s" % phase,
+                "Calls of core phase %s" % phase])
+
+        MultiLogQuantity.__init__(self, names, units, descriptions)
+
+        self.last_timings = get_phase_timings()
+
+        if json_filename is not None:
+            self.json_file = open(json_filename, "w")
+        else:
+            self.json_file = None
+        self.step = start_step
+
+    def __call__(self):
+        from pyrticle._internal import get_phase_timings
+        timings = get_phase_timings()
+
+        result = []
+        breakdown = {}
+        for phase in self.phase_names:
+            t, calls, items = timings[phase]
+            last_t, last_calls, last_items = self.last_timings[phase]
+            result.extend([t-last_t, calls-last_calls])
+            breakdown[phase] = {
+                    "t": t-last_t,
+                    "calls": calls-last_calls,
+                    "items": items-last_items,
+                    }
+
+        self.last_timings = timings
+
+        if self.json_file is not None:
+            from json import dumps
+            self.json_file.write(dumps(
+                {"step": self.step, "phases": breakdown}) + "\n")
+            self.json_file.flush()
+        self.step += 1
+
+        return result
+
+
+
+
+def add_phase_timing_quantities(mgr, json_filename=None, start_step=0):
+    """Add L{PhaseTimings} to C{mgr} if the C++ core was built with
+    phase timing, see C{PHASE_TIMING} in C{siteconf.py}.
+    """
+    from pyrticle._internal import phase_timing_enabled
+    if phase_timing_enabled():
+        mgr.add_quantity(PhaseTimings(json_filename, start_step))
+    elif json_filename is not None:
+        from warnings import warn
+        warn("phase timing was requested, but the C++ core was built "
+                "without it--set PHASE_TIMING in siteconf.py and rebuild")
+
+
+
+
+# startup timing --------------------------------------------------------------
+def get_peak_memory():
+    """Return the peak resident set size of this process in MiB."""
+    from resource import getrusage, RUSAGE_SELF
+    # ru_maxrss is in KiB on Linux
+    return getrusage(RUSAGE_SELF).ru_maxrss/1024
+
+
+
+
+class StartupTimer(object):
+    """Measures the wall time and the peak memory use of consecutive
+    phases of the setup preceding the first time step.
+
+    L{start} ends the running phase, if any, and begins a new one.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.current = None
+
+    def start(self, name):
+        self.stop()
+
+        from time import time
+        self.current = name
+        self.start_time = time()
+
+    def stop(self):
+        if self.current is None:
+            return
+
+        from time import time
+        self.phases.append(
+                (self.current, time()-self.start_time, get_peak_memory()))
+        self.current = None
+
+    def total_time(self):
+        return sum(seconds for name, seconds, peak_mem in self.phases)
+
+    def add_to_log(self, mgr):
+        """Record each phase as the constants C{t_setup_<phase>} (in
+        seconds) and C{mem_setup_<phase>} (peak memory at its end, in MiB).
+        """
+        self.stop()
+
+        for name, seconds, peak_mem in self.phases:
+            mgr.set_constant("t_setup_%s" % name, seconds)
+            mgr.set_constant("mem_setup_%s" % name, peak_mem)
+        mgr.set_constant("t_setup", self.total_time())
+
+    def print_summary(self):
+        self.stop()
+
+        total = self.total_time()
+        print "%-20s %13s %10s %15s" % (
+                "setup phase", "time [s]", "share", "peak mem [MiB]")
+        print "-"*62
+        for name, seconds, peak_mem in self.phases:
+            if total:
+                share = 100*seconds/total
+            else:
+                share = 0
+            print "%-20s %13.3f %9.1f%% %15.1f" % (name, seconds, share, peak_mem)
+        print "-"*62
+        print "%-20s %13.3f" % ("total", total)
+
+
+
+
 # Beam quantities -------------------------------------------------------------
 class RMSBeamRadius(LogQuantity):
     def __init__(self, observer, axis, name=None):
@@ -254,8 +418,10 @@ class RMSBeamRadius(LogQuantity):
         self.axis = axis
 
     def __call__(self):
-        from pyrticle._internal import rms_beam_size
-        return rms_beam_size(self.observer.state.particle_state, self.axis)
+        moments = self.observer.beam_moments()
+        from math import sqrt
+        return sqrt(moments.position_variance[self.axis]
+                + moments.mean_position[self.axis]**2)
 
 
 
@@ -272,8 +438,12 @@ class RMSBeamEmittance(LogQuantity):
         self.beam_axis = beam_axis
 
     def __call__(self):
-        from pyrticle._internal import rms_beam_emittance
-        return rms_beam_emittance(self.observer.state.particle_state, self.axis, self.beam_axis)
+        moments = self.observer.beam_moments(self.beam_axis)
+        from math import sqrt
+        return sqrt(max(0,
+            moments.position_variance[self.axis]
+            * moments.slope_variance[self.axis]
+            - moments.position_slope_covariance[self.axis]**2))
 
 
 
@@ -284,9 +454,8 @@ class RMSBeamEnergySpread(LogQuantity):
         self.observer = observer
 
     def __call__(self):
-        from pyrticle._internal import rms_energy_spread
-        return rms_energy_spread(self.observer.state.particle_state,
-                self.observer.method.units.VACUUM_LIGHT_SPEED())
+        from math import sqrt
+        return sqrt(self.observer.beam_moments().kinetic_energy_variance)
 
 
 
@@ -300,13 +469,9 @@ class ParticleCurrent(LogQuantity):
         self.tube_length = tube_length
 
     def __call__(self):
-        from pyrticle._internal import particle_current
         return numpy.dot(
-                particle_current(
-                    self.observer.state.particle_state,
-                    self.observer.method.velocities(self.observer.state),
-                    self.tube_length),
-                self.direction)
+                self.observer.beam_moments().total_charge_velocity,
+                self.direction) / self.tube_length
 
 
 
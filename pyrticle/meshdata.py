@@ -31,16 +31,248 @@ MeshData = _internal.MeshData
 
 
 
+# mesh arrays -----------------------------------------------------------------
+MESH_ARRAYS_VERSION = 1
+
+
+
+
+def get_element_vertices(mesh):
+    return numpy.array([el.vertex_indices for el in mesh.elements],
+            dtype=numpy.uint32)
+
+
+
+
+def make_mesh_arrays(mesh, el_vertices):
+    """Compute the geometry and connectivity of the simplicial C{mesh} as
+    flat arrays, in the form expected by C{MeshData.fill_from_arrays}.
+
+    C{el_vertices} is the result of L{get_element_vertices}. Returns a
+    dictionary of arrays that only depend on the mesh, not on the
+    discretization, so that it can be cached.
+    """
+    INVALID_ELEMENT = MeshData.INVALID_ELEMENT
+    INVALID_AXIS = MeshData.INVALID_AXIS
+
+    points = numpy.asarray(mesh.points, dtype=numpy.float64)
+    vertex_count, dim = points.shape
+    el_count, vertices_per_el = el_vertices.shape
+
+    # element maps ------------------------------------------------------------
+    # The map from unit to global coordinates takes the unit vertices
+    # (-1,...,-1) and -1+2*e_j to vertex 0 and vertex j+1, as hedge's does.
+    el_points = points[el_vertices]
+    fwd_mat = numpy.transpose(
+            el_points[:, 1:, :] - el_points[:, :1, :], (0, 2, 1))/2
+    fwd_vec = el_points[:, 0, :] + numpy.sum(fwd_mat, axis=2)
+
+    inv_mat = la.inv(fwd_mat)
+    inv_vec = -numpy.sum(inv_mat*fwd_vec[:, numpy.newaxis, :], axis=2)
+
+    # faces -------------------------------------------------------------------
+    face_local_vertices = numpy.array(
+            mesh.elements[0].face_vertices(range(vertices_per_el)),
+            dtype=numpy.intp)
+    faces_per_el = len(face_local_vertices)
+
+    face_points = el_points[:, face_local_vertices, :]
+    face_centroids = numpy.average(face_points, axis=2)
+
+    if dim == 1:
+        normals = numpy.ones((el_count, faces_per_el, 1))
+    elif dim == 2:
+        tangents = face_points[:, :, 1] - face_points[:, :, 0]
+        normals = numpy.concatenate([
+            tangents[:, :, 1:2], -tangents[:, :, 0:1]], axis=2)
+    elif dim == 3:
+        normals = numpy.cross(
+                face_points[:, :, 1] - face_points[:, :, 0],
+                face_points[:, :, 2] - face_points[:, :, 0])
+    else:
+        raise ValueError, "invalid mesh dimension"
+
+    normals /= numpy.sqrt(numpy.sum(normals**2, axis=2))[:, :, numpy.newaxis]
+
+    # make normals point outward
+    el_centroids = numpy.average(el_points, axis=1)
+    inward = numpy.sum(normals
+            * (face_centroids - el_centroids[:, numpy.newaxis, :]), axis=2) < 0
+    normals[inward] *= -1
+
+    face_plane_eqn_rhs = numpy.sum(normals*face_centroids, axis=2)
+    face_radii = numpy.sqrt(numpy.max(numpy.sum(
+        (face_points - face_centroids[:, :, numpy.newaxis, :])**2,
+        axis=3), axis=2))
+
+    # face neighbors ----------------------------------------------------------
+    # Faces shared by two elements have the same sorted vertex numbers, so
+    # they end up next to each other after sorting.
+    face_keys = numpy.sort(el_vertices[:, face_local_vertices],
+            axis=2).reshape(-1, face_local_vertices.shape[1])
+    order = numpy.lexsort(face_keys.T[::-1])
+    sorted_keys = face_keys[order]
+    shared = numpy.all(sorted_keys[1:] == sorted_keys[:-1], axis=1)
+    first_faces = order[:-1][shared]
+    second_faces = order[1:][shared]
+
+    face_neighbors = numpy.empty(el_count*faces_per_el, dtype=numpy.uint32)
+    face_neighbors.fill(INVALID_ELEMENT)
+    face_neighbors[first_faces] = second_faces // faces_per_el
+    face_neighbors[second_faces] = first_faces // faces_per_el
+
+    face_periodicity_axes = numpy.empty(el_count*faces_per_el,
+            dtype=numpy.uint32)
+    face_periodicity_axes.fill(INVALID_AXIS)
+
+    if mesh.periodic_opposite_faces:
+        unmatched = numpy.flatnonzero(face_neighbors == INVALID_ELEMENT)
+        unmatched_by_vertices = dict(
+                (frozenset(int(vi) for vi in face_keys[fnum]), fnum)
+                for fnum in unmatched)
+
+        for fvi, (opp_fvi, axis) in mesh.periodic_opposite_faces.iteritems():
+            fnum = unmatched_by_vertices.get(frozenset(fvi))
+            opp_fnum = unmatched_by_vertices.get(frozenset(opp_fvi))
+            if fnum is None:
+                continue
+
+            face_periodicity_axes[fnum] = axis
+            if opp_fnum is not None:
+                face_neighbors[fnum] = opp_fnum // faces_per_el
+
+    # vertex-adjacent elements ------------------------------------------------
+    adj_vertices = el_vertices.ravel().astype(numpy.intp)
+    adj_elements = numpy.repeat(
+            numpy.arange(el_count, dtype=numpy.intp), vertices_per_el)
+
+    vertex_order = numpy.argsort(adj_vertices, kind="mergesort")
+    vertex_starts = numpy.searchsorted(adj_vertices[vertex_order],
+            numpy.arange(vertex_count+1))
+
+    adj_vertices_list = [adj_vertices]
+    adj_elements_list = [adj_elements]
+    adj_axes_list = [numpy.empty(len(adj_vertices), dtype=numpy.intp)]
+    adj_axes_list[0].fill(INVALID_AXIS)
+
+    for vi, opposite in mesh.periodic_opposite_vertices.iteritems():
+        vi_elements = adj_elements[
+                vertex_order[vertex_starts[vi]:vertex_starts[vi+1]]]
+        for other_vi, axis in opposite:
+            adj_vertices_list.append(
+                    numpy.repeat(other_vi, len(vi_elements)))
+            adj_elements_list.append(vi_elements)
+            adj_axes_list.append(numpy.repeat(axis, len(vi_elements)))
+
+    adj_vertices = numpy.hstack(adj_vertices_list)
+    adj_elements = numpy.hstack(adj_elements_list)
+    adj_axes = numpy.hstack(adj_axes_list)
+
+    order = numpy.lexsort((adj_axes, adj_elements, adj_vertices))
+    adj_vertices = adj_vertices[order]
+    adj_elements = adj_elements[order]
+    adj_axes = adj_axes[order]
+
+    unique = numpy.ones(len(adj_vertices), dtype=bool)
+    unique[1:] = ((adj_vertices[1:] != adj_vertices[:-1])
+            | (adj_elements[1:] != adj_elements[:-1])
+            | (adj_axes[1:] != adj_axes[:-1]))
+    adj_vertices = adj_vertices[unique]
+
+    # per-element minimum vertex distance -------------------------------------
+    vertex_diffs = el_points[:, :, numpy.newaxis, :] - el_points[:, numpy.newaxis, :, :]
+    vertex_dists = numpy.sqrt(numpy.sum(vertex_diffs**2, axis=3))
+    vertex_dists[:, numpy.arange(vertices_per_el),
+            numpy.arange(vertices_per_el)] = numpy.inf
+
+    return {
+            "inverse_maps": numpy.concatenate(
+                [inv_mat, inv_vec[:, :, numpy.newaxis]], axis=2),
+            "jacobians": numpy.abs(la.det(fwd_mat)),
+            "face_normals": normals,
+            "face_neighbors": face_neighbors,
+            "face_periodicity_axes": face_periodicity_axes,
+            "face_plane_eqn_rhs": face_plane_eqn_rhs,
+            "face_centroids": face_centroids,
+            "face_radii": face_radii,
+            "vertex_adj_element_starts": numpy.searchsorted(adj_vertices,
+                numpy.arange(vertex_count+1)).astype(numpy.uint32),
+            "vertex_adj_elements": adj_elements[unique].astype(numpy.uint32),
+            "vertex_adj_periodicity_axes": adj_axes[unique].astype(numpy.uint32),
+            "min_vertex_distances": numpy.min(
+                vertex_dists.reshape(el_count, -1), axis=1),
+            }
+
+
+
+
+def get_mesh_hash(mesh, el_vertices):
+    """Return a hex digest identifying the geometry and connectivity of
+    C{mesh}, including its periodicity.
+    """
+    from hashlib import sha1
+    h = sha1()
+    h.update(str(MESH_ARRAYS_VERSION))
+    h.update(numpy.ascontiguousarray(mesh.points, dtype=numpy.float64).tostring())
+    h.update(el_vertices.tostring())
+    h.update(repr(mesh.periodicity))
+    h.update(repr(sorted(
+        (tuple(int(vi) for vi in fvi), tuple(int(vi) for vi in opp_fvi), axis)
+        for fvi, (opp_fvi, axis) in mesh.periodic_opposite_faces.iteritems())))
+    h.update(repr(sorted(
+        (int(vi), sorted((int(other_vi), axis) for other_vi, axis in opposite))
+        for vi, opposite in mesh.periodic_opposite_vertices.iteritems())))
+    return h.hexdigest()
+
+
+
+
+def get_cached_mesh_arrays(mesh, cache_dir=None):
+    """Return the result of L{make_mesh_arrays} for C{mesh}. If C{cache_dir}
+    is given, the arrays are read from a file in it named after the
+    L{get_mesh_hash} of C{mesh} if one exists, and written there otherwise.
+    """
+    el_vertices = get_element_vertices(mesh)
+
+    if cache_dir is None:
+        arrays = make_mesh_arrays(mesh, el_vertices)
+    else:
+        import os
+        from pyrticle.checkpoint import write_checkpoint, Checkpoint
+
+        cache_file = os.path.join(cache_dir,
+                "meshdata-%s.pcp" % get_mesh_hash(mesh, el_vertices))
+
+        if os.path.exists(cache_file):
+            arrays = Checkpoint(cache_file).get_arrays_with_prefix("", mmap=False)
+        else:
+            arrays = make_mesh_arrays(mesh, el_vertices)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            write_checkpoint(cache_file, {"version": MESH_ARRAYS_VERSION}, arrays)
+
+    arrays["el_vertices"] = el_vertices
+    return arrays
+
+
+
+
 class MeshData(_internal.MeshData):
     __metaclass__ = monkeypatch_class
 
-    def fill_from_hedge(self, discr):
+    def fill_from_hedge(self, discr, cache_dir=None):
+        """Set up the mesh data from the hedge discretization C{discr}.
+
+        The mesh-dependent part is computed by L{make_mesh_arrays} and, if
+        C{cache_dir} is given, cached there, see L{get_cached_mesh_arrays}.
+        """
         self.discr = discr
+        mesh = discr.mesh
 
         # add periodicity -----------------------------------------------------
         from pyrticle._internal import PeriodicityAxis
         for axis, ((ax_min, ax_max), periodicity_tags) in enumerate(zip(
-                zip(*discr.mesh.bounding_box()), discr.mesh.periodicity)):
+                zip(*mesh.bounding_box()), mesh.periodicity)):
             pa = PeriodicityAxis()
             if periodicity_tags is not None:
                 pa.min = ax_min
@@ -50,103 +282,56 @@ class MeshData(_internal.MeshData):
                 pa.max = 0
             self.periodicities.append(pa)
 
-        # add elements --------------------------------------------------------
-        mesh = discr.mesh
-
-        neighbor_map = {}
-        for face, (e2, f2) in discr.mesh.both_interfaces():
-            neighbor_map[face] = e2.id
-        from hedge.mesh import TAG_ALL
-        for face in discr.mesh.tag_to_boundary[TAG_ALL]:
-            neighbor_map[face] = MeshData.INVALID_ELEMENT
-
-        from pyrticle._internal import ElementInfo, FaceInfo
-
-        self.element_info.reserve(len(mesh.elements))
-        for i, el in enumerate(mesh.elements):
-            ei = ElementInfo()
-            ei.id = i
-            ei.inverse_map = el.inverse_map
-            ei.norm_forward_map = la.norm(el.map.matrix, 2)
-            ei.jacobian = abs(el.map.jacobian())
-            el_range = discr.find_el_range(el.id)
-            ei.start, ei.end = el_range.start, el_range.stop
-
-            ei.vertices.extend([int(vi) for vi in el.vertex_indices])
-
-            all_face_vertex_indices = el.face_vertices(el.vertex_indices)
-
-            for face_idx, face_normal in enumerate(el.face_normals):
-                fi = FaceInfo()
-                fi.normal = face_normal
-                fi.neighbor = neighbor_map[el, face_idx] 
-
-                this_fvi = all_face_vertex_indices[face_idx]
-                try:
-                    fi.neighbor_periodicity_axis = mesh.periodic_opposite_faces[this_fvi][1]
-                except KeyError:
-                    fi.neighbor_periodicity_axis = MeshData.INVALID_AXIS
-
-                this_face_vertices = [mesh.points[fvi] 
-                        for fvi in all_face_vertex_indices[face_idx]]
-
-                rhs = [numpy.dot(face_normal, fv) for fv in this_face_vertices]
-                from pytools import all_roughly_equal, average
-                assert all_roughly_equal(rhs, 1e-14)
-
-                fi.face_plane_eqn_rhs = average(rhs)
-                fi.face_centroid = average(this_face_vertices)
-
-                fi.face_radius_from_centroid = max(
-                        la.norm(fv - fi.face_centroid) for fv in this_face_vertices)
-
-                ei.faces.append(fi)
-
-            self.element_info.append(ei)
-
-        # add vertices --------------------------------------------------------
-        vertex_to_element_map = {} # map vertex to (via_periodic, el_id)
+        # add elements and vertices -------------------------------------------
+        arrays = get_cached_mesh_arrays(mesh, cache_dir)
 
+        el_node_ranges = numpy.empty((len(mesh.elements), 2), dtype=numpy.uint32)
         for el in mesh.elements:
-            for vi in el.vertex_indices:
-                vertex_to_element_map.setdefault(vi, set()).add((
-                    _internal.MeshData.INVALID_AXIS, el.id))
-                for other_vi, per_axis in mesh.periodic_opposite_vertices.get(vi, []):
-                    vertex_to_element_map.setdefault(other_vi, set()).add((per_axis, el.id))
-
-        self.set_vertices(mesh.points)
-
-        from pyrticle._internal import UnsignedVector
-        self.vertex_adj_elements.reserve(
-                2*discr.dimensions*len(mesh.points))
-        self.vertex_adj_element_starts.reserve(len(mesh.points))
-        self.vertex_adj_element_starts.append(0)
-
-        for vi in xrange(len(mesh.points)):
-            adj_periodicity_axes, adj_ids = zip(*vertex_to_element_map[vi])
-            self.vertex_adj_elements.extend(adj_ids)
-            self.vertex_adj_periodicity_axes.extend(adj_periodicity_axes)
-            self.vertex_adj_element_starts.append(
-                    len(self.vertex_adj_elements))
+            el_range = discr.find_el_range(el.id)
+            el_node_ranges[el.id] = el_range.start, el_range.stop
+
+        def flat(name, dtype=numpy.float64):
+            return numpy.ascontiguousarray(arrays[name], dtype=dtype).ravel()
+
+        self.set_vertices(numpy.asarray(mesh.points, dtype=numpy.float64).ravel())
+        self.fill_from_arrays(
+                flat("el_vertices", numpy.uint32),
+                el_node_ranges.ravel(),
+                flat("inverse_maps"),
+                flat("jacobians"),
+                flat("face_normals"),
+                flat("face_neighbors", numpy.uint32),
+                flat("face_periodicity_axes", numpy.uint32),
+                flat("face_plane_eqn_rhs"),
+                flat("face_centroids"),
+                flat("face_radii"),
+                flat("vertex_adj_element_starts", numpy.uint32),
+                flat("vertex_adj_elements", numpy.uint32),
+                flat("vertex_adj_periodicity_axes", numpy.uint32),
+                )
+
+        self.min_vertex_distances = arrays["min_vertex_distances"]
 
         # add nodes -----------------------------------------------------------
         self.set_nodes(discr.nodes)
 
-    def min_vertex_distance_for_el(self, el):
-        vertices = [self.discr.mesh.points[vi] 
-                for vi in el.vertex_indices]
+    def mesh_hash(self):
+        """Return the L{get_mesh_hash} of the mesh this was filled from,
+        which identifies its element numbering as well as its geometry.
+        """
+        try:
+            return self._mesh_hash
+        except AttributeError:
+            mesh = self.discr.mesh
+            self._mesh_hash = get_mesh_hash(mesh, get_element_vertices(mesh))
+            return self._mesh_hash
 
-        return min(min(la.norm(vi-vj)
-                for i, vi in enumerate(vertices)
-                if i != j)
-                for j, vj in enumerate(vertices))
+    def min_vertex_distance_for_el(self, el):
+        return self.min_vertex_distances[el.id]
 
     def advisable_particle_radius(self):
-        vertex_distances = [self.min_vertex_distance_for_el(el) 
-                for el in self.discr.mesh.elements]
-        vertex_distances.sort()
+        vertex_distances = numpy.sort(self.min_vertex_distances)
         return 0.6 * vertex_distances[int(0.25*len(vertex_distances))]
 
     def min_vertex_distance(self):
-        return min(self.min_vertex_distance_for_el(el) 
-                for el in self.discr.mesh.elements)
+        return numpy.min(self.min_vertex_distances)
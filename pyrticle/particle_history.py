@@ -0,0 +1,416 @@
+"""Append-only particle history files with partial reads"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+import numpy
+
+
+
+
+# file format -----------------------------------------------------------------
+# A particle history is a directory containing
+#
+# - "header": a pickled dictionary with the keys "version", "quantities"
+#   (mapping quantity names to tuples (dtype string, per-particle shape)),
+#   "compression" (None or "zlib") and "block_size".
+# - "index": one record of _INDEX_DTYPE per dump. The index record is
+#   appended after all of the dump's data, so a dump whose record is
+#   incomplete or missing is ignored.
+# - for each quantity, "<name>.data": the dumps, one after the other. Each
+#   dump is split into blocks of block_size particles, which are compressed
+#   separately, so that a subset of particles can be read without
+#   decompressing the whole dump.
+# - for each quantity, "<name>.blocks": one record of _BLOCK_DTYPE per block.
+
+FORMAT_VERSION = 1
+
+_INDEX_DTYPE = numpy.dtype([
+    ("step", "<i8"), ("t", "<f8"), ("particle_count", "<u8")])
+_BLOCK_DTYPE = numpy.dtype([
+    ("offset", "<u8"), ("nbytes", "<u8")])
+
+
+
+
+def _read_header(dirname):
+    from cPickle import load
+    import os.path
+
+    inf = open(os.path.join(dirname, "header"), "rb")
+    try:
+        header = load(inf)
+    finally:
+        inf.close()
+
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError("particle history '%s' has unsupported format "
+                "version %d" % (dirname, header["version"]))
+
+    return header
+
+
+
+
+def _read_records(filename, dtype):
+    """Read all complete records of C{dtype} from C{filename}."""
+    import os.path
+    if not os.path.exists(filename):
+        return numpy.zeros((0,), dtype=dtype)
+
+    count = os.path.getsize(filename) // dtype.itemsize
+    inf = open(filename, "rb")
+    try:
+        return numpy.fromfile(inf, dtype=dtype, count=count)
+    finally:
+        inf.close()
+
+
+
+
+def _block_counts(particle_counts, block_size):
+    return (particle_counts.astype(numpy.int64) + block_size - 1) // block_size
+
+
+
+
+def _check_quantity_name(name):
+    import re
+    if re.match(r"^[A-Za-z0-9_]+$", name) is None:
+        raise ValueError("invalid particle history quantity name '%s'" % name)
+
+
+
+
+# writing ---------------------------------------------------------------------
+class ParticleHistoryWriter(object):
+    """Appends dumps of per-particle quantities to the particle history in
+    the directory C{dirname}.
+
+    If C{dirname} already holds a particle history, new dumps are appended
+    to it. In that case, dumps for steps at or after C{discard_from_step}
+    are dropped first, which is what is wanted when restarting from a
+    checkpoint. C{compress} and C{block_size} only apply to new histories.
+    """
+
+    def __init__(self, dirname, compress=True, block_size=65536,
+            discard_from_step=None):
+        import os.path
+
+        self.dirname = dirname
+
+        if os.path.exists(os.path.join(dirname, "header")):
+            header = _read_header(dirname)
+            self.quantities = header["quantities"]
+            self.compression = header["compression"]
+            self.block_size = header["block_size"]
+
+            index = _read_records(self._index_filename(), _INDEX_DTYPE)
+            if discard_from_step is not None:
+                discard = numpy.flatnonzero(index["step"] >= discard_from_step)
+                if len(discard):
+                    index = index[:discard[0]]
+
+            self._truncate(index)
+        else:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+            # the header is written along with the first dump
+            self.quantities = None
+            if compress:
+                self.compression = "zlib"
+            else:
+                self.compression = None
+            self.block_size = block_size
+
+    def _index_filename(self):
+        import os.path
+        return os.path.join(self.dirname, "index")
+
+    def _data_filename(self, name):
+        import os.path
+        return os.path.join(self.dirname, name+".data")
+
+    def _blocks_filename(self, name):
+        import os.path
+        return os.path.join(self.dirname, name+".blocks")
+
+    def _truncate(self, index):
+        """Drop everything written after the dumps in C{index}, including
+        the remains of an interrupted dump.
+        """
+        block_count = int(numpy.sum(
+            _block_counts(index["particle_count"], self.block_size)))
+
+        for name in self.quantities:
+            blocks = _read_records(self._blocks_filename(name), _BLOCK_DTYPE)
+            if len(blocks) < block_count:
+                raise RuntimeError("particle history '%s' is corrupt: "
+                        "quantity '%s' has too few blocks" % (self.dirname, name))
+
+            if block_count:
+                last = blocks[block_count-1]
+                data_size = int(last["offset"] + last["nbytes"])
+            else:
+                data_size = 0
+
+            for filename, size in [
+                    (self._blocks_filename(name), block_count*_BLOCK_DTYPE.itemsize),
+                    (self._data_filename(name), data_size),
+                    ]:
+                outf = open(filename, "ab")
+                try:
+                    outf.truncate(size)
+                finally:
+                    outf.close()
+
+        outf = open(self._index_filename(), "ab")
+        try:
+            outf.truncate(len(index)*_INDEX_DTYPE.itemsize)
+        finally:
+            outf.close()
+
+    def _write_header(self):
+        from cPickle import dump
+        import os.path
+
+        outf = open(os.path.join(self.dirname, "header"), "wb")
+        try:
+            dump({
+                "version": FORMAT_VERSION,
+                "quantities": self.quantities,
+                "compression": self.compression,
+                "block_size": self.block_size,
+                }, outf, 2)
+        finally:
+            outf.close()
+
+    def append(self, step, t, quantities):
+        """Append a dump of C{quantities}, a dictionary mapping names to
+        arrays whose first axis runs over the particles.
+
+        All dumps in a history must have the same quantities with the same
+        dtypes and per-particle shapes.
+        """
+        import os.path
+
+        particle_counts = set(len(ary) for ary in quantities.itervalues())
+        if len(particle_counts) != 1:
+            raise ValueError("particle history quantities differ in length")
+        particle_count, = particle_counts
+
+        if self.quantities is None:
+            for name in quantities:
+                _check_quantity_name(name)
+            self.quantities = dict(
+                    (name, (numpy.asarray(ary).dtype.str,
+                        numpy.asarray(ary).shape[1:]))
+                    for name, ary in quantities.iteritems())
+            self._write_header()
+        elif set(quantities) != set(self.quantities):
+            raise ValueError("particle history quantities changed: "
+                    "expected %s, got %s" % (
+                        ", ".join(sorted(self.quantities)),
+                        ", ".join(sorted(quantities))))
+
+        for name, ary in quantities.iteritems():
+            dtype, shape = self.quantities[name]
+            ary = numpy.ascontiguousarray(ary, dtype=dtype)
+            if ary.shape[1:] != shape:
+                raise ValueError("particle history quantity '%s' has "
+                        "per-particle shape %s, expected %s" % (
+                            name, ary.shape[1:], shape))
+
+            data_filename = self._data_filename(name)
+            if os.path.exists(data_filename):
+                offset = os.path.getsize(data_filename)
+            else:
+                offset = 0
+
+            blocks = []
+            outf = open(data_filename, "ab")
+            try:
+                for start in xrange(0, particle_count, self.block_size):
+                    buf = ary[start:start+self.block_size].tostring()
+                    if self.compression == "zlib":
+                        from zlib import compress
+                        buf = compress(buf, 1)
+                    outf.write(buf)
+                    blocks.append((offset, len(buf)))
+                    offset += len(buf)
+            finally:
+                outf.close()
+
+            outf = open(self._blocks_filename(name), "ab")
+            try:
+                numpy.array(blocks, dtype=_BLOCK_DTYPE).tofile(outf)
+            finally:
+                outf.close()
+
+        outf = open(self._index_filename(), "ab")
+        try:
+            numpy.array([(step, t, particle_count)], dtype=_INDEX_DTYPE).tofile(outf)
+        finally:
+            outf.close()
+
+
+
+
+def get_particle_quantities(state):
+    """Return copies of the particle quantities of the L{PicState}
+    C{state} in the form expected by L{ParticleHistoryWriter.append}.
+    """
+    return {
+            "positions": numpy.array(state.positions),
+            "momenta": numpy.array(state.momenta),
+            "charges": numpy.array(state.charges),
+            "masses": numpy.array(state.masses),
+            }
+
+
+
+
+# reading ---------------------------------------------------------------------
+class ParticleHistory(object):
+    """Read access to a particle history written by L{ParticleHistoryWriter}.
+
+    Dumps are identified by their position in the history, starting at
+    zero; L{dump_index} finds the position of a step. Only the blocks of
+    a dump that hold the requested particles are read and decompressed.
+
+    Note that particle numbers are not stable across dumps if particles
+    are lost, since the last particle is moved into the place of a lost
+    one.
+    """
+
+    def __init__(self, dirname):
+        import os.path
+
+        self.dirname = dirname
+
+        header = _read_header(dirname)
+        self.quantities = header["quantities"]
+        self.compression = header["compression"]
+        self.block_size = header["block_size"]
+
+        index = _read_records(os.path.join(dirname, "index"), _INDEX_DTYPE)
+        self.steps = index["step"]
+        self.times = index["t"]
+        self.particle_counts = index["particle_count"].astype(numpy.int64)
+
+        block_counts = _block_counts(self.particle_counts, self.block_size)
+        self.first_blocks = numpy.cumsum(block_counts) - block_counts
+
+        self._blocks = {}
+
+    def __len__(self):
+        return len(self.steps)
+
+    def quantity_names(self):
+        return self.quantities.keys()
+
+    def dump_index(self, step):
+        indices = numpy.flatnonzero(self.steps == step)
+        if not len(indices):
+            raise KeyError("no dump for step %d" % step)
+        return int(indices[-1])
+
+    def _get_blocks(self, name):
+        try:
+            return self._blocks[name]
+        except KeyError:
+            import os.path
+            result = self._blocks[name] = _read_records(
+                    os.path.join(self.dirname, name+".blocks"), _BLOCK_DTYPE)
+            return result
+
+    def _particle_numbers(self, particles, particle_count):
+        if particles is None:
+            particles = slice(None)
+
+        if isinstance(particles, slice):
+            return numpy.arange(*particles.indices(particle_count))
+        else:
+            pnums = numpy.asarray(particles, dtype=numpy.int64)
+            pnums = numpy.where(pnums < 0, pnums + particle_count, pnums)
+            if len(pnums) and (pnums.min() < 0 or pnums.max() >= particle_count):
+                raise IndexError("particle number out of range")
+            return pnums
+
+    def read(self, name, dump, particles=None):
+        """Return the quantity C{name} in the dump with index C{dump}.
+
+        C{particles} may be C{None} (all particles), a slice or an array
+        of particle numbers.
+        """
+        import os.path
+
+        dtype, shape = self.quantities[name]
+        dtype = numpy.dtype(dtype)
+
+        pnums = self._particle_numbers(particles, int(self.particle_counts[dump]))
+        result = numpy.empty((len(pnums),) + shape, dtype=dtype)
+        if not len(pnums):
+            return result
+
+        blocks = self._get_blocks(name)
+        block_numbers = pnums // self.block_size
+
+        inf = open(os.path.join(self.dirname, name+".data"), "rb")
+        try:
+            for block_nr in numpy.unique(block_numbers):
+                offset, nbytes = blocks[self.first_blocks[dump] + block_nr]
+                inf.seek(int(offset))
+                buf = inf.read(int(nbytes))
+                if self.compression == "zlib":
+                    from zlib import decompress
+                    buf = decompress(buf)
+                block_data = numpy.frombuffer(buf, dtype=dtype).reshape(
+                        (-1,) + shape)
+
+                in_block = block_numbers == block_nr
+                result[in_block] = block_data[
+                        pnums[in_block] - block_nr*self.block_size]
+        finally:
+            inf.close()
+
+        return result
+
+    def read_dump(self, dump, names=None, particles=None):
+        """Return a dictionary mapping the quantities C{names} (default:
+        all) to their values in the dump with index C{dump}.
+        """
+        if names is None:
+            names = self.quantity_names()
+        return dict((name, self.read(name, dump, particles)) for name in names)
+
+    def iter_quantity(self, name, dumps=None, particles=None):
+        """Yield tuples C{(step, t, value)} of the quantity C{name} for the
+        dumps with indices C{dumps} (default: all).
+        """
+        if dumps is None:
+            dumps = xrange(len(self))
+
+        for dump in dumps:
+            yield (int(self.steps[dump]), float(self.times[dump]),
+                    self.read(name, dump, particles))
@@ -0,0 +1,420 @@
+"""Histograms of the particle distribution, streamed to a compact log"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+import numpy
+
+
+
+
+# file format -----------------------------------------------------------------
+# A phase space history is a directory containing
+#
+# - "header": a pickled dictionary with the keys "version" and
+#   "histograms", a list of tuples (name, description, axes). axes is a
+#   list of tuples (label, unit, min, max, bins), one per histogram axis.
+#   The header is written once the ranges are known.
+# - "data": one record of the dtype returned by _record_dtype per dump,
+#   holding the step, the time, the number of particles and the counts of
+#   each histogram. An incomplete record at the end is ignored.
+
+FORMAT_VERSION = 1
+
+
+
+
+def _record_dtype(shapes):
+    """Return the record dtype for histograms given as a list of tuples
+    C{(name, shape)}.
+    """
+    return numpy.dtype(
+            [("step", "<i8"), ("t", "<f8"), ("particle_count", "<u8")]
+            + [(name, "<f8", tuple(shape)) for name, shape in shapes])
+
+
+
+
+def _read_header(dirname):
+    from cPickle import load
+    import os.path
+
+    inf = open(os.path.join(dirname, "header"), "rb")
+    try:
+        header = load(inf)
+    finally:
+        inf.close()
+
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError("phase space history '%s' has unsupported format "
+                "version %d" % (dirname, header["version"]))
+
+    return header
+
+
+
+
+# histograms ------------------------------------------------------------------
+class Histogram(object):
+    """A histogram of the particles over one or two quantities.
+
+    C{bins} gives the number of bins along each axis. C{ranges} gives a
+    tuple C{(min, max)} for each axis, or C{None} for a range of
+    C{range_sigmas} standard deviations about the mean, which is fixed
+    from the first state with particles the histogram is taken of (until
+    then, the histogram is empty). Since each rank determines its own
+    automatic ranges, give explicit ones if the histograms of several
+    ranks are to be added. Particles are counted with their weights, and
+    particles out of range are not counted.
+    """
+
+    def __init__(self, name, description, bins, ranges, range_sigmas):
+        self.name = name
+        self.description = description
+        self.bins = bins
+        self.ranges = ranges
+        self.range_sigmas = range_sigmas
+
+        self.axes = None
+
+    def get_axis_statistics(self, observer):
+        """Return a tuple C{(label, unit, mean, standard_deviation)} for
+        each axis, the latter two over the particles of C{observer.state}.
+        """
+        raise NotImplementedError
+
+    def get_axes(self, observer):
+        """Return a tuple C{(label, unit, min, max, bins)} for each axis,
+        determining automatic ranges from C{observer.state}.
+        """
+        result = []
+        for (label, unit, mean, std_dev), rng, bins in zip(
+                self.get_axis_statistics(observer), self.ranges, self.bins):
+            if rng is None:
+                half_width = self.range_sigmas*std_dev
+                if not half_width:
+                    half_width = abs(mean) or 1
+                rng = (mean-half_width, mean+half_width)
+
+            result.append((label, unit, float(rng[0]), float(rng[1]), int(bins)))
+
+        return result
+
+    def accumulate(self, observer):
+        """Return the histogram of C{observer.state} over L{axes} as a
+        flat array.
+        """
+        raise NotImplementedError
+
+    def __call__(self, observer):
+        if self.axes is None:
+            if not len(observer.state):
+                return numpy.zeros(self.bins)
+            self.axes = self.get_axes(observer)
+
+        return self.accumulate(observer).reshape(
+                tuple(ax[4] for ax in self.axes))
+
+
+
+
+class PositionHistogram(Histogram):
+    """The particle density along the position axis C{axis}."""
+
+    def __init__(self, axis, bins=256, range=None, range_sigmas=4, name=None):
+        from hedge.log import axis_name
+        if name is None:
+            name = "n_%s" % axis_name(axis)
+
+        Histogram.__init__(self, name,
+                "Particle density along %s" % axis_name(axis),
+                (bins,), [range], range_sigmas)
+        self.axis = axis
+
+    def get_axis_statistics(self, observer):
+        from hedge.log import axis_name
+        moments = observer.beam_moments()
+        return [(axis_name(self.axis), "m",
+            moments.mean_position[self.axis],
+            moments.position_variance[self.axis]**0.5)]
+
+    def accumulate(self, observer):
+        from pyrticle._internal import position_histogram
+        label, unit, lower, upper, bins = self.axes[0]
+        return position_histogram(observer.state.particle_state,
+                self.axis, lower, upper, bins)
+
+
+
+
+class EnergyHistogram(Histogram):
+    """The distribution of the kinetic energy per particle. Automatic
+    ranges do not extend below zero.
+    """
+
+    def __init__(self, bins=256, range=None, range_sigmas=4, name="n_W"):
+        Histogram.__init__(self, name, "Kinetic energy distribution",
+                (bins,), [range], range_sigmas)
+
+    def get_axis_statistics(self, observer):
+        state = observer.state
+        if state.weights is None:
+            moments = observer.beam_moments()
+            return [("W", "J",
+                moments.mean_kinetic_energy,
+                moments.kinetic_energy_variance**0.5)]
+        else:
+            # the moments are those of the macroparticles
+            from pyrticle._internal import kinetic_energies
+            energies = kinetic_energies(state.particle_state,
+                    observer.method.units.VACUUM_LIGHT_SPEED()) / state.weights
+            if not len(energies):
+                return [("W", "J", 0, 0)]
+            return [("W", "J", numpy.mean(energies), numpy.std(energies))]
+
+    def get_axes(self, observer):
+        axes = Histogram.get_axes(self, observer)
+        if self.ranges[0] is None:
+            label, unit, lower, upper, bins = axes[0]
+            axes[0] = (label, unit, max(lower, 0), upper, bins)
+        return axes
+
+    def accumulate(self, observer):
+        from pyrticle._internal import energy_histogram
+        label, unit, lower, upper, bins = self.axes[0]
+        return energy_histogram(observer.state.particle_state,
+                observer.method.units.VACUUM_LIGHT_SPEED(), lower, upper, bins)
+
+
+
+
+class TraceSpaceHistogram(Histogram):
+    """The particle distribution over position along C{axis} and slope
+    C{p_axis/p_beam_axis}, i.e. the M{x-x'} trace space.
+    """
+
+    def __init__(self, axis, beam_axis, bins=(64, 64), ranges=(None, None),
+            range_sigmas=4, name=None):
+        from hedge.log import axis_name
+        if name is None:
+            name = "n_%s_%sp" % (axis_name(axis), axis_name(axis))
+
+        Histogram.__init__(self, name,
+                "Trace space distribution along %s" % axis_name(axis),
+                tuple(bins), list(ranges), range_sigmas)
+        self.axis = axis
+        self.beam_axis = beam_axis
+
+    def get_axis_statistics(self, observer):
+        from hedge.log import axis_name
+        moments = observer.beam_moments(self.beam_axis)
+        return [
+                (axis_name(self.axis), "m",
+                    moments.mean_position[self.axis],
+                    moments.position_variance[self.axis]**0.5),
+                (axis_name(self.axis)+"'", "rad",
+                    moments.mean_slope[self.axis],
+                    moments.slope_variance[self.axis]**0.5),
+                ]
+
+    def accumulate(self, observer):
+        from pyrticle._internal import trace_space_histogram
+        (x_label, x_unit, x_min, x_max, x_bins), \
+                (xp_label, xp_unit, xp_min, xp_max, xp_bins) = self.axes
+        return trace_space_histogram(observer.state.particle_state,
+                self.axis, self.beam_axis,
+                x_min, x_max, x_bins, xp_min, xp_max, xp_bins)
+
+
+
+
+def make_default_histograms(dimensions_pos, dimensions_velocity, beam_axis):
+    """Return the energy distribution and, if C{beam_axis} is given, the
+    longitudinal density and the trace space distributions of the
+    transverse axes, or else the density along each axis.
+    """
+    if beam_axis is None:
+        result = [PositionHistogram(axis) for axis in range(dimensions_pos)]
+    else:
+        result = []
+        if beam_axis < dimensions_pos:
+            result.append(PositionHistogram(beam_axis))
+
+    result.append(EnergyHistogram())
+
+    if beam_axis is not None:
+        result.extend(TraceSpaceHistogram(axis, beam_axis)
+                for axis in range(min(dimensions_pos, dimensions_velocity))
+                if axis != beam_axis)
+
+    return result
+
+
+
+
+# writing ---------------------------------------------------------------------
+class PhaseSpaceHistoryWriter(object):
+    """Appends the L{Histogram}s C{histograms} of the particles to the
+    phase space history in the directory C{dirname}.
+
+    If C{dirname} already holds a phase space history, new dumps are
+    appended to it, reusing its histogram ranges. In that case, dumps for
+    steps at or after C{discard_from_step} are dropped first, which is
+    what is wanted when restarting from a checkpoint.
+    """
+
+    def __init__(self, dirname, histograms, discard_from_step=None):
+        import os.path
+
+        self.dirname = dirname
+        self.histograms = histograms
+
+        names = [hist.name for hist in histograms]
+        if len(set(names)) != len(names):
+            raise ValueError("phase space histogram names are not unique")
+
+        self.dtype = _record_dtype(
+                [(hist.name, hist.bins) for hist in histograms])
+
+        self.header_written = os.path.exists(os.path.join(dirname, "header"))
+        if self.header_written:
+            header = _read_header(dirname)
+            if [(name, tuple(ax[4] for ax in axes))
+                    for name, description, axes in header["histograms"]] \
+                            != [(hist.name, tuple(hist.bins))
+                                    for hist in histograms]:
+                raise ValueError("phase space history '%s' holds different "
+                        "histograms" % dirname)
+
+            for hist, (name, description, axes) in zip(
+                    histograms, header["histograms"]):
+                hist.axes = axes
+        elif not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        if os.path.exists(self._data_filename()):
+            from pyrticle.particle_history import _read_records
+            records = _read_records(self._data_filename(), self.dtype)
+            if discard_from_step is not None:
+                discard = numpy.flatnonzero(records["step"] >= discard_from_step)
+                if len(discard):
+                    records = records[:discard[0]]
+
+            # also drops the remains of an interrupted dump
+            outf = open(self._data_filename(), "ab")
+            try:
+                outf.truncate(len(records)*self.dtype.itemsize)
+            finally:
+                outf.close()
+
+    def _data_filename(self):
+        import os.path
+        return os.path.join(self.dirname, "data")
+
+    def _write_header(self):
+        from cPickle import dump
+        import os.path
+
+        outf = open(os.path.join(self.dirname, "header"), "wb")
+        try:
+            dump({
+                "version": FORMAT_VERSION,
+                "histograms": [(hist.name, hist.description, hist.axes)
+                    for hist in self.histograms],
+                }, outf, 2)
+        finally:
+            outf.close()
+
+    def make_record(self, step, t, observer):
+        """Take the histograms of C{observer.state} and return them as
+        a record for L{append}.
+        """
+        values = [hist(observer) for hist in self.histograms]
+
+        if not self.header_written and not [hist
+                for hist in self.histograms if hist.axes is None]:
+            self._write_header()
+            self.header_written = True
+
+        record = numpy.zeros((1,), dtype=self.dtype)
+        record["step"] = step
+        record["t"] = t
+        record["particle_count"] = len(observer.state)
+        for hist, value in zip(self.histograms, values):
+            record[hist.name] = value
+
+        return record
+
+    def append(self, record):
+        """Append a record returned by L{make_record}. Only this
+        method writes to the data file, so it may run in a background
+        thread.
+        """
+        outf = open(self._data_filename(), "ab")
+        try:
+            record.tofile(outf)
+        finally:
+            outf.close()
+
+
+
+
+# reading ---------------------------------------------------------------------
+class PhaseSpaceHistory(object):
+    """Read access to a phase space history written by
+    L{PhaseSpaceHistoryWriter}.
+    """
+
+    def __init__(self, dirname):
+        import os.path
+        from pyrticle.particle_history import _read_records
+
+        header = _read_header(dirname)
+        self.histogram_names = [name
+                for name, description, axes in header["histograms"]]
+        self.descriptions = dict((name, description)
+                for name, description, axes in header["histograms"])
+        self.axes = dict((name, axes)
+                for name, description, axes in header["histograms"])
+
+        self.records = _read_records(os.path.join(dirname, "data"),
+                _record_dtype([(name, [ax[4] for ax in axes])
+                    for name, description, axes in header["histograms"]]))
+        self.steps = self.records["step"]
+        self.times = self.records["t"]
+        self.particle_counts = self.records["particle_count"].astype(numpy.int64)
+
+    def __len__(self):
+        return len(self.records)
+
+    def read(self, name):
+        """Return the histogram C{name} of all dumps, as an array whose
+        first axis runs over the dumps.
+        """
+        return self.records[name]
+
+    def get_bin_edges(self, name):
+        """Return an array of bin edges for each axis of histogram
+        C{name}.
+        """
+        return [numpy.linspace(lower, upper, bins+1)
+                for label, unit, lower, upper, bins in self.axes[name]]
@@ -59,11 +59,20 @@ class Pusher(object):
     def upkeep(self, state):
         pass
 
+    def get_checkpoint_data(self, state):
+        """Return a dictionary mapping names to numpy arrays that suffice
+        to restore C{state.pusher_state}.
+        """
+        return {}
+
+    def set_checkpoint_data(self, state, data):
+        pass
+
     def _forces(self, state, velocities, *field_args):
         return self.backend.forces(
                 ps=state.particle_state,
                 velocities=velocities,
-                vis_listener=state.vis_listener,
+                vis_listener=self.method.get_vis_listener(state),
                 *field_args
                 )
 
@@ -183,6 +192,7 @@ class AverageParticlePusher(Pusher):
 
         mgr.add_quantity(AverageEFieldStdDeviation(observer))
         mgr.add_quantity(AverageBFieldStdDeviation(observer))
+        self.method.note_logged_diagnostics()
 
         from pyrticle.log import StatsGathererLogQuantity
         mgr.add_quantity(StatsGathererLogQuantity(
@@ -203,5 +213,5 @@ class AverageParticlePusher(Pusher):
                 depositor=self.method.depositor.backend,
                 depositor_state=state.depositor_state,
                 velocities=velocities,
-                vis_listener=state.vis_listener,
+                vis_listener=self.method.get_vis_listener(state),
                 *field_args)
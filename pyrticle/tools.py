@@ -1,5 +1,7 @@
 """Little bits of usefulness for Pyrticle"""
 
+from __future__ import division
+
 __copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
 
 __license__ = """
@@ -163,7 +165,7 @@ class NumberShiftableVector(_internal.NumberShiftListener):
         if new_size > old_size:
             new_shape = list(self.vector.shape)
             new_shape[0] = new_size
-            new_vector = numpy.empty(
+            new_vector = numpy.zeros(
                     new_shape,
                     dtype=self.vector.dtype)
             new_vector[:old_size] = self.vector
@@ -181,16 +183,44 @@ class NumberShiftableVector(_internal.NumberShiftListener):
 
 
 # math stuff ------------------------------------------------------------------
-def uniform_on_unit_sphere(dim):
-    from random import gauss
+def make_random_state(seed=None):
+    """Return a C{numpy.random.RandomState} for C{seed}.
+
+    C{seed} may also be a C{RandomState} or a L{QuasiRandomDraws}, which is
+    returned unchanged. If
+    it is C{None}, the seed is drawn from the standard C{random} module, so
+    that setups calling C{random.seed} keep drawing the same numbers.
+    """
+    if isinstance(seed, (numpy.random.RandomState, QuasiRandomDraws)):
+        return seed
+
+    if seed is None:
+        from random import getrandbits
+        seed = getrandbits(32)
+
+    return numpy.random.RandomState(seed)
+
+
+
+
+def uniform_on_unit_sphere(dim, count=None, rng=None):
+    """Return a point uniformly distributed on the unit sphere in C{dim}
+    dimensions, or, if C{count} is given, a C{(count, dim)} array of such
+    points drawn from the C{numpy.random.RandomState} C{rng}.
+    """
 
     # cf.
     # http://www-alg.ist.hokudai.ac.jp/~jan/randsphere.pdf
     # Algorith due to Knuth
 
-    pt = numpy.array([gauss(0,1) for i in range(dim)])
-    n2 = la.norm(pt)
-    return pt/n2
+    if count is None:
+        from random import gauss
+        pt = numpy.array([gauss(0,1) for i in range(dim)])
+        n2 = la.norm(pt)
+        return pt/n2
+    else:
+        pts = make_random_state(rng).standard_normal((count, dim))
+        return pts/numpy.sqrt(numpy.sum(pts**2, axis=1))[:, numpy.newaxis]
 
 
 
@@ -259,6 +289,146 @@ class ODEDefinedFunction:
 
 
 
+# quasi-random numbers --------------------------------------------------------
+def get_primes(count):
+    """Return a list of the first C{count} primes."""
+    primes = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+
+
+class HaltonSequence(object):
+    """A scrambled Halton sequence in arbitrarily many dimensions.
+
+    Dimension M{i} is the radical inverse in the M{i}-th prime base with
+    its digits put through a random permutation that keeps zero in place.
+    The scrambling removes the correlation between high dimensions that
+    the plain Halton sequence suffers from.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = make_random_state(seed)
+        self.bases = []
+        self.permutations = []
+
+    def _extend(self, dimensions):
+        if dimensions <= len(self.bases):
+            return
+
+        self.bases = get_primes(dimensions)
+        for base in self.bases[len(self.permutations):]:
+            self.permutations.append(numpy.hstack(
+                ([0], 1+self.rng.permutation(base-1))))
+
+    def __call__(self, indices, dimension):
+        """Return the coordinate C{dimension} of the sequence points with
+        the integer array C{indices}.
+        """
+        self._extend(dimension+1)
+        base = self.bases[dimension]
+        permutation = self.permutations[dimension]
+
+        indices = numpy.array(indices, dtype=numpy.int64)
+        result = numpy.zeros(indices.shape)
+        scale = 1/base
+        while indices.any():
+            result += permutation[indices % base]*scale
+            indices //= base
+            scale /= base
+
+        return result
+
+
+
+
+def inverse_normal_cdf(p):
+    """Return the quantiles of the standard normal distribution for the
+    probabilities in the array C{p}, with a relative error below 1.2e-9.
+
+    Uses the rational approximation by Peter J. Acklam.
+    """
+    a = [-3.969683028665376e+01, 2.209460984245205e+02,
+            -2.759285104469687e+02, 1.383577518672690e+02,
+            -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02,
+            -1.556989798598866e+02, 6.680131188771972e+01,
+            -1.328068155288572e+01, 1]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01,
+            -2.400758277161838e+00, -2.549732539343734e+00,
+            4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01,
+            2.445134137142996e+00, 3.754408661907416e+00, 1]
+
+    p = numpy.asarray(p, dtype=numpy.float64)
+    result = numpy.empty(p.shape)
+
+    p_low = 0.02425
+    central = (p_low <= p) & (p <= 1-p_low)
+    q = p[central]-0.5
+    r = q*q
+    result[central] = q*numpy.polyval(a, r)/numpy.polyval(b, r)
+
+    # the tails are symmetric about p=1/2
+    tail = ~central
+    q = numpy.sqrt(-2*numpy.log(numpy.minimum(p[tail], 1-p[tail])))
+    result[tail] = numpy.where(p[tail] < 0.5, 1, -1) \
+            * numpy.polyval(c, q)/numpy.polyval(d, q)
+
+    return result
+
+
+
+
+class QuasiRandomDraws(object):
+    """Supplies the random numbers for one batch of particles from a
+    low-discrepancy sequence, in place of a C{numpy.random.RandomState}.
+
+    Particle M{i} of the batch is the sequence point with index
+    C{start+i}, and successive calls to L{random_sample} and
+    L{standard_normal} use successive dimensions of that point. If
+    C{mirror} is set, the second half of the batch uses the complements
+    M{1-u} of the numbers M{u} of the first half, so that each particle
+    has a partner placed symmetrically with respect to the distribution.
+    """
+
+    def __init__(self, sequence, start, count, mirror=False):
+        self.sequence = sequence
+        self.count = count
+        self.mirror = mirror
+        self.dimension = 0
+
+        if mirror:
+            self.indices = numpy.arange(start, start+(count+1)//2)
+        else:
+            self.indices = numpy.arange(start, start+count)
+
+    def random_sample(self, size):
+        count, dimensions = size
+        assert count == self.count, \
+                "quasi-random draws are only available for the whole batch"
+
+        result = numpy.empty((len(self.indices), dimensions))
+        for i in range(dimensions):
+            result[:, i] = self.sequence(self.indices, self.dimension)
+            self.dimension += 1
+
+        if self.mirror:
+            result = numpy.vstack((result, 1-result))[:count]
+
+        return result
+
+    def standard_normal(self, size):
+        return inverse_normal_cdf(self.random_sample(size))
+
+
+
+
 # shape function --------------------------------------------------------------
 PolynomialShapeFunction = _internal.PolynomialShapeFunction
 
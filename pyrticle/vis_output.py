@@ -0,0 +1,137 @@
+"""Visualization output in a background thread"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+import numpy
+
+
+
+
+def snapshot_field(field):
+    """Return a copy of C{field} that shares no storage with it. Object
+    arrays (as returned by hedge for vector fields) are copied component
+    by component.
+    """
+    if isinstance(field, numpy.ndarray):
+        if field.dtype == object:
+            result = numpy.empty(field.shape, dtype=object)
+            for i, subfield in enumerate(field.flat):
+                result.flat[i] = snapshot_field(subfield)
+            return result
+        else:
+            return field.copy()
+    elif isinstance(field, list):
+        return [snapshot_field(subfield) for subfield in field]
+    else:
+        return field
+
+
+
+
+class BackgroundVisualizationWriter(object):
+    """Runs visualization jobs in order in a single background thread.
+
+    Jobs are callables without arguments that must only touch data that
+    the caller will not modify afterwards, such as snapshots obtained from
+    L{pyrticle.cloud.PicMethod.make_vis_snapshot} and L{snapshot_field}.
+
+    At most C{max_pending} jobs wait in the queue in addition to the one
+    being executed. L{submit} blocks once that limit is reached, which
+    bounds the memory held by snapshots to C{max_pending+1} copies.
+
+    An exception raised by a job is re-raised in the submitting thread
+    by the next call to L{submit} or L{flush}.
+
+    Jobs run concurrently with the particle kernels (deposition, force
+    interpolation and element finding), which release the global
+    interpreter lock. Field solves and other Python-level work in the
+    main thread still take turns with the writer.
+    """
+
+    def __init__(self, max_pending=1):
+        from Queue import Queue
+        from threading import Thread
+
+        self.queue = Queue(max_pending)
+        self.exc_info = None
+
+        self.thread = Thread(target=self._work, name="pyrticle-vis")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+
+                if self.exc_info is None:
+                    try:
+                        job()
+                    except:
+                        import sys
+                        self.exc_info = sys.exc_info()
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self):
+        if self.exc_info is not None:
+            exc_type, exc_value, traceback = self.exc_info
+            self.exc_info = None
+            raise exc_type, exc_value, traceback
+
+    def submit(self, job):
+        self._check_error()
+        if not self.thread.isAlive():
+            raise RuntimeError("background visualization writer is closed")
+        self.queue.put(job)
+
+    def flush(self):
+        """Wait until all submitted jobs have completed."""
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        """Complete all submitted jobs and stop the background thread."""
+        if self.thread.isAlive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
+
+
+
+
+class SynchronousVisualizationWriter(object):
+    """Has the interface of L{BackgroundVisualizationWriter}, but runs jobs
+    immediately in the submitting thread.
+    """
+
+    def submit(self, job):
+        job()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
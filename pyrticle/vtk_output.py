@@ -0,0 +1,168 @@
+"""Binary VTK output of particle data"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007, 2008 Andreas Kloeckner"
+
+__license__ = """
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see U{http://www.gnu.org/licenses/}.
+"""
+
+
+
+
+import numpy
+
+
+
+
+VTK_VERTEX = 1
+
+_VTK_TYPE_NAMES = {
+        "f4": "Float32", "f8": "Float64",
+        "i1": "Int8", "u1": "UInt8",
+        "i2": "Int16", "u2": "UInt16",
+        "i4": "Int32", "u4": "UInt32",
+        "i8": "Int64", "u8": "UInt64",
+        }
+
+
+
+
+class _AppendedDataWriter(object):
+    """Collects the XML elements of a VTK XML file along with the arrays
+    they refer to in the raw appended data section.
+    """
+
+    def __init__(self):
+        self.arrays = []
+        self.offset = 0
+
+    def data_array(self, name, ary):
+        """Return a C{DataArray} element for C{ary}, which has shape
+        C{(n,)} or C{(n, ncomponents)}, and schedule C{ary} to be appended.
+        No copy is made if C{ary} is contiguous and little-endian.
+        """
+        ary = numpy.asarray(ary)
+        dtype = ary.dtype.newbyteorder("<")
+        ary = numpy.ascontiguousarray(ary, dtype=dtype)
+
+        try:
+            type_name = _VTK_TYPE_NAMES["%s%d" % (dtype.kind, dtype.itemsize)]
+        except KeyError:
+            raise ValueError("array '%s' has dtype %s, which cannot be "
+                    "written to VTK" % (name, ary.dtype))
+
+        if len(ary.shape) == 1:
+            components = 1
+        elif len(ary.shape) == 2:
+            components = ary.shape[1]
+        else:
+            raise ValueError("array '%s' has too many axes" % name)
+
+        result = ('<DataArray type="%s" Name="%s" NumberOfComponents="%d" '
+                'NumberOfTuples="%d" format="appended" offset="%d"/>' % (
+                    type_name, name, components, len(ary), self.offset))
+
+        self.arrays.append(ary)
+        self.offset += 8 + ary.nbytes
+        return result
+
+    def write_data(self, outf):
+        from struct import pack
+
+        outf.write('<AppendedData encoding="raw">\n_')
+        for ary in self.arrays:
+            outf.write(pack("<Q", ary.nbytes))
+            if ary.nbytes:
+                ary.tofile(outf)
+        outf.write('\n</AppendedData>\n')
+
+
+
+
+def write_particle_vtu(filename, positions, point_data=[],
+        time=None, step=None):
+    """Write particles as an unstructured grid of vertices to the VTK XML
+    file C{filename}, with all arrays in binary appended form.
+
+    C{positions} has shape C{(particle_count, dim)} with C{dim <= 3}.
+    C{point_data} is a list of tuples C{(name, value)}, where C{value}
+    has shape C{(particle_count,)} or C{(particle_count, ncomponents)}.
+    Since that is the layout of the particle state, arrays from it are
+    written as they are. Only positions with C{dim < 3} are padded.
+    """
+    particle_count, dim = positions.shape
+    if dim != 3:
+        points = numpy.zeros((particle_count, 3), dtype=positions.dtype)
+        points[:, :dim] = positions
+    else:
+        points = positions
+
+    cell_types = numpy.empty(particle_count, dtype=numpy.uint8)
+    cell_types.fill(VTK_VERTEX)
+
+    adw = _AppendedDataWriter()
+
+    xml = [
+            '<?xml version="1.0"?>',
+            '<VTKFile type="UnstructuredGrid" version="1.0" '
+            'byte_order="LittleEndian" header_type="UInt64">',
+            '<UnstructuredGrid>',
+            ]
+
+    field_data = []
+    if time is not None:
+        field_data.append(adw.data_array("TIME",
+            numpy.array([time], dtype=numpy.float64)))
+    if step is not None:
+        field_data.append(adw.data_array("CYCLE",
+            numpy.array([step], dtype=numpy.int64)))
+    if field_data:
+        xml.append('<FieldData>')
+        xml.extend(field_data)
+        xml.append('</FieldData>')
+
+    xml.extend([
+        '<Piece NumberOfPoints="%d" NumberOfCells="%d">' % (
+            particle_count, particle_count),
+        '<Points>',
+        adw.data_array("points", points),
+        '</Points>',
+        '<Cells>',
+        adw.data_array("connectivity",
+            numpy.arange(particle_count, dtype=numpy.int64)),
+        adw.data_array("offsets",
+            numpy.arange(1, particle_count+1, dtype=numpy.int64)),
+        adw.data_array("types", cell_types),
+        '</Cells>',
+        '<PointData>',
+        ])
+
+    for name, value in point_data:
+        xml.append(adw.data_array(name, value))
+
+    xml.extend([
+        '</PointData>',
+        '</Piece>',
+        '</UnstructuredGrid>',
+        ])
+
+    outf = open(filename, "wb")
+    try:
+        outf.write("\n".join(xml) + "\n")
+        adw.write_data(outf)
+        outf.write('</VTKFile>\n')
+    finally:
+        outf.close()
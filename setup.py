@@ -21,7 +21,7 @@
 def get_config_schema():
     from aksetup_helper import ConfigSchema, \
             IncludeDir, LibraryDir, Libraries, BoostLibraries, \
-            StringListOption, make_boost_base_options
+            Switch, StringListOption, make_boost_base_options
 
     return ConfigSchema(make_boost_base_options() + [
         BoostLibraries("python"),
@@ -33,6 +33,11 @@ def get_config_schema():
         LibraryDir("LAPACK", []),
         Libraries("LAPACK", ["lapack"]),
 
+        Switch("PHASE_TIMING", False,
+            "Compile per-phase timers into the C++ core"),
+        Switch("OPENMP", False,
+            "Use OpenMP threads for element finding"),
+
         StringListOption("CXXFLAGS", [],
             help="Any extra C++ compiler options to include"),
         ])
@@ -54,6 +59,8 @@ def main():
     EXTRA_INCLUDE_DIRS = []
     EXTRA_LIBRARY_DIRS = []
     EXTRA_LIBRARIES = []
+    EXTRA_COMPILE_ARGS = []
+    EXTRA_LINK_ARGS = []
 
     INCLUDE_DIRS = ["src/cpp"] \
             + conf["BOOST_BINDINGS_INC_DIR"] \
@@ -74,6 +81,14 @@ def main():
     handle_component("LAPACK")
     handle_component("BLAS")
 
+    if conf["PHASE_TIMING"]:
+        EXTRA_DEFINES["PYRTICLE_PHASE_TIMING"] = 1
+        EXTRA_LIBRARIES.append("rt")
+
+    if conf["OPENMP"]:
+        EXTRA_COMPILE_ARGS.append("-fopenmp")
+        EXTRA_LINK_ARGS.append("-fopenmp")
+
     setup(
             name="pyrticle",
             version="0.90",
@@ -102,7 +117,8 @@ def main():
                     include_dirs=INCLUDE_DIRS + EXTRA_INCLUDE_DIRS,
                     library_dirs=LIBRARY_DIRS + EXTRA_LIBRARY_DIRS,
                     libraries=LIBRARIES + EXTRA_LIBRARIES,
-                    extra_compile_args=conf["CXXFLAGS"],
+                    extra_compile_args=conf["CXXFLAGS"] + EXTRA_COMPILE_ARGS,
+                    extra_link_args=EXTRA_LINK_ARGS,
                     define_macros=list(EXTRA_DEFINES.iteritems()),
                     )]
                 )
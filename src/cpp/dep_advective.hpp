@@ -37,10 +37,10 @@
 #include <boost/numeric/bindings/traits/ublas_matrix.hpp>
 #include <boost/numeric/bindings/blas/blas3.hpp>
 #include <boost/typeof/std/utility.hpp>
-#include <boost/unordered_map.hpp>
 #include <pyublas/elementwise_op.hpp>
 #include <hedge/face_operators.hpp>
 #include "tools.hpp"
+#include "phase_timing.hpp"
 #include "meshdata.hpp"
 #include "dep_target.hpp"
 #include "dep_shape.hpp"
@@ -63,14 +63,14 @@ namespace pyrticle
 
       struct active_element
       {
-        const mesh_data::element_info *m_element_info;
+        mesh_data::element_number m_element_id;
         boost::array<mesh_data::element_number,
           advective_depositor::max_faces> m_connections;
         unsigned m_start_index;
         unsigned m_min_life;
 
         active_element()
-          : m_element_info(0)
+          : m_element_id(mesh_data::INVALID_ELEMENT)
         {
           for (unsigned i = 0; i < advective_depositor::max_faces; i++)
             m_connections[i] = mesh_data::INVALID_ELEMENT;
@@ -88,7 +88,7 @@ namespace pyrticle
             return 0;
           BOOST_FOREACH(active_element &el, m_elements)
           {
-            if (el.m_element_info->m_id == en)
+            if (el.m_element_id == en)
               return &el;
           }
           return 0;
@@ -100,7 +100,7 @@ namespace pyrticle
             return 0;
           BOOST_FOREACH(const active_element &el, m_elements)
           {
-            if (el.m_element_info->m_id == en)
+            if (el.m_element_id == en)
               return &el;
           }
           return 0;
@@ -196,24 +196,47 @@ namespace pyrticle
       boost::shared_ptr<face_group_type > m_int_face_group;
       boost::shared_ptr<face_group_type > m_bdry_face_group;
 
+      /** Locates the hedge face instance for one (element, face) pair.
+       *
+       * A face_pair represents both sides of a face. It points
+       * to one or two hedge::face instances in its face_group that
+       * carry information about each side of the face. The "ext" side
+       * of the face_pair may be unpopulated because of a boundary.
+       *
+       * m_is_face_b records which side of the face_pair the
+       * (element, face) pair this locator was built for refers to.
+       */
       struct face_pair_locator
       {
         face_group_type const *m_face_group;
         face_pair_type const *m_face_pair;
+        bool m_is_face_b;
 
         face_pair_locator()
-          : m_face_group(0), m_face_pair(0)
+          : m_face_group(0), m_face_pair(0), m_is_face_b(false)
         { }
 
         face_pair_locator(
             face_group_type     const &face_group,
-            face_pair_type      const &face_pair
+            face_pair_type      const &face_pair,
+            bool is_face_b
             )
-          : m_face_group(&face_group), m_face_pair(&face_pair)
+          : m_face_group(&face_group), m_face_pair(&face_pair),
+          m_is_face_b(is_face_b)
         { }
+
+        bool is_boundary() const
+        { return m_face_pair->ext_side.element_id == hedge::INVALID_ELEMENT; }
+
+        const face_pair_type::int_side_type &flux_face() const
+        { return m_is_face_b ? m_face_pair->ext_side : m_face_pair->int_side; }
+
+        const face_pair_type::int_side_type &external_flux_face() const
+        { return m_is_face_b ? m_face_pair->int_side : m_face_pair->ext_side; }
       };
 
-      boost::unordered_map<mesh_data::el_face, face_pair_locator> m_el_face_to_face_pair_locator;
+      /** Indexed by element_number*m_faces_per_element+face_number. */
+      std::vector<face_pair_locator> m_face_pair_locators;
 
       double m_activation_threshold;
       double m_kill_threshold;
@@ -260,28 +283,28 @@ namespace pyrticle
         m_int_face_group = int_face_group;
         m_bdry_face_group = bdry_face_group;
 
-        // build m_el_face_to_face_pair_locator
-        BOOST_FOREACH(const hedge::face_pair<hedge::straight_face> &fp,
+        // build m_face_pair_locators
+        m_face_pair_locators.resize(
+            m_mesh_data.element_count()*m_faces_per_element);
+
+        BOOST_FOREACH(const face_pair_type &fp,
             int_face_group->face_pairs)
         {
           const hedge::straight_face &f = fp.int_side;
-          m_el_face_to_face_pair_locator
-            [std::make_pair(f.element_id, f.face_id)] =
-            face_pair_locator(*int_face_group, fp);
+          m_face_pair_locators[f.element_id*m_faces_per_element+f.face_id] =
+            face_pair_locator(*int_face_group, fp, false);
 
           const hedge::straight_face &ext_f = fp.ext_side;
-          m_el_face_to_face_pair_locator
-            [std::make_pair(ext_f.element_id, ext_f.face_id)] =
-            face_pair_locator(*int_face_group, fp);
+          m_face_pair_locators[ext_f.element_id*m_faces_per_element+ext_f.face_id] =
+            face_pair_locator(*int_face_group, fp, true);
         }
 
         BOOST_FOREACH(const face_pair_type &fp,
             bdry_face_group->face_pairs)
         {
           const hedge::straight_face &f = fp.int_side;
-          m_el_face_to_face_pair_locator
-            [std::make_pair(f.element_id, f.face_id)] =
-            face_pair_locator(*bdry_face_group, fp);
+          m_face_pair_locators[f.element_id*m_faces_per_element+f.face_id] =
+            face_pair_locator(*bdry_face_group, fp, false);
         }
 
         m_activation_threshold = activation_threshold;
@@ -307,6 +330,16 @@ namespace pyrticle
       unsigned get_dimensions_mesh() const
       { return m_mesh_data.m_dimensions; }
 
+      const face_pair_locator &get_face_pair_locator(
+          mesh_data::element_number en, mesh_data::face_number fn) const
+      {
+        const face_pair_locator &result =
+          m_face_pair_locators[en*m_faces_per_element+fn];
+        if (result.m_face_group == 0)
+          throw std::logic_error("face pair locator not found");
+        return result;
+      }
+
 
 
 
@@ -317,7 +350,10 @@ namespace pyrticle
           const ParticleState &ps,
           Target &tgt, boost::python::slice const &pslice) const
       {
-        FOR_ALL_SLICE_INDICES(pslice, ps.particle_count)
+        FOR_ALL_SLICE_INDICES_PREP(pslice, ps.particle_count)
+        gil_release no_gil;
+
+        FOR_ALL_SLICE_INDICES_LOOP
         {
           FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
 
@@ -325,8 +361,8 @@ namespace pyrticle
           BOOST_FOREACH(const active_element &el,
               ds.m_advected_particles[pn].m_elements)
             tgt.add_shape_on_element(
-                el.m_element_info->m_id,
-                el.m_element_info->m_start,
+                el.m_element_id,
+                m_mesh_data.element_start(el.m_element_id),
                 subrange(ds.m_rho, el.m_start_index, el.m_start_index+m_dofs_per_element));
           tgt.end_particle(pn);
         }
@@ -371,10 +407,16 @@ namespace pyrticle
         if (m_kill_threshold == 0)
           throw std::runtime_error("zero kill threshold");
 
+        std::vector<bool> retire;
+
         particle_number pn = 0;
         BOOST_FOREACH(advected_particle &p, ds.m_advected_particles)
         {
-          double particle_charge = fabs(ps.charges[pn]);
+          // phase 1: decide which elements are to be retired
+          const double particle_charge = fabs(ps.charge(pn));
+          bool any_retired = false;
+
+          retire.assign(p.m_elements.size(), false);
           for (unsigned i_el = 0; i_el < p.m_elements.size(); ++i_el)
           {
             active_element &el = p.m_elements[i_el];
@@ -382,43 +424,57 @@ namespace pyrticle
             if (el.m_min_life)
               --el.m_min_life;
 
+            if (el.m_min_life)
+              continue;
+
             const double element_charge = element_l1(
-                el.m_element_info->m_jacobian,
+                m_mesh_data.jacobian(el.m_element_id),
                 subrange(
                   ds.m_rho,
                   el.m_start_index,
                   el.m_start_index+m_dofs_per_element));
 
-            if (el.m_min_life == 0  && element_charge / particle_charge < m_kill_threshold)
-            {
-              // retire this element
-              const hedge::element_number_t en = el.m_element_info->m_id;
+            if (element_charge / particle_charge < m_kill_threshold)
+              retire[i_el] = any_retired = true;
+          }
 
-              // kill connections
-              for (hedge::face_number_t fn = 0; fn < m_faces_per_element; ++fn)
-              {
-                hedge::element_number_t connected_en = el.m_connections[fn];
-                if (connected_en != hedge::INVALID_ELEMENT)
-                {
-                  active_element &connected_el = *p.find_element(connected_en);
+          if (!any_retired)
+          {
+            ++pn;
+            continue;
+          }
 
-                  for (hedge::face_number_t cfn = 0; cfn < m_faces_per_element; ++cfn)
-                  {
-                    if (connected_el.m_connections[cfn] == en)
-                      connected_el.m_connections[cfn] = hedge::INVALID_ELEMENT;
-                  }
-                }
-              }
+          // phase 2: kill connections and deallocate
+          for (unsigned i_el = 0; i_el < p.m_elements.size(); ++i_el)
+          {
+            if (!retire[i_el])
+              continue;
 
-              deallocate_element(ds, el.m_start_index);
+            const active_element &el = p.m_elements[i_el];
+            const mesh_data::element_number en = el.m_element_id;
 
-              // kill the element
-              p.m_elements.erase(p.m_elements.begin()+i_el);
+            for (hedge::face_number_t fn = 0; fn < m_faces_per_element; ++fn)
+            {
+              const mesh_data::element_number connected_en = el.m_connections[fn];
+              if (connected_en == mesh_data::INVALID_ELEMENT)
+                continue;
+
+              const face_pair_type::int_side_type &ext_face =
+                get_face_pair_locator(en, fn).external_flux_face();
+              p.find_element(connected_en)->m_connections[ext_face.face_id] =
+                mesh_data::INVALID_ELEMENT;
             }
-            else
-              ++i_el;
+
+            deallocate_element(ds, el.m_start_index);
           }
 
+          // phase 3: compact the element list
+          unsigned i_dest = 0;
+          for (unsigned i_el = 0; i_el < p.m_elements.size(); ++i_el)
+            if (!retire[i_el])
+              p.m_elements[i_dest++] = p.m_elements[i_el];
+          p.m_elements.erase(p.m_elements.begin()+i_dest, p.m_elements.end());
+
           ++pn;
         }
       }
@@ -462,6 +518,127 @@ namespace pyrticle
 
 
 
+      // checkpointing ------------------------------------------------------
+      /** A flattened copy of a depositor_state, suitable for storage.
+       *
+       * The elements of particle \c pn are found at indices
+       * m_element_starts[pn] through m_element_starts[pn+1]-1 of
+       * m_element_numbers, m_start_indices and m_min_lives. Their
+       * connections are stored with a stride of max_faces.
+       */
+      struct checkpoint_data
+      {
+        typedef pyublas::numpy_vector<npy_uint32> uint_vector;
+
+        uint_vector   m_element_starts;
+        uint_vector   m_element_numbers;
+        uint_vector   m_start_indices;
+        uint_vector   m_min_lives;
+        uint_vector   m_connections;
+        uint_vector   m_freelist;
+        py_vector     m_rho;
+        unsigned      m_active_elements;
+
+        checkpoint_data()
+          : m_active_elements(0)
+        { }
+      };
+
+
+
+
+      checkpoint_data get_checkpoint_data(const depositor_state &ds) const
+      {
+        typedef typename checkpoint_data::uint_vector uint_vector;
+
+        unsigned element_count = 0;
+        BOOST_FOREACH(const advected_particle &p, ds.m_advected_particles)
+          element_count += p.m_elements.size();
+
+        checkpoint_data result;
+        result.m_element_starts = uint_vector(ds.m_advected_particles.size()+1);
+        result.m_element_numbers = uint_vector(element_count);
+        result.m_start_indices = uint_vector(element_count);
+        result.m_min_lives = uint_vector(element_count);
+        result.m_connections = uint_vector(element_count*max_faces);
+
+        unsigned i_el = 0;
+        unsigned pn = 0;
+        BOOST_FOREACH(const advected_particle &p, ds.m_advected_particles)
+        {
+          result.m_element_starts[pn++] = i_el;
+
+          BOOST_FOREACH(const active_element &el, p.m_elements)
+          {
+            result.m_element_numbers[i_el] = el.m_element_id;
+            result.m_start_indices[i_el] = el.m_start_index;
+            result.m_min_lives[i_el] = el.m_min_life;
+            for (unsigned fn = 0; fn < max_faces; ++fn)
+              result.m_connections[i_el*max_faces+fn] = el.m_connections[fn];
+            ++i_el;
+          }
+        }
+        result.m_element_starts[pn] = i_el;
+
+        result.m_freelist = uint_vector(ds.m_freelist.size());
+        std::copy(ds.m_freelist.begin(), ds.m_freelist.end(),
+            result.m_freelist.begin());
+
+        result.m_rho = py_vector(ds.m_rho.size());
+        std::copy(ds.m_rho.begin(), ds.m_rho.end(), result.m_rho.begin());
+
+        result.m_active_elements = ds.m_active_elements;
+        return result;
+      }
+
+
+
+
+      void set_checkpoint_data(
+          depositor_state &ds,
+          shape_function sf,
+          const checkpoint_data &cd)
+      {
+        if (cd.m_element_starts.size() == 0)
+          throw std::runtime_error("invalid advective checkpoint data");
+
+        const unsigned particle_count = cd.m_element_starts.size()-1;
+
+        ds.clear();
+        ds.m_advected_particles.resize(particle_count);
+
+        for (particle_number pn = 0; pn < particle_count; ++pn)
+        {
+          advected_particle &p = ds.m_advected_particles[pn];
+          p.m_shape_function = sf;
+
+          for (unsigned i_el = cd.m_element_starts[pn];
+              i_el < cd.m_element_starts[pn+1]; ++i_el)
+          {
+            active_element el;
+            el.m_element_id = cd.m_element_numbers[i_el];
+            if (el.m_element_id >= m_mesh_data.element_count())
+              throw std::runtime_error("advective checkpoint refers to "
+                  "nonexistent element");
+            el.m_start_index = cd.m_start_indices[i_el];
+            el.m_min_life = cd.m_min_lives[i_el];
+            for (unsigned fn = 0; fn < max_faces; ++fn)
+              el.m_connections[fn] = cd.m_connections[i_el*max_faces+fn];
+            p.m_elements.push_back(el);
+          }
+        }
+
+        ds.m_freelist.assign(cd.m_freelist.begin(), cd.m_freelist.end());
+        ds.m_rho = cd.m_rho;
+        ds.m_active_elements = cd.m_active_elements;
+
+        if (ds.m_rho_dof_shift_listener.get())
+          ds.m_rho_dof_shift_listener->note_change_size(ds.m_rho.size());
+      }
+
+
+
+
       // initialization -----------------------------------------------------
       void dump_particle(advected_particle const &p) const
       {
@@ -469,7 +646,7 @@ namespace pyrticle
         unsigned i_el = 0;
         BOOST_FOREACH(const active_element &el, p.m_elements)
         {
-          std::cout << "#" << el.m_element_info->m_id << " cnx:(";
+          std::cout << "#" << el.m_element_id << " cnx:(";
           for (unsigned fn = 0; fn < m_faces_per_element; ++fn)
             if (el.m_connections[fn] == hedge::INVALID_ELEMENT)
               std::cout << "X" << ',';
@@ -526,6 +703,31 @@ namespace pyrticle
       }
 
 
+      /** Make sure that the next \c count calls to allocate_element
+       * will not need to enlarge the state vector.
+       */
+      void reserve_elements(depositor_state &ds, unsigned count)
+      {
+        if (count <= ds.m_freelist.size())
+          return;
+
+        // After the freelist is exhausted, new elements are appended
+        // past the contiguous range of active_elements+freelist slots.
+        const unsigned needed_space = ds.m_active_elements + count;
+        const unsigned avl_space = ds.m_rho.size() / m_dofs_per_element;
+
+        if (needed_space > avl_space)
+        {
+          ds.resize_rho(std::max(std::max(
+                dyn_vector::size_type(m_dofs_per_element*1024),
+                2*ds.m_rho.size()),
+                dyn_vector::size_type(m_dofs_per_element*needed_space)));
+          if (ds.m_rho_dof_shift_listener.get())
+            ds.m_rho_dof_shift_listener->note_change_size(ds.m_rho.size());
+        }
+      }
+
+
       void deallocate_element(depositor_state &ds, unsigned start_index)
       {
         if (start_index % m_dofs_per_element != 0)
@@ -552,15 +754,16 @@ namespace pyrticle
           VecType const &pspace) const
       {
         py_vector result(
-            m_dofs_per_element*m_mesh_data.m_element_info.size());
+            m_dofs_per_element*m_mesh_data.element_count());
         result.clear();
 
         BOOST_FOREACH(const advected_particle &p, ds.m_advected_particles)
         {
           BOOST_FOREACH(const active_element &el, p.m_elements)
           {
-            const mesh_data::element_info &einfo = *el.m_element_info;
-            noalias(subrange(result, einfo.m_start, einfo.m_end)) +=
+            noalias(subrange(result,
+                  m_mesh_data.element_start(el.m_element_id),
+                  m_mesh_data.element_end(el.m_element_id))) +=
               subrange(pspace, el.m_start_index, el.m_start_index+m_dofs_per_element);
           }
         }
@@ -576,15 +779,16 @@ namespace pyrticle
           particle_state const &ps) const
       {
         py_vector result(
-            m_dofs_per_element*m_mesh_data.m_element_info.size());
+            m_dofs_per_element*m_mesh_data.element_count());
         result.clear();
 
         BOOST_FOREACH(const advected_particle &p, ds.m_advected_particles)
         {
           BOOST_FOREACH(const active_element &el, p.m_elements)
           {
-            const mesh_data::element_info &einfo = *el.m_element_info;
-            noalias(subrange(result, einfo.m_start, einfo.m_end)) +=
+            noalias(subrange(result,
+                  m_mesh_data.element_start(el.m_element_id),
+                  m_mesh_data.element_end(el.m_element_id))) +=
               boost::numeric::ublas::scalar_vector<double>(m_dofs_per_element, 1);
           }
         }
@@ -617,11 +821,11 @@ namespace pyrticle
               const mesh_data::element_number en
               )
           {
-            const mesh_data::element_info &einfo(
-                m_depositor.m_mesh_data.m_element_info[en]);
+            const mesh_data::node_number el_start =
+              m_depositor.m_mesh_data.element_start(en);
 
             active_element new_element;
-            new_element.m_element_info = &einfo;
+            new_element.m_element_id = en;
             unsigned start = new_element.m_start_index =
               m_depositor.allocate_element(m_dep_state);
             new_element.m_min_life = 0;
@@ -629,7 +833,7 @@ namespace pyrticle
             for (unsigned i = 0; i < m_depositor.m_dofs_per_element; ++i)
               m_dep_state.m_rho[start+i] =
                 m_particle.m_shape_function(
-                    m_depositor.m_mesh_data.mesh_node(einfo.m_start+i)-center);
+                    m_depositor.m_mesh_data.mesh_node(el_start+i)-center);
 
             m_particle.m_elements.push_back(new_element);
           }
@@ -658,14 +862,12 @@ namespace pyrticle
         // make connections
         BOOST_FOREACH(active_element &el, new_particle.m_elements)
         {
-          const mesh_data::element_info &einfo = *el.m_element_info;
-
-          unsigned fn = 0;
-          BOOST_FOREACH(const mesh_data::face_info &f, einfo.m_faces)
+          for (unsigned fn = 0; fn < m_mesh_data.faces_per_element(); ++fn)
           {
-            if (new_particle.find_element(f.m_neighbor))
-              el.m_connections[fn] = f.m_neighbor;
-            ++fn;
+            const mesh_data::element_number neighbor =
+              m_mesh_data.face_neighbor(el.m_element_id, fn);
+            if (new_particle.find_element(neighbor))
+              el.m_connections[fn] = neighbor;
           }
         }
 
@@ -673,12 +875,12 @@ namespace pyrticle
         std::vector<double> unscaled_masses;
         BOOST_FOREACH(active_element &el, new_particle.m_elements)
           unscaled_masses.push_back(element_integral(
-                el.m_element_info->m_jacobian,
+                m_mesh_data.jacobian(el.m_element_id),
                 subrange(ds.m_rho,
                   el.m_start_index,
                   el.m_start_index+m_dofs_per_element)));
 
-        const double charge = ps.charges[pn];
+        const double charge = ps.charge(pn);
         const double total_unscaled_mass = std::accumulate(
             unscaled_masses.begin(), unscaled_masses.end(), double(0));
 
@@ -710,6 +912,8 @@ namespace pyrticle
           const ParticleState &ps,
           py_vector const &velocities) const
       {
+        PYRTICLE_PHASE(adv_local_div);
+
         const unsigned dofs = ds.m_rho.size();
         const unsigned active_contiguous_elements =
           ds.m_active_elements + ds.m_freelist.size();
@@ -759,7 +963,7 @@ namespace pyrticle
                 double coeff = 0;
                 for (unsigned glob_axis = 0; glob_axis < get_dimensions_mesh(); ++glob_axis)
                   coeff += -v[glob_axis] *
-                    el.m_element_info->m_inverse_map.matrix()(loc_axis, glob_axis);
+                    m_mesh_data.inverse_map_entry(el.m_element_id, loc_axis, glob_axis);
 
                 subrange(local_div,
                     el.m_start_index,
@@ -779,220 +983,234 @@ namespace pyrticle
 
 
 
-      py_vector calculate_fluxes(
+    private:
+      struct activation_candidate
+      {
+        particle_number m_particle_number;
+        mesh_data::element_number m_element_number;
+
+        activation_candidate(particle_number pn, mesh_data::element_number en)
+          : m_particle_number(pn), m_element_number(en)
+        { }
+      };
+
+    public:
+      /** Activate all elements that the particles' outflow is about to
+       * reach.
+       *
+       * This works in three phases: First, all candidate elements are
+       * collected in one pass over the particles. Next, room for all of
+       * them is allocated at once, so that the state vector is enlarged
+       * at most once. Finally, the new elements are wired up with their
+       * active neighbors using m_face_pair_locators.
+       */
+      void activate_outflow_elements(
           depositor_state &ds,
           const ParticleState &ps,
           py_vector const &velocities)
       {
+        PYRTICLE_PHASE(adv_activation);
+
         if (m_activation_threshold == 0)
           throw std::runtime_error("zero activation threshold");
 
-        py_vector fluxes(ds.m_rho.size());
-        fluxes.clear();
+        const unsigned face_length = m_face_mass_matrix.size1();
+
+        // phase 1: collect candidates --------------------------------------
+        std::vector<activation_candidate> candidates;
 
         particle_number pn = 0;
-        BOOST_FOREACH(advected_particle &p, ds.m_advected_particles)
+        BOOST_FOREACH(const advected_particle &p, ds.m_advected_particles)
         {
-          const double shape_peak =
+          const double activation_density = m_activation_threshold * fabs(
             p.m_shape_function(
                 boost::numeric::ublas::zero_vector<double>(get_dimensions_mesh()))
-            * ps.charges[pn];
+            * ps.charge(pn));
 
           const bounded_vector v = subrange(velocities,
               ps.vdim()*pn, ps.vdim()*(pn+1));
 
-          for (unsigned i_el = 0; i_el < p.m_elements.size(); ++i_el)
+          const unsigned first_candidate = candidates.size();
+
+          BOOST_FOREACH(const active_element &el, p.m_elements)
           {
-            active_element const *el = &p.m_elements[i_el];
+            const mesh_data::element_number en = el.m_element_id;
 
             for (hedge::face_number_t fn = 0; fn < m_faces_per_element; ++fn)
             {
-              const mesh_data::element_number en = el->m_element_info->m_id;
-
-              /* Find correct face instance
-               *
-               * A face_pair represents both sides of a face. It points
-               * to one or two hedge::face instances in its face_group that
-               * carry information about each side of the face.
-               *
-               * The "ext" side of the face_pair may be unpopulated because
-               * of a boundary.
-               *
-               * First, we need to identify which side of the face (en,fn)
-               * identifies, guarding against an unpopulated "ext" side.
-               */
-              bool is_boundary;
-              const face_pair_type::int_side_type *flux_face;
-              const face_pair_type::int_side_type *external_flux_face;
-              hedge::index_lists_t::const_iterator idx_list;
-              hedge::index_lists_t::const_iterator ext_idx_list;
+              if (el.m_connections[fn] != mesh_data::INVALID_ELEMENT)
+                continue;
 
-              {
-                const face_pair_locator &fp_locator = map_get(
-                    m_el_face_to_face_pair_locator,
-                    std::make_pair(en, fn));
+              const face_pair_locator &fp_locator = get_face_pair_locator(en, fn);
+              if (fp_locator.is_boundary())
+                continue;
 
-                const face_group_type &fg(*fp_locator.m_face_group);
-                const face_pair_type &fp(*fp_locator.m_face_pair);
+              const face_pair_type::int_side_type &flux_face =
+                fp_locator.flux_face();
 
-                const face_pair_type::int_side_type &flux_face_a = fp.int_side;
+              // only outflow faces can activate
+              if (inner_prod(v, flux_face.normal) <= 0)
+                continue;
 
-                const bool is_face_b = en != flux_face_a.element_id;
+              hedge::index_lists_t::const_iterator idx_list =
+                fp_locator.m_face_group->index_list(
+                    flux_face.face_index_list_number);
 
-                is_boundary =
-                  fp.ext_side.element_id == hedge::INVALID_ELEMENT;
+              double max_density = 0;
+              for (unsigned i = 0; i < face_length; i++)
+                max_density = std::max(max_density,
+                    fabs(ds.m_rho[el.m_start_index+idx_list[i]]));
 
-                const face_pair_type::ext_side_type *flux_face_b = &fp.ext_side;
+              if (max_density <= activation_density)
+                continue;
 
-                if (is_boundary && is_face_b)
-                  throw std::runtime_error("looking for non-existant cross-boundary element");
+              // an element may be reached through more than one face
+              const mesh_data::element_number ext_en =
+                fp_locator.external_flux_face().element_id;
 
-                if (is_face_b && en != flux_face_b->element_id)
-                  throw std::runtime_error("el/face lookup failed");
+              bool is_duplicate = false;
+              for (unsigned i = first_candidate; i < candidates.size(); ++i)
+                if (candidates[i].m_element_number == ext_en)
+                {
+                  is_duplicate = true;
+                  break;
+                }
 
-                flux_face = is_face_b ? flux_face_b : &flux_face_a;
-                external_flux_face = is_face_b ? &flux_face_a : flux_face_b;
+              if (!is_duplicate)
+                candidates.push_back(activation_candidate(pn, ext_en));
+            }
+          }
 
-                idx_list = fg.index_list(flux_face->face_index_list_number);
-                ext_idx_list = fg.index_list(external_flux_face->face_index_list_number);
-              }
+          ++pn;
+        }
 
-              // Find information about this face
-              const double n_dot_v = inner_prod(v, flux_face->normal);
-              const bool inflow = n_dot_v <= 0;
-              bool active = el->m_connections[fn] != mesh_data::INVALID_ELEMENT;
+        if (candidates.empty())
+          return;
 
-              if (is_boundary && active)
-                throw std::runtime_error("detected boundary non-connection as active");
+        // phase 2: allocate ------------------------------------------------
+        reserve_elements(ds, candidates.size());
 
-              const double int_coeff =
-                flux_face->face_jacobian*(-n_dot_v)*(
-                    m_upwind_alpha*(1 - (inflow ? 0 : 1))
-                    +
-                    (1-m_upwind_alpha)*0.5);
-              const double ext_coeff =
-                flux_face->face_jacobian*(-n_dot_v)*(
-                    m_upwind_alpha*-(inflow ? 1 : 0)
-                    +
-                    (1-m_upwind_alpha)*-0.5);
+        BOOST_FOREACH(const activation_candidate &cand, candidates)
+        {
+          active_element ext_element;
+          ext_element.m_element_id = cand.m_element_number;
 
-              const mesh_data::node_number this_base_idx = el->m_start_index;
+          const unsigned start = ext_element.m_start_index = allocate_element(ds);
+          subrange(ds.m_rho, start, start+m_dofs_per_element) =
+            boost::numeric::ublas::zero_vector<double>(m_dofs_per_element);
 
-              // activate outflow, if necessary -----------------------------
-              if (!is_boundary && !active && !inflow)
-              {
-                const unsigned face_length = m_face_mass_matrix.size1();
+          ext_element.m_min_life = 10;
 
-                double max_density = 0;
-                for (unsigned i = 0; i < face_length; i++)
-                  max_density = std::max(max_density,
-                      fabs(ds.m_rho[this_base_idx+idx_list[i]]));
+          ds.m_advected_particles[cand.m_particle_number].m_elements.push_back(
+              ext_element);
+        }
 
-                // std::cout << max_density << ' ' << shape_peak << std::endl;
-                if (max_density > m_activation_threshold*fabs(shape_peak))
-                {
-                  // yes, activate the external element
+        // phase 3: update connections --------------------------------------
+        BOOST_FOREACH(const activation_candidate &cand, candidates)
+        {
+          advected_particle &p = ds.m_advected_particles[cand.m_particle_number];
+          const mesh_data::element_number ext_en = cand.m_element_number;
+          active_element &ext_element = *p.find_element(ext_en);
+
+          for (hedge::face_number_t ext_fn = 0; ext_fn < m_faces_per_element; ++ext_fn)
+          {
+            if (ext_element.m_connections[ext_fn] != mesh_data::INVALID_ELEMENT)
+              continue;
+
+            const face_pair_locator &fp_locator = get_face_pair_locator(ext_en, ext_fn);
+            if (fp_locator.is_boundary())
+              continue;
+
+            const face_pair_type::int_side_type &ext_neigh_face =
+              fp_locator.external_flux_face();
+            active_element *ext_neigh_el = p.find_element(ext_neigh_face.element_id);
+
+            if (ext_neigh_el)
+            {
+              ext_element.m_connections[ext_fn] = ext_neigh_face.element_id;
+              ext_neigh_el->m_connections[ext_neigh_face.face_id] = ext_en;
+            }
+          }
+        }
+      }
 
-                  const hedge::element_number_t ext_en = external_flux_face->element_id;
 
-                  const mesh_data::element_info &ext_einfo(
-                      m_mesh_data.m_element_info[ext_en]);
 
-                  active_element ext_element;
-                  ext_element.m_element_info = &ext_einfo;
 
-                  unsigned start = ext_element.m_start_index = allocate_element(ds);
-                  subrange(ds.m_rho, start, start+m_dofs_per_element) =
-                    boost::numeric::ublas::zero_vector<double>(m_dofs_per_element);
+      py_vector calculate_fluxes(
+          depositor_state &ds,
+          const ParticleState &ps,
+          py_vector const &velocities)
+      {
+        PYRTICLE_PHASE(adv_fluxes);
+        activate_outflow_elements(ds, ps, velocities);
 
-                  if (ds.m_rho.size() != fluxes.size())
-                  {
-                    // allocate_element enlarged the size of the state vector
-                    // fluxes needs to be changed as well.
-                    py_vector new_fluxes(ds.m_rho.size());
-                    new_fluxes.clear();
-                    noalias(subrange(new_fluxes, 0, fluxes.size())) = fluxes;
-                    fluxes.swap(new_fluxes);
-                  }
+        py_vector fluxes(ds.m_rho.size());
+        fluxes.clear();
 
-                  ext_element.m_min_life = 10;
+        const unsigned face_length = m_face_mass_matrix.size1();
 
-                  // update connections
-                  hedge::face_number_t ext_fn = 0;
-                  BOOST_FOREACH(const mesh_data::face_info &ext_face, ext_einfo.m_faces)
-                  {
-                    const hedge::element_number_t ext_neigh_en = ext_face.m_neighbor;
-                    active_element *ext_neigh_el = p.find_element(ext_neigh_en);
-                    if (ext_neigh_el)
-                    {
-                      /* We found an active neighbor of our "external" element.
-                       *
-                       * Notation:
-                       *        *
-                       *       / \
-                       *      /ext_neigh
-                       *     *-----*
-                       *    / \ext/
-                       *   / el\ /
-                       *  *-----*
-                       *
-                       * el: The element currently under consideration in the
-                       *   "big" loop.
-                       * ext: The "external" element that we just decided to
-                       *   activate.
-                       * ext_neigh: Neighbor of ext, also part of this
-                       *   advected_particle
-                       */
-
-                       // First, tell ext that ext_neigh exists.
-                      ext_element.m_connections[ext_fn] = ext_neigh_en;
-
-                      // Next, tell ext_neigh that ext exists.
-                      const mesh_data::element_info &ext_neigh_einfo(
-                          m_mesh_data.m_element_info[ext_neigh_en]);
-
-                      mesh_data::face_number ext_index_in_ext_neigh = 0;
-                      for (;ext_index_in_ext_neigh < ext_neigh_einfo.m_faces.size()
-                          ;++ext_index_in_ext_neigh)
-                        if (ext_neigh_einfo.m_faces[ext_index_in_ext_neigh].m_neighbor
-                            == ext_en)
-                          break;
-
-                      if (ext_index_in_ext_neigh == ext_neigh_einfo.m_faces.size())
-                        throw std::runtime_error("ext not found in ext_neigh");
-
-                      ext_neigh_el->m_connections[ext_index_in_ext_neigh] = ext_en;
-                    }
-
-                    ++ext_fn;
-                  }
+        particle_number pn = 0;
+        BOOST_FOREACH(const advected_particle &p, ds.m_advected_particles)
+        {
+          const bounded_vector v = subrange(velocities,
+              ps.vdim()*pn, ps.vdim()*(pn+1));
 
-                  p.m_elements.push_back(ext_element);
+          BOOST_FOREACH(const active_element &el, p.m_elements)
+          {
+            const mesh_data::element_number en = el.m_element_id;
 
-                  // modification of m_elements might have invalidated el,
-                  // refresh it
+            for (hedge::face_number_t fn = 0; fn < m_faces_per_element; ++fn)
+            {
+              const face_pair_locator &fp_locator = get_face_pair_locator(en, fn);
 
-                  el = &p.m_elements[i_el];
+              const bool is_boundary = fp_locator.is_boundary();
+              const face_pair_type::int_side_type &flux_face =
+                fp_locator.flux_face();
 
-                  active = true;
-                }
-              }
+              hedge::index_lists_t::const_iterator idx_list =
+                fp_locator.m_face_group->index_list(
+                    flux_face.face_index_list_number);
+
+              // Find information about this face
+              const double n_dot_v = inner_prod(v, flux_face.normal);
+              const bool inflow = n_dot_v <= 0;
+              const bool active = el.m_connections[fn] != mesh_data::INVALID_ELEMENT;
+
+              if (is_boundary && active)
+                throw std::runtime_error("detected boundary non-connection as active");
+
+              const double int_coeff =
+                flux_face.face_jacobian*(-n_dot_v)*(
+                    m_upwind_alpha*(1 - (inflow ? 0 : 1))
+                    +
+                    (1-m_upwind_alpha)*0.5);
+              const double ext_coeff =
+                flux_face.face_jacobian*(-n_dot_v)*(
+                    m_upwind_alpha*-(inflow ? 1 : 0)
+                    +
+                    (1-m_upwind_alpha)*-0.5);
+
+              const mesh_data::node_number this_base_idx = el.m_start_index;
 
               // treat fluxes between active elements -----------------------
               if (active)
               {
-                const active_element *ext_el = p.find_element(el->m_connections[fn]);
-                const mesh_data::node_number ext_base_idx = ext_el->m_start_index;
+                const active_element *ext_el = p.find_element(el.m_connections[fn]);
 
                 if (ext_el == 0)
                 {
                   dump_particle(p);
                   throw std::runtime_error(
                       boost::str(boost::format("external element %d of (el:%d,face:%d) for active connection not found")
-                      % el->m_connections[fn] % en % fn).c_str());
+                      % el.m_connections[fn] % en % fn).c_str());
                 }
 
-                const unsigned face_length = m_face_mass_matrix.size1();
+                const mesh_data::node_number ext_base_idx = ext_el->m_start_index;
+
+                hedge::index_lists_t::const_iterator ext_idx_list =
+                  fp_locator.m_face_group->index_list(
+                      fp_locator.external_flux_face().face_index_list_number);
 
                 for (unsigned i = 0; i < face_length; i++)
                 {
@@ -1022,8 +1240,6 @@ namespace pyrticle
               // handle zero inflow from inactive neighbors -----------------
               else if (inflow)
               {
-                const unsigned face_length = m_face_mass_matrix.size1();
-
                 for (unsigned i = 0; i < face_length; i++)
                 {
                   const int ili = this_base_idx+idx_list[i];
@@ -1041,7 +1257,6 @@ namespace pyrticle
                 }
               }
             }
-
           }
           ++pn;
         }
@@ -1056,6 +1271,8 @@ namespace pyrticle
           depositor_state &ds,
           py_vector const &operand) const
       {
+        PYRTICLE_PHASE(adv_inverse_mass);
+
         py_vector result(ds.m_rho.size());
         result.clear();
 
@@ -1089,7 +1306,7 @@ namespace pyrticle
             subrange(result,
                 el.m_start_index,
                 el.m_start_index+m_dofs_per_element) *=
-            1/el.m_element_info->m_jacobian;
+            1/m_mesh_data.jacobian(el.m_element_id);
           }
 
         return result;
@@ -141,10 +141,9 @@ namespace pyrticle
 
       py_vector find_points_in_element(element_on_grid &eog, double scaled_tolerance) const
       {
-        const unsigned mdims = this->m_mesh_data.m_dimensions;
-        const mesh_data::element_info &el = 
-          this->m_mesh_data.m_element_info[
-          eog.m_element_number];
+        const mesh_data &md = this->m_mesh_data;
+        const unsigned mdims = md.m_dimensions;
+        const mesh_data::element_number en = eog.m_element_number;
 
         bounded_box el_bbox = this->m_mesh_data.element_bounding_box(
             eog.m_element_number);
@@ -179,9 +178,9 @@ namespace pyrticle
 
             bounded_vector point = it.point();
 
-            BOOST_FOREACH(const mesh_data::face_info &f, el.m_faces)
-              if (inner_prod(f.m_normal, point) 
-                  - f.m_face_plane_eqn_rhs > scaled_tolerance)
+            for (mesh_data::face_number fn = 0; fn < md.faces_per_element(); ++fn)
+              if (inner_prod(md.face_normal(en, fn), point) 
+                  - md.face_plane_eqn_rhs(en, fn) > scaled_tolerance)
               {
                 in_el = false;
                 break;
@@ -270,6 +269,8 @@ namespace pyrticle
       void remap_grid_to_mesh(const py_vector from, py_vector to, 
           const unsigned offset=0, const unsigned increment=1) const
       {
+        PYRTICLE_PHASE(dep_grid_remap);
+
         const py_vector::const_iterator from_it = from.begin();
 
         if (m_max_el_grid_values == 0)
@@ -284,8 +285,8 @@ namespace pyrticle
 
         BOOST_FOREACH(const element_on_grid &eog, m_elements_on_grid)
         {
-          const mesh_data::element_info &el = 
-            this->m_mesh_data.m_element_info[eog.m_element_number];
+          const mesh_data::node_number el_start =
+            this->m_mesh_data.element_start(eog.m_element_number);
 
           // pick values off the grid
           const py_vector::const_iterator weights = eog.m_weight_factors.begin();
@@ -318,7 +319,7 @@ namespace pyrticle
                 traits::vector_storage(grid_values), /*incx*/ 1,
 
                 /*beta*/ 1,
-                traits::vector_storage(to) + el.m_start*increment + offset, 
+                traits::vector_storage(to) + el_start*increment + offset, 
                 /*incy*/ increment);
           }
         }
@@ -364,9 +365,10 @@ namespace pyrticle
           const unsigned offset=0, const unsigned increment=1) const
       {
         unsigned max_el_size = 0;
-        BOOST_FOREACH(const mesh_data::element_info &el, 
-            this->m_mesh_data.m_element_info)
-          max_el_size = std::max(max_el_size, el.m_end-el.m_start);
+        const mesh_data &md = this->m_mesh_data;
+        for (mesh_data::element_number en = 0; en < md.element_count(); ++en)
+          max_el_size = std::max<unsigned>(max_el_size,
+              md.element_end(en)-md.element_start(en));
         dyn_vector mesh_values(max_el_size);
 
         const py_vector::const_iterator from_it = from.begin();
@@ -499,6 +501,68 @@ namespace pyrticle
         deposit_densities_on_grid_target(ds, ps, rho_tgt, pslice);
         return grid_rho;
       }
+
+
+
+
+      boost::tuple<py_vector, py_vector> 
+        deposit_grouped_grid_densities(
+            depositor_state &ds,
+            const particle_state &ps,
+            const py_vector &velocities,
+            const group_vector &groups,
+            unsigned group_count,
+            boost::python::slice const &pslice)
+      {
+        const unsigned gnc = grid_node_count_with_extra();
+
+        npy_intp rho_dims[] = { gnc };
+        npy_intp j_dims[] = { gnc, ps.vdim() };
+        std::vector<py_vector> grid_rhos(
+            make_group_vectors(group_count, 1, rho_dims));
+        std::vector<py_vector> grid_js(
+            make_group_vectors(group_count, 2, j_dims));
+
+        typedef j_target<particle_state::m_vdim, py_vector, py_vector> 
+          j_tgt_t;
+        typedef chained_target<rho_target<py_vector>, j_tgt_t> group_tgt_t;
+
+        grouped_deposition_target<group_tgt_t> tgt(groups);
+        for (unsigned g = 0; g < group_count; ++g)
+        {
+          rho_target<py_vector> rho_tgt(grid_rhos[g]);
+          j_tgt_t j_tgt(grid_js[g], velocities);
+          tgt.add_target(new group_tgt_t(rho_tgt, j_tgt));
+        }
+
+        deposit_densities_on_grid_target(ds, ps, tgt, pslice);
+
+        return boost::make_tuple(
+            stack_group_vectors(grid_rhos, 1, rho_dims),
+            stack_group_vectors(grid_js, 2, j_dims));
+      }
+
+
+
+
+      py_vector deposit_grouped_grid_rho(
+          depositor_state &ds,
+          const particle_state &ps,
+          const group_vector &groups,
+          unsigned group_count,
+          boost::python::slice const &pslice)
+      {
+        npy_intp dims[] = { grid_node_count_with_extra() };
+        std::vector<py_vector> grid_rhos(
+            make_group_vectors(group_count, 1, dims));
+
+        grouped_deposition_target<rho_target<py_vector> > tgt(groups);
+        for (unsigned g = 0; g < group_count; ++g)
+          tgt.add_target(new rho_target<py_vector>(grid_rhos[g]));
+
+        deposit_densities_on_grid_target(ds, ps, tgt, pslice);
+        return stack_group_vectors(grid_rhos, 1, dims);
+      }
   };
 }
 
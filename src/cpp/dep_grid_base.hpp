@@ -27,7 +27,9 @@
 #include "bases.hpp"
 #include "meshdata.hpp"
 #include "tools.hpp"
+#include "phase_timing.hpp"
 #include "grid.hpp"
+#include "dep_target.hpp"
 
 
 
@@ -220,11 +222,12 @@ namespace pyrticle
       {
         brick_number &bn_cache(ds.m_particle_brick_numbers[pn]);
         const brick_type &last_brick = m_bricks[bn_cache];
+        const double charge = ps.charge(pn);
 
         bool is_complete;
         bool does_intersect_cached = 
           static_cast<const Derived *>(this)->deposit_particle_on_one_brick(
-              tgt, last_brick, center, particle_box, ps.charges[pn],
+              tgt, last_brick, center, particle_box, charge,
               &is_complete);
 
         if (!is_complete)
@@ -236,7 +239,7 @@ namespace pyrticle
               continue;
 
             if (static_cast<const Derived *>(this)->deposit_particle_on_one_brick(
-                  tgt, brk, center, particle_box, ps.charges[pn])
+                  tgt, brk, center, particle_box, charge)
                 && !does_intersect_cached)
             {
               // We did not intersect the cached brick, but we
@@ -305,7 +308,7 @@ namespace pyrticle
         else
         {
           deposit_single_particle_without_cache(
-              tgt, center, particle_box, ps.charges[pn]);
+              tgt, center, particle_box, ps.charge(pn));
         }
         pset.push_back(abf);
 
@@ -355,6 +358,9 @@ namespace pyrticle
           depositor_state &ds, const particle_state &ps,
           Target tgt, boost::python::slice const &pslice)
       {
+        PYRTICLE_PHASE(dep_grid);
+        PYRTICLE_PHASE_COUNT(dep_grid, ps.particle_count);
+
         const unsigned dim_x = ps.xdim();
         const unsigned dim_m = m_mesh_data.m_dimensions;
 
@@ -362,7 +368,10 @@ namespace pyrticle
         const scalar_vector<double> shape_extent(
             dim_m, m_shape_function.radius());
 
-        FOR_ALL_SLICE_INDICES(pslice, ps.particle_count)
+        FOR_ALL_SLICE_INDICES_PREP(pslice, ps.particle_count)
+        gil_release no_gil;
+
+        FOR_ALL_SLICE_INDICES_LOOP
         {
           FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
 
@@ -175,6 +175,68 @@ namespace pyrticle
         this->deposit_densities_on_grid_target(ds, ps, rho_tgt, pslice);
         return rho;
       }
+
+
+
+
+      boost::tuple<py_vector, py_vector> 
+      deposit_grouped_densities(
+          depositor_state &ds,
+          const particle_state &ps,
+          const py_vector &velocities,
+          const group_vector &groups,
+          unsigned group_count,
+          boost::python::slice const &pslice)
+      {
+        npy_intp rho_dims[] = { this->m_mesh_data.node_count() };
+        npy_intp j_dims[] = {
+          this->m_mesh_data.node_count(),
+          particle_state::vdim()
+        };
+        std::vector<py_vector> rhos(
+            make_group_vectors(group_count, 1, rho_dims));
+        std::vector<py_vector> js(
+            make_group_vectors(group_count, 2, j_dims));
+
+        typedef j_target<particle_state::m_vdim, py_vector, py_vector> 
+          j_tgt_t;
+        typedef chained_target<rho_target<py_vector>, j_tgt_t> group_tgt_t;
+
+        grouped_deposition_target<group_tgt_t> tgt(groups);
+        for (unsigned g = 0; g < group_count; ++g)
+        {
+          rho_target<py_vector> rho_tgt(rhos[g]);
+          j_tgt_t j_tgt(js[g], velocities);
+          tgt.add_target(new group_tgt_t(rho_tgt, j_tgt));
+        }
+
+        this->deposit_densities_on_grid_target(ds, ps, tgt, pslice);
+
+        return boost::make_tuple(
+            stack_group_vectors(rhos, 1, rho_dims),
+            stack_group_vectors(js, 2, j_dims));
+      }
+
+
+
+
+      py_vector deposit_grouped_rho(
+          depositor_state &ds,
+          const particle_state &ps,
+          const group_vector &groups,
+          unsigned group_count,
+          boost::python::slice const &pslice)
+      {
+        npy_intp dims[] = { this->m_mesh_data.node_count() };
+        std::vector<py_vector> rhos(make_group_vectors(group_count, 1, dims));
+
+        grouped_deposition_target<rho_target<py_vector> > tgt(groups);
+        for (unsigned g = 0; g < group_count; ++g)
+          tgt.add_target(new rho_target<py_vector>(rhos[g]));
+
+        this->deposit_densities_on_grid_target(ds, ps, tgt, pslice);
+        return stack_group_vectors(rhos, 1, dims);
+      }
   };
 }
 
@@ -29,6 +29,7 @@
 #include <boost/numeric/ublas/vector_proxy.hpp>
 #include <boost/typeof/std/utility.hpp>
 #include "tools.hpp"
+#include "phase_timing.hpp"
 #include "bases.hpp"
 #include "meshdata.hpp"
 #include "dep_target.hpp"
@@ -60,153 +61,11 @@ namespace pyrticle
         normalized_deposition_stats m_stats;
       };
 
-    private:
-      template <class Target>
-      class normalizing_element_target
-      {
-        public:
-          const normalized_shape_function_depositor &m_dep;
-          const particle_state &m_pstate;
-          depositor_state &m_dstate;
-          Target m_target;
-          dyn_vector m_shape_interpolant;
-          unsigned m_used_shape_dofs;
-
-          struct shape_element {
-            mesh_data::element_number m_el_number;
-            unsigned m_el_length;
-            unsigned m_my_start_index;
-            mesh_data::node_number m_global_start_index;
-
-            shape_element(
-                mesh_data::element_number el_number,
-                unsigned el_length,
-                unsigned my_start_index, 
-                mesh_data::node_number global_start_index)
-              : 
-                m_el_number(el_number),
-                m_el_length(el_length),
-                m_my_start_index(my_start_index), 
-                m_global_start_index(global_start_index)
-            { }
-          };
-
-          std::vector<shape_element>        m_particle_shape_elements;
-          double                            m_integral;
-
-          normalizing_element_target(
-              const normalized_shape_function_depositor &dep,
-              depositor_state &dstate,
-              const particle_state &pstate,
-              const dyn_vector &integral_weights,
-              Target &target
-              )
-            : 
-              m_dep(dep),
-              m_pstate(pstate),
-              m_dstate(dstate),
-              m_target(target), 
-              m_shape_interpolant(100)
-          { }
-
-
-
-
-          void begin_particle()
-          {
-            m_used_shape_dofs = 0;
-            m_particle_shape_elements.clear();
-            m_integral = 0;
-          }
-
-
-
-
-          void add_shape_on_element(
-              const bounded_vector &center,
-              const mesh_data::element_number en
-              )
-          {
-            const mesh_data::element_info &einfo = m_dep.m_mesh_data.m_element_info[en];
-            unsigned element_length = einfo.m_end-einfo.m_start;
-
-            {
-              bounded_vector centroid = m_dep.m_mesh_data.element_centroid(en);
-              m_dstate.m_stats.m_centroid_distance_stats.add(norm_2(centroid-center));
-            }
-
-            // make sure we have enough interpolant dofs available
-            while (m_used_shape_dofs + element_length > m_shape_interpolant.size())
-            {
-              dyn_vector new_shape_interpolant(2*m_shape_interpolant.size());
-              subrange(new_shape_interpolant, 0, m_shape_interpolant.size()) =
-                m_shape_interpolant;
-              new_shape_interpolant.swap(m_shape_interpolant);
-            }
-
-            shape_element new_shape_element(
-                einfo.m_id,
-                element_length,
-                m_used_shape_dofs, 
-                einfo.m_start);
-            m_used_shape_dofs += element_length;
-
-            double el_integral = 0;
-            for (unsigned i = 0; i < element_length; i++)
-            {
-              double shapeval = m_dep.m_shape_function(
-                  m_dep.m_mesh_data.mesh_node(i+einfo.m_start)-center);
-
-              m_shape_interpolant[new_shape_element.m_my_start_index+i] 
-                = shapeval;
-              el_integral += shapeval * m_dep.m_integral_weights[i];
-            }
-            m_integral += el_integral*einfo.m_jacobian;
-
-            m_particle_shape_elements.push_back(new_shape_element);
-          }
-
-
-
-
-          void end_particle(
-              particle_number pn,
-              const double charge)
-          {
-            m_dstate.m_stats.m_el_per_particle_stats.add(
-                m_particle_shape_elements.size());
-
-            if (m_integral == 0)
-            {
-              WARN(boost::str(boost::format(
-                      "deposited particle mass is zero (particle %d, #elements=%d)") 
-                    % pn 
-                    % m_particle_shape_elements.size()));
-              return;
-            }
-
-            const double scale = charge/m_integral;
-            m_dstate.m_stats.m_normalization_stats.add(scale);
-
-            m_target.begin_particle(pn);
-            BOOST_FOREACH(const shape_element &sel, m_particle_shape_elements)
-              m_target.add_shape_on_element(sel.m_el_number,
-                  sel.m_global_start_index,
-                  scale * subrange(m_shape_interpolant, 
-                    sel.m_my_start_index,
-                    sel.m_my_start_index+sel.m_el_length));
-            m_target.end_particle(pn);
-          }
-      };
-
-
-
-
-    public:
       // member data --------------------------------------------------------
       ShapeFunction m_shape_function;
       dyn_vector m_integral_weights;
       const mesh_data &m_mesh_data;
+      element_finder_kind m_element_finder;
 
 
 
@@ -214,7 +73,7 @@ namespace pyrticle
       normalized_shape_function_depositor(
           const mesh_data &md,
           const py_matrix &mass_matrix)
-        : m_mesh_data(md)
+        : m_mesh_data(md), m_element_finder(finder_face_based)
       { 
         m_integral_weights = prod(mass_matrix, 
             boost::numeric::ublas::scalar_vector<double>
@@ -230,17 +89,109 @@ namespace pyrticle
           const particle_state &ps,
           Target &tgt, boost::python::slice const &pslice) const
       {
-        normalizing_element_target<Target> norm_tgt(
-            *this, ds, ps, m_integral_weights, tgt);
+        element_finder el_finder(m_mesh_data, m_element_finder);
+        shape_footprints footprints(m_mesh_data);
+        dyn_vector shape_values;
+        std::vector<double> integrals;
 
-        element_finder el_finder(m_mesh_data);
+        FOR_ALL_SLICE_INDICES_PREP(pslice, ps.particle_count)
+        gil_release no_gil;
 
-        FOR_ALL_SLICE_INDICES(pslice, ps.particle_count)
+        for (Py_ssize_t batch_start = 0;
+            batch_start < FOR_ALL_SLICE_INDICES_COUNT;
+            batch_start += shape_deposition_batch_size)
         {
-          FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
-          norm_tgt.begin_particle();
-          el_finder(ps, norm_tgt, pn, m_shape_function.radius());
-          norm_tgt.end_particle(pn, ps.charges[pn]);
+          const Py_ssize_t batch_end = std::min<Py_ssize_t>(
+              FOR_ALL_SLICE_INDICES_COUNT,
+              batch_start + shape_deposition_batch_size);
+
+          footprints.clear();
+          {
+            PYRTICLE_PHASE(dep_footprint);
+
+            FOR_ALL_SLICE_INDICES_RANGE(batch_start, batch_end)
+            {
+              FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
+              el_finder(ps, footprints, pn, m_shape_function.radius());
+              footprints.end_particle();
+            }
+
+            BOOST_FOREACH(const shape_footprints::element &el, footprints.m_elements)
+              ds.m_stats.m_centroid_distance_stats.add(norm_2(
+                    m_mesh_data.element_centroid(el.m_el_number)-el.m_center));
+
+            PYRTICLE_PHASE_COUNT(dep_footprint, footprints.m_elements.size());
+          }
+
+          // evaluate the shape functions and their integrals
+          {
+            PYRTICLE_PHASE(dep_shape_eval);
+            PYRTICLE_PHASE_COUNT(dep_shape_eval, footprints.m_shape_dofs);
+
+            shape_values.resize(footprints.m_shape_dofs, false);
+            integrals.assign(batch_end-batch_start, 0);
+
+            for (unsigned i_particle = 0; i_particle < integrals.size(); ++i_particle)
+              for (unsigned i_el = footprints.m_particle_starts[i_particle];
+                  i_el < footprints.m_particle_starts[i_particle+1]; ++i_el)
+              {
+                const shape_footprints::element &el = footprints.m_elements[i_el];
+
+                double el_integral = 0;
+                for (unsigned i = 0; i < el.m_el_length; i++)
+                {
+                  double shapeval = m_shape_function(
+                      m_mesh_data.mesh_node(el.m_global_start_index+i)
+                      - el.m_center);
+
+                  shape_values[el.m_shape_start_index+i] = shapeval;
+                  el_integral += shapeval * m_integral_weights[i];
+                }
+                integrals[i_particle] +=
+                  el_integral*m_mesh_data.jacobian(el.m_el_number);
+              }
+          }
+
+          // normalize and scatter
+          {
+            PYRTICLE_PHASE(dep_scatter);
+
+            unsigned i_particle = 0;
+            FOR_ALL_SLICE_INDICES_RANGE(batch_start, batch_end)
+            {
+              FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
+              const unsigned el_begin = footprints.m_particle_starts[i_particle];
+              const unsigned el_end = footprints.m_particle_starts[i_particle+1];
+              const double integral = integrals[i_particle];
+              ++i_particle;
+
+              ds.m_stats.m_el_per_particle_stats.add(el_end-el_begin);
+
+              if (integral == 0)
+              {
+                WARN(boost::str(boost::format(
+                        "deposited particle mass is zero (particle %d, #elements=%d)") 
+                      % pn 
+                      % (el_end-el_begin)));
+                continue;
+              }
+
+              const double scale = ps.charge(pn)/integral;
+              ds.m_stats.m_normalization_stats.add(scale);
+
+              tgt.begin_particle(pn);
+              for (unsigned i_el = el_begin; i_el < el_end; ++i_el)
+              {
+                const shape_footprints::element &el = footprints.m_elements[i_el];
+                tgt.add_shape_on_element(el.m_el_number,
+                    el.m_global_start_index,
+                    scale * subrange(shape_values, 
+                      el.m_shape_start_index,
+                      el.m_shape_start_index+el.m_el_length));
+              }
+              tgt.end_particle(pn);
+            }
+          }
         }
       }
   };
@@ -25,12 +25,15 @@
 
 
 
+#include <vector>
+#include <algorithm>
 #include <boost/ref.hpp>
 #include <boost/foreach.hpp>
 #include <boost/unordered_set.hpp>
 #include <boost/numeric/ublas/vector_proxy.hpp>
 #include <boost/typeof/std/utility.hpp>
 #include "tools.hpp"
+#include "phase_timing.hpp"
 #include "bases.hpp"
 #include "meshdata.hpp"
 #include "particle_state.hpp"
@@ -41,25 +44,66 @@
 
 namespace pyrticle 
 {
-  template <class VecType>
-  inline
-  bool is_not_near_vertex(VecType const &unit_pt)
+  /** The footprints of a batch of particles, i.e. the elements their
+   * shape functions cover, as found by element_finder.
+   *
+   * The shape depositors handle particles in batches of
+   * shape_deposition_batch_size, in three passes: finding the footprints,
+   * evaluating the shape functions on them, and scattering the values to
+   * the target. Keeping the passes apart lets each be timed as a phase.
+   */
+  class shape_footprints
   {
-    bool not_near_vertex = true;
+    public:
+      struct element
+      {
+        bounded_vector            m_center;
+        mesh_data::element_number m_el_number;
+        mesh_data::node_number    m_global_start_index;
+        unsigned                  m_el_length;
+        unsigned                  m_shape_start_index;
+      };
+
+      const mesh_data           &m_mesh_data;
+      std::vector<element>      m_elements;
+      /** The elements of the i-th particle of the batch are
+       * m_elements[m_particle_starts[i]] through
+       * m_elements[m_particle_starts[i+1]-1]. */
+      std::vector<unsigned>     m_particle_starts;
+      /** The total length of the elements, and so of the shape values. */
+      unsigned                  m_shape_dofs;
 
-    double uc_sum = 0;
-    BOOST_FOREACH(double uc, unit_pt)
-    {
-      if (uc > 0)
+      shape_footprints(const mesh_data &md)
+        : m_mesh_data(md)
+      { clear(); }
+
+      void clear()
       {
-        not_near_vertex = false;
-        break;
+        m_elements.clear();
+        m_particle_starts.assign(1, 0);
+        m_shape_dofs = 0;
       }
-      uc_sum += uc;
-    }
 
-    return not_near_vertex && (1-0.5*(uc_sum+unit_pt.size()) < 0.5);
-  }
+      void add_shape_on_element(
+          const bounded_vector &center,
+          const mesh_data::element_number en)
+      {
+        element el;
+        el.m_center = center;
+        el.m_el_number = en;
+        el.m_global_start_index = m_mesh_data.element_start(en);
+        el.m_el_length = m_mesh_data.element_end(en)-el.m_global_start_index;
+        el.m_shape_start_index = m_shape_dofs;
+
+        m_shape_dofs += el.m_el_length;
+        m_elements.push_back(el);
+      }
+
+      void end_particle()
+      { m_particle_starts.push_back(m_elements.size()); }
+  };
+
+  static const unsigned shape_deposition_batch_size = 256;
 
 
 
@@ -67,45 +111,6 @@ namespace pyrticle
   template <class ParticleState, class ShapeFunction>
   struct shape_function_depositor
   {
-    private:
-      template <class Target>
-      class element_target
-      {
-        private:
-          const mesh_data   &m_mesh_data;
-          ShapeFunction     m_shape_function;
-          const double      m_charge;
-          Target            &m_target;
-          
-        public:
-          element_target(
-              const mesh_data &md, 
-              const ShapeFunction &sf,
-              double charge, Target &tgt)
-            : m_mesh_data(md), m_shape_function(sf), m_charge(charge), m_target(tgt)
-          { }
-
-          void add_shape_on_element(
-              const bounded_vector &center,
-              const mesh_data::element_number en
-              ) const
-          {
-            const mesh_data::element_info &einfo(
-                m_mesh_data.m_element_info[en]);
-
-            const unsigned el_length = einfo.m_end-einfo.m_start;
-            dyn_vector el_rho(el_length);
-
-            for (unsigned i = 0; i < el_length; i++)
-              el_rho[i] = 
-                m_charge * m_shape_function(
-                    m_mesh_data.mesh_node(einfo.m_start+i) 
-                    - center);
-
-            m_target.add_shape_on_element(en, einfo.m_start, el_rho);
-          }
-      };
-
     public:
       typedef ParticleState particle_state;
 
@@ -114,12 +119,13 @@ namespace pyrticle
 
       ShapeFunction m_shape_function;
       const mesh_data &m_mesh_data;
+      element_finder_kind m_element_finder;
 
 
 
 
       shape_function_depositor(const mesh_data &md)
-        : m_mesh_data(md)
+        : m_mesh_data(md), m_element_finder(finder_face_based)
       { }
     
 
@@ -132,19 +138,84 @@ namespace pyrticle
           Target &tgt,
           boost::python::slice const &pslice) const
       {
-        element_finder el_finder(m_mesh_data);
+        element_finder el_finder(m_mesh_data, m_element_finder);
+        shape_footprints footprints(m_mesh_data);
+        dyn_vector shape_values;
 
         FOR_ALL_SLICE_INDICES_PREP(pslice, ps.particle_count)
+        gil_release no_gil;
 
-        FOR_ALL_SLICE_INDICES_LOOP
+        for (Py_ssize_t batch_start = 0;
+            batch_start < FOR_ALL_SLICE_INDICES_COUNT;
+            batch_start += shape_deposition_batch_size)
         {
-          FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
+          const Py_ssize_t batch_end = std::min<Py_ssize_t>(
+              FOR_ALL_SLICE_INDICES_COUNT,
+              batch_start + shape_deposition_batch_size);
+
+          footprints.clear();
+          {
+            PYRTICLE_PHASE(dep_footprint);
 
-          element_target<Target> el_target(m_mesh_data, m_shape_function, ps.charges[pn], tgt);
+            FOR_ALL_SLICE_INDICES_RANGE(batch_start, batch_end)
+            {
+              FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
+              el_finder(ps, footprints, pn, m_shape_function.radius());
+              footprints.end_particle();
+            }
 
-          tgt.begin_particle(pn);
-          el_finder(ps, el_target, pn, m_shape_function.radius());
-          tgt.end_particle(pn);
+            PYRTICLE_PHASE_COUNT(dep_footprint, footprints.m_elements.size());
+          }
+
+          {
+            PYRTICLE_PHASE(dep_shape_eval);
+            PYRTICLE_PHASE_COUNT(dep_shape_eval, footprints.m_shape_dofs);
+
+            shape_values.resize(footprints.m_shape_dofs, false);
+
+            unsigned i_particle = 0;
+            FOR_ALL_SLICE_INDICES_RANGE(batch_start, batch_end)
+            {
+              FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
+              const double charge = ps.charge(pn);
+
+              for (unsigned i_el = footprints.m_particle_starts[i_particle];
+                  i_el < footprints.m_particle_starts[i_particle+1]; ++i_el)
+              {
+                const shape_footprints::element &el = footprints.m_elements[i_el];
+
+                for (unsigned i = 0; i < el.m_el_length; i++)
+                  shape_values[el.m_shape_start_index+i] = 
+                    charge * m_shape_function(
+                        m_mesh_data.mesh_node(el.m_global_start_index+i) 
+                        - el.m_center);
+              }
+              ++i_particle;
+            }
+          }
+
+          {
+            PYRTICLE_PHASE(dep_scatter);
+
+            unsigned i_particle = 0;
+            FOR_ALL_SLICE_INDICES_RANGE(batch_start, batch_end)
+            {
+              FOR_ALL_SLICE_INDICES_INNER(particle_number, pn);
+
+              tgt.begin_particle(pn);
+              for (unsigned i_el = footprints.m_particle_starts[i_particle];
+                  i_el < footprints.m_particle_starts[i_particle+1]; ++i_el)
+              {
+                const shape_footprints::element &el = footprints.m_elements[i_el];
+                tgt.add_shape_on_element(el.m_el_number, el.m_global_start_index,
+                    subrange(shape_values,
+                      el.m_shape_start_index,
+                      el.m_shape_start_index+el.m_el_length));
+              }
+              tgt.end_particle(pn);
+              ++i_particle;
+            }
+          }
         }
       }
   };
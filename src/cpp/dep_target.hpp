@@ -25,6 +25,9 @@
 
 
 
+#include <vector>
+#include <boost/foreach.hpp>
+#include <boost/shared_ptr.hpp>
 #include "meshdata.hpp"
 #include "bases.hpp"
 
@@ -199,6 +202,110 @@ namespace pyrticle
 
 
 
+  typedef pyublas::numpy_vector<species_number> group_vector;
+
+  /** Deposition target that hands each particle on to one of several
+   * targets, selected by the particle's entry in a vector of group
+   * numbers, such as the particle species. Particles whose group has no
+   * target are skipped. This obtains per-group densities from a single
+   * pass over the particles.
+   *
+   * Copies share the group targets, so that this may also be passed by
+   * value. Besides the protocol above, the grid target protocol of
+   * dep_grid_base.hpp is forwarded.
+   */
+  template <class Target>
+  class grouped_deposition_target
+  {
+    private:
+      const group_vector &m_groups;
+      std::vector<boost::shared_ptr<Target> > m_targets;
+      Target *m_current;
+
+    public:
+      grouped_deposition_target(const group_vector &groups)
+        : m_groups(groups), m_current(0)
+      { }
+
+      /** Add the target for the next group, taking ownership of it. */
+      void add_target(Target *tgt)
+      {
+        m_targets.push_back(boost::shared_ptr<Target>(tgt));
+      }
+
+      void begin_particle(const particle_number pn)
+      {
+        const unsigned group = m_groups[pn];
+        if (group < m_targets.size())
+        {
+          m_current = m_targets[group].get();
+          m_current->begin_particle(pn);
+        }
+        else
+          m_current = 0;
+      }
+
+      template <class VectorExpression>
+      void add_shape_on_element(const mesh_data::element_number en, 
+          const mesh_data::node_number start_idx, 
+          VectorExpression const &rho_contrib)
+      {
+        if (m_current)
+          m_current->add_shape_on_element(en, start_idx, rho_contrib);
+      }
+
+      void add_shape_value(unsigned vec_idx, double q_shapeval)
+      {
+        if (m_current)
+          m_current->add_shape_value(vec_idx, q_shapeval);
+      }
+
+      void end_particle(const particle_number pn)
+      {
+        if (m_current)
+          m_current->end_particle(pn);
+      }
+  };
+
+
+
+
+  /** Allocate one vector of shape \c dims for each of \c group_count
+   * groups. */
+  inline
+  std::vector<py_vector> make_group_vectors(unsigned group_count,
+      int ndim, const npy_intp *dims)
+  {
+    std::vector<py_vector> result;
+    result.reserve(group_count);
+    for (unsigned g = 0; g < group_count; ++g)
+      result.push_back(py_vector(ndim, dims));
+    return result;
+  }
+
+
+
+
+  /** Copy per-group results of shape \c dims into one vector of shape
+   * (group count,) + \c dims. */
+  inline
+  py_vector stack_group_vectors(const std::vector<py_vector> &vectors,
+      int ndim, const npy_intp *dims)
+  {
+    std::vector<npy_intp> stacked_dims(1, vectors.size());
+    stacked_dims.insert(stacked_dims.end(), dims, dims+ndim);
+    py_vector result(ndim+1, &stacked_dims.front());
+
+    py_vector::iterator it = result.begin();
+    BOOST_FOREACH(const py_vector &vec, vectors)
+      it = std::copy(vec.begin(), vec.end(), it);
+
+    return result;
+  }
+
+
+
+
   // depositor drivers ----------------------------------------------------
   template <class Depositor>
   boost::tuple<py_vector, py_vector> 
@@ -271,6 +378,71 @@ namespace pyrticle
     dep.deposit_densities_on_target(ds, ps, rho_tgt, pslice);
     return rho;
   }
+
+
+
+
+  template <class Depositor>
+  boost::tuple<py_vector, py_vector> 
+    deposit_grouped_densities(
+        const Depositor &dep,
+        typename Depositor::depositor_state &ds,
+        const typename Depositor::particle_state &ps,
+        unsigned node_count, 
+        const py_vector &velocities, 
+        const group_vector &groups,
+        unsigned group_count,
+        const boost::python::slice &pslice)
+  {
+    npy_intp rho_dims[] = { node_count };
+    npy_intp j_dims[] = { node_count, ps.vdim() };
+    std::vector<py_vector> rhos(make_group_vectors(group_count, 1, rho_dims));
+    std::vector<py_vector> js(make_group_vectors(group_count, 2, j_dims));
+
+    typedef j_deposition_target<
+      Depositor::particle_state::m_vdim> j_tgt_t;
+    typedef chained_deposition_target<rho_deposition_target, j_tgt_t> 
+      group_tgt_t;
+
+    grouped_deposition_target<group_tgt_t> tgt(groups);
+    for (unsigned g = 0; g < group_count; ++g)
+    {
+      rho_deposition_target rho_tgt(rhos[g]);
+      j_tgt_t j_tgt(js[g], velocities);
+      tgt.add_target(new group_tgt_t(rho_tgt, j_tgt));
+    }
+
+    dep.deposit_densities_on_target(ds, ps, tgt, pslice);
+
+    return boost::make_tuple(
+        stack_group_vectors(rhos, 1, rho_dims),
+        stack_group_vectors(js, 2, j_dims));
+  }
+
+
+
+
+  template <class Depositor>
+  py_vector deposit_grouped_rho(
+      const Depositor &dep,
+      typename Depositor::depositor_state &ds,
+      typename Depositor::particle_state const &ps,
+      unsigned node_count,
+      const group_vector &groups,
+      unsigned group_count,
+      boost::python::slice const &pslice)
+  {
+    npy_intp dims[] = { node_count };
+    std::vector<py_vector> rhos(make_group_vectors(group_count, 1, dims));
+
+    grouped_deposition_target<rho_deposition_target> tgt(groups);
+    for (unsigned g = 0; g < group_count; ++g)
+      tgt.add_target(new rho_deposition_target(rhos[g]));
+
+    dep.deposit_densities_on_target(ds, ps, tgt, pslice);
+
+    return stack_group_vectors(rhos, 1, dims);
+  }
 }
 
 
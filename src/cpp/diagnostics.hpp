@@ -25,15 +25,30 @@
 
 
 #include <cmath>
+#include <algorithm>
+#include <stdexcept>
 #include <boost/foreach.hpp>
 #include <boost/numeric/ublas/vector_proxy.hpp>
 #include "particle_state.hpp"
+#include "phase_timing.hpp"
 
 
 
 
 namespace pyrticle
 {
+  /** Return (gamma-1) m c^2, in a form that does not cancel for small
+   * momenta. */
+  inline
+  double kinetic_energy(double m, double p_squared, double vacuum_c)
+  {
+    const double mc = m*vacuum_c;
+    return vacuum_c*p_squared/(sqrt(mc*mc + p_squared) + mc);
+  }
+
+
+
+
   template <class ParticleState>
   const py_vector kinetic_energies(ParticleState const &ps, double vacuum_c)
   {
@@ -41,17 +56,14 @@ namespace pyrticle
 
     py_vector result(ps.particle_count);
 
-    const double c_squared = vacuum_c*vacuum_c;
-
     for (particle_number pn = 0; pn < ps.particle_count; pn++)
     {
       const unsigned vpstart = vdim*pn;
       const unsigned vpend = vdim*(pn+1);
 
-      const double m = ps.masses[pn];
-      double p = norm_2(subrange(ps.momenta, vpstart, vpend));
-      double v = vacuum_c*p/sqrt(m*m*c_squared + p*p);
-      result[pn] = (p/v-m)*c_squared;
+      result[pn] = kinetic_energy(ps.mass(pn),
+          norm_2_square(subrange(ps.momenta, vpstart, vpend)),
+          vacuum_c);
     }
     return result;
   }
@@ -63,7 +75,7 @@ namespace pyrticle
   {
     double result = 0;
     for (particle_number pn = 0; pn < ps.particle_count; pn++)
-      result += ps.charges[pn];
+      result += ps.charge(pn);
     return result;
   }
 
@@ -156,30 +168,324 @@ namespace pyrticle
 
 
 
+  template <class ParticleState>
+  const py_vector particle_current(ParticleState const &ps, py_vector const &velocities,
+      double length)
+  {
+    const unsigned vdim = ps.vdim();
+    py_vector result(vdim);
+    result.clear();
+
+    for (particle_number pn = 0; pn < ps.particle_count; pn++)
+      result += ps.charge(pn) * subrange(velocities, vdim*pn, vdim*(pn+1));
+
+    return result / length;
+  }
+
+
+
+
+  /** Totals, means and (co)variances of particle quantities, as
+   * computed by get_beam_moments. Means and variances are taken over
+   * particles, unweighted by charge.
+   *
+   * The slope of a particle along an axis is the ratio of its momentum
+   * along that axis to that along the beam axis, or zero if either is
+   * unavailable.
+   */
+  struct beam_moments
+  {
+    unsigned particle_count;
+
+    double total_charge;
+    double total_kinetic_energy;
+    py_vector total_momentum;
+    /** The sum of charge times velocity. */
+    py_vector total_charge_velocity;
+
+    py_vector mean_position;
+    py_vector position_variance;
+    py_vector mean_slope;
+    py_vector slope_variance;
+    py_vector position_slope_covariance;
+
+    double mean_kinetic_energy;
+    double kinetic_energy_variance;
+  };
+
+
+
+
+  /** Compute all beam_moments in one pass over the particles, updating
+   * the means and centered second moments as in Welford's algorithm.
+   */
+  template <class ParticleState>
+  beam_moments get_beam_moments(ParticleState const &ps, double vacuum_c,
+      unsigned beam_axis)
+  {
+    PYRTICLE_PHASE(diag_moments);
+    PYRTICLE_PHASE_COUNT(diag_moments, ps.particle_count);
+
+    static const unsigned xdim = ParticleState::m_xdim;
+    static const unsigned vdim = ParticleState::m_vdim;
+
+    if (beam_axis >= vdim)
+      throw std::runtime_error("invalid beam axis");
+
+    double total_charge = 0;
+    double total_kinetic_energy = 0;
+    double total_momentum[vdim], total_charge_velocity[vdim];
+    std::fill(total_momentum, total_momentum+vdim, 0.);
+    std::fill(total_charge_velocity, total_charge_velocity+vdim, 0.);
+
+    double mean_x[xdim], m2_x[xdim];
+    double mean_xp[xdim], m2_xp[xdim], c_x_xp[xdim];
+    std::fill(mean_x, mean_x+xdim, 0.);
+    std::fill(m2_x, m2_x+xdim, 0.);
+    std::fill(mean_xp, mean_xp+xdim, 0.);
+    std::fill(m2_xp, m2_xp+xdim, 0.);
+    std::fill(c_x_xp, c_x_xp+xdim, 0.);
+
+    double mean_ke = 0, m2_ke = 0;
+
+    for (particle_number pn = 0; pn < ps.particle_count; pn++)
+    {
+      const double inv_n = 1./(pn+1);
+      const double q = ps.charge(pn);
+      const double m = ps.mass(pn);
+
+      const double *p = &ps.momenta[pn*vdim];
+      double p_squared = 0;
+      for (unsigned i = 0; i < vdim; ++i)
+        p_squared += p[i]*p[i];
+
+      // v = p c / (gamma m c)
+      const double mc = m*vacuum_c;
+      const double v_scale = vacuum_c/sqrt(mc*mc + p_squared);
+      const double ke = kinetic_energy(m, p_squared, vacuum_c);
+
+      total_charge += q;
+      total_kinetic_energy += ke;
+      for (unsigned i = 0; i < vdim; ++i)
+      {
+        total_momentum[i] += p[i];
+        total_charge_velocity[i] += q*v_scale*p[i];
+      }
+
+      const double p_beam = p[beam_axis];
+      for (unsigned i = 0; i < xdim; ++i)
+      {
+        const double x = ps.positions[pn*xdim+i];
+        const double xp = (i < vdim && p_beam) ? p[i]/p_beam : 0;
+
+        const double dx = x - mean_x[i];
+        mean_x[i] += dx*inv_n;
+        m2_x[i] += dx*(x - mean_x[i]);
+
+        const double dxp = xp - mean_xp[i];
+        mean_xp[i] += dxp*inv_n;
+        m2_xp[i] += dxp*(xp - mean_xp[i]);
+        c_x_xp[i] += dx*(xp - mean_xp[i]);
+      }
+
+      const double dke = ke - mean_ke;
+      mean_ke += dke*inv_n;
+      m2_ke += dke*(ke - mean_ke);
+    }
+
+    const double inv_count = ps.particle_count ? 1./ps.particle_count : 0;
+
+    beam_moments result;
+    result.particle_count = ps.particle_count;
+    result.total_charge = total_charge;
+    result.total_kinetic_energy = total_kinetic_energy;
+    result.mean_kinetic_energy = mean_ke;
+    result.kinetic_energy_variance = m2_ke*inv_count;
+
+    result.total_momentum = py_vector(vdim);
+    result.total_charge_velocity = py_vector(vdim);
+    std::copy(total_momentum, total_momentum+vdim,
+        result.total_momentum.begin());
+    std::copy(total_charge_velocity, total_charge_velocity+vdim,
+        result.total_charge_velocity.begin());
+
+    result.mean_position = py_vector(xdim);
+    result.position_variance = py_vector(xdim);
+    result.mean_slope = py_vector(xdim);
+    result.slope_variance = py_vector(xdim);
+    result.position_slope_covariance = py_vector(xdim);
+    for (unsigned i = 0; i < xdim; ++i)
+    {
+      result.mean_position[i] = mean_x[i];
+      result.position_variance[i] = m2_x[i]*inv_count;
+      result.mean_slope[i] = mean_xp[i];
+      result.slope_variance[i] = m2_xp[i]*inv_count;
+      result.position_slope_covariance[i] = c_x_xp[i]*inv_count;
+    }
+
+    return result;
+  }
+
+
+
+
   template <class ParticleState>
   const double rms_energy_spread(ParticleState const &ps, double vacuum_c)
   {
-    if (ps.particle_count == 0)
-      return 0;
-    py_vector energies = kinetic_energies(ps, vacuum_c);
-    return std_dev(energies.begin(), energies.end());
+    return sqrt(get_beam_moments(ps, vacuum_c, ps.vdim()-1)
+        .kinetic_energy_variance);
   }
 
 
 
 
+  /** Equal-width bins covering [min, max). */
+  class histogram_axis
+  {
+    private:
+      double m_min, m_scale;
+      unsigned m_bins;
+
+    public:
+      histogram_axis(double min, double max, unsigned bins)
+        : m_min(min), m_scale(bins/(max-min)), m_bins(bins)
+      {
+        if (bins == 0 || !(max > min))
+          throw std::runtime_error("invalid histogram range");
+      }
+
+      unsigned bins() const
+      { return m_bins; }
+
+      /** Set bin to the bin containing value and return true, or
+       * return false if value is out of range.
+       */
+      bool find_bin(double value, unsigned &bin) const
+      {
+        const double pos = (value-m_min)*m_scale;
+        // also catches NaN
+        if (!(pos >= 0 && pos < m_bins))
+          return false;
+        bin = std::min(unsigned(pos), m_bins-1);
+        return true;
+      }
+  };
+
+
+
+
+  /** Return the number of particles in each bin of position along axis.
+   * Particles are counted with their weights, if any, and particles
+   * outside the range are not counted.
+   */
   template <class ParticleState>
-  const py_vector particle_current(ParticleState const &ps, py_vector const &velocities,
-      double length)
+  const py_vector position_histogram(ParticleState const &ps, unsigned axis,
+      double min, double max, unsigned bins)
   {
+    PYRTICLE_PHASE(diag_histogram);
+    PYRTICLE_PHASE_COUNT(diag_histogram, ps.particle_count);
+
+    if (axis >= ps.xdim())
+      throw std::runtime_error("invalid histogram axis");
+
+    const histogram_axis hist_axis(min, max, bins);
+    const bool weighted = ps.is_weighted();
+
+    py_vector result(bins);
+    result.clear();
+
+    unsigned bin;
+    for (particle_number pn = 0; pn < ps.particle_count; pn++)
+      if (hist_axis.find_bin(ps.positions[pn*ps.xdim() + axis], bin))
+        result[bin] += weighted ? ps.weights[pn] : 1;
+
+    return result;
+  }
+
+
+
+
+  /** Return the number of particles in each bin of the kinetic energy
+   * per particle, in the manner of position_histogram.
+   */
+  template <class ParticleState>
+  const py_vector energy_histogram(ParticleState const &ps, double vacuum_c,
+      double min, double max, unsigned bins)
+  {
+    PYRTICLE_PHASE(diag_histogram);
+    PYRTICLE_PHASE_COUNT(diag_histogram, ps.particle_count);
+
     const unsigned vdim = ps.vdim();
-    py_vector result(vdim);
+    const histogram_axis hist_axis(min, max, bins);
+    const bool weighted = ps.is_weighted();
+
+    py_vector result(bins);
     result.clear();
 
+    unsigned bin;
     for (particle_number pn = 0; pn < ps.particle_count; pn++)
-      result += ps.charges[pn] * subrange(velocities, vdim*pn, vdim*(pn+1));
+    {
+      const double weight = weighted ? ps.weights[pn] : 1;
+
+      double p_squared = 0;
+      for (unsigned i = 0; i < vdim; ++i)
+        p_squared += square(ps.momenta[pn*vdim + i]);
+
+      // bin the energy of one particle of the species, not that of the
+      // whole macroparticle
+      const double m = ps.species_masses[ps.species[pn]];
+      if (hist_axis.find_bin(
+            kinetic_energy(m, p_squared/(weight*weight), vacuum_c), bin))
+        result[bin] += weight;
+    }
 
-    return result / length;
+    return result;
+  }
+
+
+
+
+  /** Return the number of particles in each bin of the trace space of
+   * axis, i.e. of position against slope p_axis/p_beam_axis, as a
+   * row-major array of x_bins by xp_bins counts, in the manner of
+   * position_histogram. Particles without momentum along the beam
+   * axis are not counted.
+   */
+  template <class ParticleState>
+  const py_vector trace_space_histogram(ParticleState const &ps,
+      unsigned axis, unsigned beam_axis,
+      double x_min, double x_max, unsigned x_bins,
+      double xp_min, double xp_max, unsigned xp_bins)
+  {
+    PYRTICLE_PHASE(diag_histogram);
+    PYRTICLE_PHASE_COUNT(diag_histogram, ps.particle_count);
+
+    const unsigned xdim = ps.xdim();
+    const unsigned vdim = ps.vdim();
+
+    if (axis >= xdim || axis >= vdim || beam_axis >= vdim)
+      throw std::runtime_error("invalid histogram axis");
+
+    const histogram_axis x_axis(x_min, x_max, x_bins);
+    const histogram_axis xp_axis(xp_min, xp_max, xp_bins);
+    const bool weighted = ps.is_weighted();
+
+    py_vector result(x_bins*xp_bins);
+    result.clear();
+
+    unsigned x_bin, xp_bin;
+    for (particle_number pn = 0; pn < ps.particle_count; pn++)
+    {
+      const double p_beam = ps.momenta[pn*vdim + beam_axis];
+      if (!p_beam)
+        continue;
+
+      if (x_axis.find_bin(ps.positions[pn*xdim + axis], x_bin)
+          && xp_axis.find_bin(ps.momenta[pn*vdim + axis]/p_beam, xp_bin))
+        result[x_bin*xp_bins + xp_bin] += weighted ? ps.weights[pn] : 1;
+    }
+
+    return result;
   }
 }
 
@@ -40,6 +40,29 @@
 
 namespace pyrticle
 {
+  template <class VecType>
+  inline
+  bool is_not_near_vertex(VecType const &unit_pt)
+  {
+    bool not_near_vertex = true;
+
+    double uc_sum = 0;
+    BOOST_FOREACH(double uc, unit_pt)
+    {
+      if (uc > 0)
+      {
+        not_near_vertex = false;
+        break;
+      }
+      uc_sum += uc;
+    }
+
+    return not_near_vertex && (1-0.5*(uc_sum+unit_pt.size()) < 0.5);
+  }
+
+
+
+
   class heuristic_element_finder
   {
     private:
@@ -55,34 +78,37 @@ namespace pyrticle
       void add_shape_by_neighbors(
           ElementTarget &target,
           const bounded_vector &pos,
-          const mesh_data::element_info &einfo,
+          mesh_data::element_number en,
           double radius)
       {
-        target.add_shape_on_element(pos, einfo.m_id);
+        const mesh_data &md = m_mesh_data;
+
+        target.add_shape_on_element(pos, en);
 
-        BOOST_FOREACH(const mesh_data::face_info &face, einfo.m_faces)
+        for (mesh_data::face_number fn = 0; fn < md.faces_per_element(); ++fn)
         {
-          if (face.m_neighbor != mesh_data::INVALID_ELEMENT)
+          const mesh_data::element_number neighbor = md.face_neighbor(en, fn);
+          if (neighbor != mesh_data::INVALID_ELEMENT)
           {
-            const mesh_data::axis_number per_axis = face.m_neighbor_periodicity_axis;
+            const mesh_data::axis_number per_axis = md.face_periodicity_axis(en, fn);
 
             if (per_axis == mesh_data::INVALID_AXIS)
-              target.add_shape_on_element(pos, face.m_neighbor);
+              target.add_shape_on_element(pos, neighbor);
             else
             {
               bounded_vector pos2(pos);
               const mesh_data::periodicity_axis &pa =
-                m_mesh_data.m_periodicities[per_axis];
+                md.m_periodicities[per_axis];
 
               if (pos[per_axis] - radius < pa.m_min)
               {
                 pos2[per_axis] += (pa.m_max-pa.m_min);
-                target.add_shape_on_element(pos2, face.m_neighbor);
+                target.add_shape_on_element(pos2, neighbor);
               }
               if (pos[per_axis] + radius > pa.m_max)
               {
                 pos2[per_axis] -= (pa.m_max-pa.m_min);
-                target.add_shape_on_element(pos2, face.m_neighbor);
+                target.add_shape_on_element(pos2, neighbor);
               }
             }
           }
@@ -96,17 +122,20 @@ namespace pyrticle
       void add_shape_by_vertex(
           ElementTarget &target,
           const bounded_vector &pos,
-          const mesh_data::element_info &einfo,
+          mesh_data::element_number en,
           double radius)
       {
+        const mesh_data &md = m_mesh_data;
+
         // find closest vertex
         mesh_data::vertex_number closest_vertex =
           mesh_data::INVALID_VERTEX;
         double min_dist = std::numeric_limits<double>::infinity();
 
-        BOOST_FOREACH(mesh_data::vertex_number vi, einfo.m_vertices)
+        for (unsigned i = 0; i < md.vertices_per_element(); ++i)
         {
-          double dist = norm_2(m_mesh_data.mesh_vertex(vi) - pos);
+          const mesh_data::vertex_number vi = md.element_vertex(en, i);
+          double dist = norm_2(md.mesh_vertex(vi) - pos);
           if (dist < min_dist)
           {
             closest_vertex = vi;
@@ -114,8 +143,6 @@ namespace pyrticle
           }
         }
 
-        const mesh_data &md = m_mesh_data;
-
         // go through vertex-adjacent elements
         unsigned start = md.m_vertex_adj_element_starts[closest_vertex];
         unsigned stop = md.m_vertex_adj_element_starts[closest_vertex+1];
@@ -163,8 +190,6 @@ namespace pyrticle
             ps.positions, pn*dim, (pn+1)*dim);
         const mesh_data::element_number containing_el =
           ps.containing_elements[pn];
-        const mesh_data::element_info &einfo(
-            m_mesh_data.m_element_info[containing_el]);
 
         // We're deciding between RULE A and RULE B below.
         // The decision is made by looking at the barycentric coordinates of
@@ -181,18 +206,18 @@ namespace pyrticle
 
         // FIXME this assumes dimension_pos == dimension_mesh
 
-        if (is_not_near_vertex(einfo.m_inverse_map(pos)))
+        if (is_not_near_vertex(m_mesh_data.map_to_unit(containing_el, pos)))
         {
           // RULE A: we're far enough away from vertices,
           //m_neighbor_shape_adds.tick();
-          add_shape_by_neighbors(target, pos, einfo, radius);
+          add_shape_by_neighbors(target, pos, containing_el, radius);
         }
         else
         {
           // RULE B: we're close to a vertex, weight onto all elements
           // adjoining that vertex
           //m_vertex_shape_adds.tick();
-          add_shape_by_vertex(target, pos, einfo, radius);
+          add_shape_by_vertex(target, pos, containing_el, radius);
         }
       }
   };
@@ -243,50 +268,53 @@ namespace pyrticle
         target.add_shape_on_element(pos, en);
         el_set.insert(en);
 
-        const mesh_data::element_info &einfo(
-            m_mesh_data.m_element_info[en]);
-        BOOST_FOREACH(const mesh_data::face_info &face, einfo.m_faces)
+        const mesh_data &md = m_mesh_data;
+
+        for (mesh_data::face_number fn = 0; fn < md.faces_per_element(); ++fn)
         {
-          if (face.m_neighbor == mesh_data::INVALID_ELEMENT)
+          const mesh_data::element_number neighbor = md.face_neighbor(en, fn);
+
+          if (neighbor == mesh_data::INVALID_ELEMENT)
             continue;
 
-          if (el_set.find(face.m_neighbor) != el_set.end())
+          if (el_set.find(neighbor) != el_set.end())
             continue;
 
           // test 1: necessary for inclusion
           // d(blob, faceplane) < particle_radius?
           double plane_dist = fabs(
-              inner_prod(pos, face.m_normal) - face.m_face_plane_eqn_rhs);
+              inner_prod(pos, md.face_normal(en, fn))
+              - md.face_plane_eqn_rhs(en, fn));
 
           if (plane_dist > radius)
             continue;
 
           // test 2: sufficient for exclusion
           // d(face_bound_circle, pos) < radius?
-          if (norm_2(face.m_face_centroid-pos)
-              > radius+face.m_face_radius_from_centroid)
+          if (norm_2(md.face_centroid(en, fn)-pos)
+              > radius+md.face_radius_from_centroid(en, fn))
             continue;
 
           // treat periodicity
-          const mesh_data::axis_number per_axis = face.m_neighbor_periodicity_axis;
+          const mesh_data::axis_number per_axis = md.face_periodicity_axis(en, fn);
 
           if (per_axis == mesh_data::INVALID_AXIS)
-            recurse(target, pos, radius, el_set, face.m_neighbor);
+            recurse(target, pos, radius, el_set, neighbor);
           else
           {
             bounded_vector pos2(pos);
             const mesh_data::periodicity_axis &pa =
-              m_mesh_data.m_periodicities[per_axis];
+              md.m_periodicities[per_axis];
 
             if (pos[per_axis] - radius < pa.m_min)
             {
               pos2[per_axis] += (pa.m_max-pa.m_min);
-              recurse(target, pos2, radius, el_set, face.m_neighbor);
+              recurse(target, pos2, radius, el_set, neighbor);
             }
             if (pos[per_axis] + radius > pa.m_max)
             {
               pos2[per_axis] -= (pa.m_max-pa.m_min);
-              recurse(target, pos2, radius, el_set, face.m_neighbor);
+              recurse(target, pos2, radius, el_set, neighbor);
             }
           }
         }
@@ -315,12 +343,15 @@ namespace pyrticle
 
         bool all_inside = true;
 
-        const mesh_data::element_info &einfo(
-            m_mesh_data.m_element_info[en]);
-        BOOST_FOREACH(const mesh_data::face_info &face, einfo.m_faces)
+        const mesh_data &md = m_mesh_data;
+
+        for (mesh_data::face_number fn = 0; fn < md.faces_per_element(); ++fn)
         {
+          const mesh_data::element_number neighbor = md.face_neighbor(en, fn);
+
           double plane_dist =
-              inner_prod(pos, face.m_normal) - face.m_face_plane_eqn_rhs;
+              inner_prod(pos, md.face_normal(en, fn))
+              - md.face_plane_eqn_rhs(en, fn);
 
           if (plane_dist >= radius)
           {
@@ -329,31 +360,31 @@ namespace pyrticle
           }
           else
           {
-            if (face.m_neighbor == mesh_data::INVALID_ELEMENT)
+            if (neighbor == mesh_data::INVALID_ELEMENT)
               continue;
-            if (el_set.find(face.m_neighbor) != el_set.end())
+            if (el_set.find(neighbor) != el_set.end())
               continue;
 
             // treat periodicity
-            const mesh_data::axis_number per_axis = face.m_neighbor_periodicity_axis;
+            const mesh_data::axis_number per_axis = md.face_periodicity_axis(en, fn);
 
             if (per_axis == mesh_data::INVALID_AXIS)
-              recurse(target, pos, radius, el_set, face.m_neighbor);
+              recurse(target, pos, radius, el_set, neighbor);
             else
             {
               bounded_vector pos2(pos);
               const mesh_data::periodicity_axis &pa =
-                m_mesh_data.m_periodicities[per_axis];
+                md.m_periodicities[per_axis];
 
               if (pos[per_axis] - radius < pa.m_min)
               {
                 pos2[per_axis] += (pa.m_max-pa.m_min);
-                recurse(target, pos2, radius, el_set, face.m_neighbor);
+                recurse(target, pos2, radius, el_set, neighbor);
               }
               if (pos[per_axis] + radius > pa.m_max)
               {
                 pos2[per_axis] -= (pa.m_max-pa.m_min);
-                recurse(target, pos2, radius, el_set, face.m_neighbor);
+                recurse(target, pos2, radius, el_set, neighbor);
               }
             }
           }
@@ -367,9 +398,57 @@ namespace pyrticle
 
 
 
-  // typedef heuristic_element_finder element_finder;
-  typedef face_based_element_finder element_finder;
-  // typedef hyperplane_element_finder element_finder;
+  enum element_finder_kind
+  {
+    finder_heuristic,
+    finder_face_based,
+    finder_hyperplane
+  };
+
+
+
+
+  /** Dispatches to one of the finders above, chosen at run time.
+   *
+   * The choice is made once per particle, which is cheap compared to the
+   * footprint search itself.
+   */
+  class element_finder
+  {
+    private:
+      element_finder_kind m_kind;
+      heuristic_element_finder m_heuristic;
+      face_based_element_finder m_face_based;
+      hyperplane_element_finder m_hyperplane;
+
+    public:
+      element_finder(const mesh_data &md,
+          element_finder_kind kind=finder_face_based)
+        : m_kind(kind), m_heuristic(md), m_face_based(md), m_hyperplane(md)
+      { }
+
+      template <class ParticleState, class ElementTarget>
+      void operator()(
+          const ParticleState &ps,
+          ElementTarget &target,
+          particle_number pn, double radius)
+      {
+        switch (m_kind)
+        {
+          case finder_heuristic:
+            m_heuristic(ps, target, pn, radius);
+            break;
+          case finder_face_based:
+            m_face_based(ps, target, pn, radius);
+            break;
+          case finder_hyperplane:
+            m_hyperplane(ps, target, pn, radius);
+            break;
+          default:
+            throw std::runtime_error("invalid element finder");
+        }
+      }
+  };
 }
 
 
@@ -71,36 +71,6 @@ namespace pyrticle
 
 
       // data structures ------------------------------------------------------
-      struct face_info
-      {
-        bounded_vector        m_normal;
-        element_number        m_neighbor;
-        axis_number           m_neighbor_periodicity_axis;
-
-        /** The equation for the hyperplane containing this face is
-         * m_normal * x = m_face_plane_eqn_rhs.
-         */
-        double                m_face_plane_eqn_rhs;
-
-        /** These two specify a bounding circle on the face. */
-        bounded_vector        m_face_centroid;
-        double                m_face_radius_from_centroid;
-      };
-
-      struct element_info
-      {
-        element_number                 m_id;
-        hedge::affine_map<double>      m_inverse_map;
-        double                         m_jacobian;
-
-        unsigned                       m_start, m_end;
-
-        vtx_id_vector                  m_vertices;
-
-        std::vector<face_info>      m_faces;
-      };
-
-
       struct periodicity_axis
       {
         double                  m_min, m_max;
@@ -109,11 +79,36 @@ namespace pyrticle
       // data members ---------------------------------------------------------
       const unsigned m_dimensions;
 
-      std::vector<element_info> m_element_info;
-
     private:
       dyn_vector m_mesh_vertices, m_mesh_nodes;
 
+      unsigned m_element_count;
+
+      /** The element and face tables below are stored flat, with a fixed
+       * stride per element that depends only on the dimension d: d*d for
+       * the inverse map matrices, d for their offsets, d+1 for the vertices
+       * and faces of a simplex, and d per face for normals and centroids.
+       *
+       * The inverse map of element en is x -> Ax+b with A stored row-major
+       * in m_inverse_map_matrices and b in m_inverse_map_offsets.
+       */
+      dyn_vector m_inverse_map_matrices;
+      dyn_vector m_inverse_map_offsets;
+      dyn_vector m_jacobians;
+      std::vector<node_number> m_element_node_ranges;
+      std::vector<vertex_number> m_element_vertices;
+
+      dyn_vector m_face_normals;
+      /** The equation for the hyperplane containing a face is
+       * face_normal(en, fn) * x = face_plane_eqn_rhs(en, fn).
+       */
+      dyn_vector m_face_plane_eqn_rhs;
+      std::vector<element_number> m_face_neighbors;
+      std::vector<axis_number> m_face_periodicity_axes;
+      /** These two specify a bounding circle on each face. */
+      dyn_vector m_face_centroids;
+      dyn_vector m_face_radii;
+
     public:
       /** The following three encode the vertex-adjacent elements in a sort
        * of Compressed-Row-Storage format. */
@@ -128,7 +123,7 @@ namespace pyrticle
 
       // setup ----------------------------------------------------------------
       mesh_data(unsigned dimensions)
-        : m_dimensions(dimensions)
+        : m_dimensions(dimensions), m_element_count(0)
       { }
 
       void set_vertices(py_vector v)
@@ -136,12 +131,160 @@ namespace pyrticle
       void set_nodes(py_vector n)
       { m_mesh_nodes = n; }
 
+      typedef pyublas::numpy_vector<npy_uint32> uint_vector;
+
+      /** Build the element, face and vertex adjacency data from flat
+       * arrays in one go. All arrays are C-ordered, with element-major
+       * layout for the per-element and per-face data. Each entry of
+       * \c inverse_maps is the d x (d+1) matrix [A|b] of the map
+       * x -> Ax+b. See pyrticle/meshdata.py for how the arrays are
+       * computed.
+       */
+      void fill_from_arrays(
+          uint_vector el_vertices,
+          uint_vector el_node_ranges,
+          py_vector inverse_maps,
+          py_vector jacobians,
+          py_vector face_normals,
+          uint_vector face_neighbors,
+          uint_vector face_periodicity_axes,
+          py_vector face_plane_eqn_rhs,
+          py_vector face_centroids,
+          py_vector face_radii,
+          uint_vector vertex_adj_element_starts,
+          uint_vector vertex_adj_elements,
+          uint_vector vertex_adj_periodicity_axes)
+      {
+        const unsigned d = m_dimensions;
+        const unsigned el_count = jacobians.size();
+        const unsigned face_count = el_count*faces_per_element();
+
+        if (el_vertices.size() != el_count*vertices_per_element()
+            || el_node_ranges.size() != 2*el_count
+            || inverse_maps.size() != el_count*d*(d+1)
+            || face_normals.size() != face_count*d
+            || face_neighbors.size() != face_count
+            || face_periodicity_axes.size() != face_count
+            || face_plane_eqn_rhs.size() != face_count
+            || face_centroids.size() != face_count*d
+            || face_radii.size() != face_count)
+          throw std::runtime_error("mesh array sizes do not match");
+
+        m_element_count = el_count;
+
+        m_inverse_map_matrices.resize(el_count*d*d);
+        m_inverse_map_offsets.resize(el_count*d);
+        for (unsigned en = 0; en < el_count; ++en)
+          for (unsigned i = 0; i < d; ++i)
+          {
+            for (unsigned j = 0; j < d; ++j)
+              m_inverse_map_matrices[(en*d + i)*d + j] =
+                inverse_maps[(en*d + i)*(d+1) + j];
+            m_inverse_map_offsets[en*d + i] =
+              inverse_maps[(en*d + i)*(d+1) + d];
+          }
+
+        m_jacobians = jacobians;
+        m_element_node_ranges.assign(
+            el_node_ranges.begin(), el_node_ranges.end());
+        m_element_vertices.assign(el_vertices.begin(), el_vertices.end());
+
+        m_face_normals = face_normals;
+        m_face_plane_eqn_rhs = face_plane_eqn_rhs;
+        m_face_neighbors.assign(face_neighbors.begin(), face_neighbors.end());
+        m_face_periodicity_axes.assign(
+            face_periodicity_axes.begin(), face_periodicity_axes.end());
+        m_face_centroids = face_centroids;
+        m_face_radii = face_radii;
+
+        m_vertex_adj_element_starts.assign(
+            vertex_adj_element_starts.begin(), vertex_adj_element_starts.end());
+        m_vertex_adj_elements.assign(
+            vertex_adj_elements.begin(), vertex_adj_elements.end());
+        m_vertex_adj_periodicity_axes.assign(
+            vertex_adj_periodicity_axes.begin(), vertex_adj_periodicity_axes.end());
+      }
+
       static element_number get_INVALID_ELEMENT() { return INVALID_ELEMENT; }
       static axis_number get_INVALID_AXIS() { return INVALID_AXIS; }
 
 
 
 
+      // element and face tables ----------------------------------------------
+      unsigned element_count() const
+      { return m_element_count; }
+
+      unsigned vertices_per_element() const
+      { return m_dimensions+1; }
+
+      unsigned faces_per_element() const
+      { return m_dimensions+1; }
+
+      node_number element_start(element_number en) const
+      { return m_element_node_ranges[2*en]; }
+
+      node_number element_end(element_number en) const
+      { return m_element_node_ranges[2*en+1]; }
+
+      double jacobian(element_number en) const
+      { return m_jacobians[en]; }
+
+      vertex_number element_vertex(element_number en, unsigned vi) const
+      { return m_element_vertices[en*vertices_per_element() + vi]; }
+
+      /** Entry (i, j) of the matrix part of the inverse map of element en. */
+      double inverse_map_entry(element_number en, unsigned i, unsigned j) const
+      { return m_inverse_map_matrices[(en*m_dimensions + i)*m_dimensions + j]; }
+
+      /** Apply the inverse map of element en to pt, giving unit coordinates. */
+      template <class VecType>
+      bounded_vector map_to_unit(element_number en, const VecType &pt) const
+      {
+        const unsigned d = m_dimensions;
+        const double *mat = &m_inverse_map_matrices[en*d*d];
+        const double *ofs = &m_inverse_map_offsets[en*d];
+
+        bounded_vector result(d);
+        for (unsigned i = 0; i < d; ++i)
+        {
+          double r = ofs[i];
+          for (unsigned j = 0; j < d; ++j)
+            r += mat[i*d+j]*pt[j];
+          result[i] = r;
+        }
+        return result;
+      }
+
+      typedef boost::numeric::ublas::vector_range<const dyn_vector> const_face_vector_type;
+
+      const_face_vector_type face_normal(element_number en, face_number fn) const
+      {
+        const unsigned fi = en*faces_per_element() + fn;
+        return subrange(m_face_normals, fi*m_dimensions, (fi+1)*m_dimensions);
+      }
+
+      const_face_vector_type face_centroid(element_number en, face_number fn) const
+      {
+        const unsigned fi = en*faces_per_element() + fn;
+        return subrange(m_face_centroids, fi*m_dimensions, (fi+1)*m_dimensions);
+      }
+
+      element_number face_neighbor(element_number en, face_number fn) const
+      { return m_face_neighbors[en*faces_per_element() + fn]; }
+
+      axis_number face_periodicity_axis(element_number en, face_number fn) const
+      { return m_face_periodicity_axes[en*faces_per_element() + fn]; }
+
+      double face_plane_eqn_rhs(element_number en, face_number fn) const
+      { return m_face_plane_eqn_rhs[en*faces_per_element() + fn]; }
+
+      double face_radius_from_centroid(element_number en, face_number fn) const
+      { return m_face_radii[en*faces_per_element() + fn]; }
+
+
+
+
       // operations -----------------------------------------------------------
       unsigned node_count() const
       { return m_mesh_nodes.size()/m_dimensions; }
@@ -168,27 +311,26 @@ namespace pyrticle
 
       bounded_vector element_centroid(element_number en) const
       {
-        const element_info &ei = m_element_info[en];
+        const unsigned vcount = vertices_per_element();
 
-        bounded_vector result(mesh_vertex(ei.m_vertices[0]));
+        bounded_vector result(mesh_vertex(element_vertex(en, 0)));
 
-        for (unsigned i = 1; i < ei.m_vertices.size(); ++i)
-          result += mesh_vertex(ei.m_vertices[i]);
+        for (unsigned i = 1; i < vcount; ++i)
+          result += mesh_vertex(element_vertex(en, i));
 
-        result /= ei.m_vertices.size();
+        result /= vcount;
         return result;
       }
 
       bounded_box element_bounding_box(element_number en) const
       {
-        const element_info &ei = m_element_info[en];
         bounded_vector
-          min(mesh_vertex(ei.m_vertices[0])), 
-          max(mesh_vertex(ei.m_vertices[0]));
+          min(mesh_vertex(element_vertex(en, 0))), 
+          max(mesh_vertex(element_vertex(en, 0)));
 
-        for (unsigned vi = 0; vi < ei.m_vertices.size(); ++vi)
+        for (unsigned vi = 0; vi < vertices_per_element(); ++vi)
         {
-          const_mesh_vertex_type vtx = mesh_vertex(ei.m_vertices[vi]);
+          const_mesh_vertex_type vtx = mesh_vertex(element_vertex(en, vi));
           for (unsigned i = 0; i < m_dimensions; ++i)
           {
             if (vtx[i] < min[i]) min[i] = vtx[i];
@@ -202,17 +344,106 @@ namespace pyrticle
       template <class VecType>
       const bool is_in_element(element_number en, const VecType &pt, double tolerance=1e-10) const
       {
-        return is_in_unit_simplex(m_element_info[en].m_inverse_map(pt), tolerance);
+        return is_in_unit_simplex(map_to_unit(en, pt), tolerance);
+      }
+
+      /** Starting from element \c en, repeatedly cross the face whose
+       * plane \c pt lies furthest beyond until an element containing
+       * \c pt is reached. This follows the line towards \c pt in the
+       * sense that each step moves to an element on the side of \c pt.
+       *
+       * Gives up at boundary and periodic faces and after \c max_steps
+       * steps, returning INVALID_ELEMENT. \c steps receives the number of
+       * faces crossed.
+       */
+      template <class VecType>
+      const element_number walk_to_containing_element(
+          element_number en, const VecType &pt,
+          unsigned max_steps, unsigned &steps) const
+      {
+        for (steps = 0; steps < max_steps; ++steps)
+        {
+          int exit_face = -1;
+          double max_dist = 0;
+
+          for (unsigned fn = 0; fn < faces_per_element(); ++fn)
+          {
+            const double dist =
+              inner_prod(face_normal(en, fn), pt) - face_plane_eqn_rhs(en, fn);
+            if (dist > max_dist)
+            {
+              exit_face = fn;
+              max_dist = dist;
+            }
+          }
+
+          if (exit_face == -1)
+            return is_in_element(en, pt) ? en : INVALID_ELEMENT;
+
+          const element_number neighbor = face_neighbor(en, exit_face);
+          if (neighbor == INVALID_ELEMENT
+              || face_periodicity_axis(en, exit_face) != INVALID_AXIS)
+            return INVALID_ELEMENT;
+
+          en = neighbor;
+          if (is_in_element(en, pt))
+          {
+            ++steps;
+            return en;
+          }
+        }
+
+        return INVALID_ELEMENT;
       }
 
       template <class VecType>
       const element_number find_containing_element(const VecType &pt) const
       {
-        BOOST_FOREACH(const element_info &el, m_element_info)
-          if (is_in_unit_simplex(el.m_inverse_map(pt)))
-            return el.m_id;
+        for (element_number en = 0; en < m_element_count; ++en)
+          if (is_in_unit_simplex(map_to_unit(en, pt)))
+            return en;
         return INVALID_ELEMENT;
       }
+
+      /** Return the containing element of each of the points stored one
+       * after the other in \c points, or INVALID_ELEMENT for points
+       * outside the mesh.
+       *
+       * Points read from files or generated in order are usually close to
+       * their predecessors, so each search first walks across faces from
+       * the previous point's element and only scans all elements if that
+       * fails.
+       */
+      template <class VecType>
+      uint_vector find_containing_elements(const VecType &points) const
+      {
+        static const unsigned max_walk_steps = 256;
+
+        const unsigned point_count = points.size()/m_dimensions;
+        uint_vector result(point_count);
+
+        element_number last_en = INVALID_ELEMENT;
+        for (unsigned i = 0; i < point_count; ++i)
+        {
+          const bounded_vector pt = subrange(points,
+              i*m_dimensions, (i+1)*m_dimensions);
+
+          element_number en = INVALID_ELEMENT;
+          if (last_en != INVALID_ELEMENT)
+          {
+            unsigned steps;
+            en = walk_to_containing_element(last_en, pt, max_walk_steps, steps);
+          }
+          if (en == INVALID_ELEMENT)
+            en = find_containing_element(pt);
+
+          result[i] = en;
+          if (en != INVALID_ELEMENT)
+            last_en = en;
+        }
+
+        return result;
+      }
   };
 }
 
@@ -26,6 +26,7 @@
 
 
 
+#include <algorithm>
 #include <boost/foreach.hpp> 
 #include <boost/shared_ptr.hpp> 
 #include <boost/numeric/ublas/vector_proxy.hpp>
@@ -33,6 +34,7 @@
 #include <boost/format.hpp>
 #include "meshdata.hpp"
 #include "dep_target.hpp"
+#include "phase_timing.hpp"
 
 
 
@@ -56,8 +58,31 @@ namespace pyrticle
     pyublas::numpy_vector<mesh_data::element_number> containing_elements;
     py_vector                         positions;
     py_vector                         momenta;
-    py_vector                         charges;
-    py_vector                         masses;
+
+    /** Each particle belongs to a species, whose macro-particle charge
+     * and mass are found in the (short) tables species_charges and
+     * species_masses at the index given by species. If weights is not
+     * empty, it holds a factor for each particle by which its charge and
+     * mass are scaled.
+     */
+    pyublas::numpy_vector<species_number> species;
+    py_vector                         weights;
+    py_vector                         species_charges;
+    py_vector                         species_masses;
+
+    /** The margin cache records, per particle, a ball that is known to
+     * lie inside one element: the element number, the center of the ball
+     * and its radius, the distance from the center to the closest face
+     * plane. While a particle stays inside the ball belonging to its
+     * containing element, that element need not be looked up again.
+     *
+     * Since every entry is a fact about the mesh alone, stale entries
+     * are harmless. The cache is unused if it holds fewer than
+     * particle_count entries.
+     */
+    pyublas::numpy_vector<mesh_data::element_number> margin_elements;
+    py_vector                         margin_centers;
+    py_vector                         margins;
 
     particle_base_state()
     : particle_count(0)
@@ -75,20 +100,60 @@ namespace pyrticle
       containing_elements = src.containing_elements.copy();
       positions = src.positions.copy();
       momenta = src.momenta.copy();
-      charges = src.charges.copy();
-      masses = src.masses.copy();
+      species = src.species.copy();
+      weights = src.weights.copy();
+      species_charges = src.species_charges.copy();
+      species_masses = src.species_masses.copy();
+      margin_elements = src.margin_elements.copy();
+      margin_centers = src.margin_centers.copy();
+      margins = src.margins.copy();
+    }
+
+    bool is_weighted() const
+    { return weights.size() != 0; }
+
+    double charge(particle_number pn) const
+    {
+      const double q = species_charges[species[pn]];
+      return is_weighted() ? weights[pn]*q : q;
+    }
+
+    double mass(particle_number pn) const
+    {
+      const double m = species_masses[species[pn]];
+      return is_weighted() ? weights[pn]*m : m;
     }
   };
 
 
 
 
+  /** How many faces find_new_containing_element crosses at most while
+   * walking towards a particle's new position before falling back to
+   * slower searches. */
+  static const unsigned max_find_walk_steps = 16;
+
+
+
+
   struct find_event_counters
   {
+    event_counter             find_by_margin;
     event_counter             find_same;
     event_counter             find_by_neighbor;
+    event_counter             find_by_walk;
     event_counter             find_by_vertex;
     event_counter             find_global;
+
+    void add(find_event_counters &other)
+    {
+      find_by_margin.add(other.find_by_margin.get());
+      find_same.add(other.find_same.get());
+      find_by_neighbor.add(other.find_by_neighbor.get());
+      find_by_walk.add(other.find_by_walk.get());
+      find_by_vertex.add(other.find_by_vertex.get());
+      find_global.add(other.find_global.get());
+    }
   };
 
 
@@ -108,7 +173,7 @@ namespace pyrticle
       unsigned vpstart = vdim*pn;
       unsigned vpend = vdim*(pn+1);
 
-      const double m = ps.masses[pn];
+      const double m = ps.mass(pn);
       double p = norm_2(subrange(ps.momenta, vpstart, vpend));
 
       if (p == 0)
@@ -127,6 +192,66 @@ namespace pyrticle
 
 
 
+  // margin cache -------------------------------------------------------------
+  template <class ParticleState>
+  bool has_margin_cache(const ParticleState &ps)
+  {
+    return ps.margin_elements.size() >= ps.particle_count
+      && ps.margins.size() >= ps.particle_count
+      && ps.margin_centers.size() >= ps.particle_count*ps.xdim();
+  }
+
+
+
+
+  template <class ParticleState>
+  bool is_within_margin(
+      const ParticleState &ps,
+      particle_number pn,
+      mesh_data::element_number en)
+  {
+    if (ps.margin_elements[pn] != en)
+      return false;
+
+    const unsigned xdim = ps.xdim();
+    double dist_squared = 0;
+    for (unsigned i = 0; i < xdim; ++i)
+    {
+      const double dx = ps.positions[pn*xdim+i] - ps.margin_centers[pn*xdim+i];
+      dist_squared += dx*dx;
+    }
+
+    const double margin = ps.margins[pn];
+    return dist_squared < margin*margin;
+  }
+
+
+
+
+  template <class ParticleState>
+  void update_margin(
+      const mesh_data &mesh,
+      ParticleState &ps,
+      particle_number pn,
+      mesh_data::element_number en)
+  {
+    const unsigned xdim = ps.xdim();
+    const bounded_vector pt = subrange(ps.positions, pn*xdim, (pn+1)*xdim);
+
+    // face normals point outward, so this is positive inside the element
+    double margin = std::numeric_limits<double>::infinity();
+    for (unsigned fn = 0; fn < mesh.faces_per_element(); ++fn)
+      margin = std::min(margin,
+          mesh.face_plane_eqn_rhs(en, fn) - inner_prod(mesh.face_normal(en, fn), pt));
+
+    ps.margin_elements[pn] = en;
+    subrange(ps.margin_centers, pn*xdim, (pn+1)*xdim) = pt;
+    ps.margins[pn] = margin;
+  }
+
+
+
+
   template <class ParticleState>
   mesh_data::element_number find_new_containing_element(
       const mesh_data &mesh,
@@ -144,63 +269,28 @@ namespace pyrticle
 
     if (prev != mesh_data::INVALID_ELEMENT)
     {
-      const mesh_data::element_info &prev_el = mesh.m_element_info[prev];
-
       // check if we're still in the same element -------------------------
-      if (is_in_unit_simplex(prev_el.m_inverse_map(pt)))
+      if (is_in_unit_simplex(mesh.map_to_unit(prev, pt)))
       {
         counters.find_same.tick();
         return prev;
       }
 
-      // we're not: lookup via normal -------------------------------------
-      {
-        int closest_normal_idx = -1;
-        double max_ip = 0;
-        unsigned normal_idx = 0;
+      PYRTICLE_PHASE_COUNT(find_search, 1);
 
-        BOOST_FOREACH(const mesh_data::face_info &f, prev_el.m_faces)
-        {
-          double ip = inner_prod(
-              f.m_normal, 
-              subrange(ps.momenta, x_pstart, x_pend));
-
-          if (ip > max_ip)
-          {
-            closest_normal_idx = normal_idx;
-            max_ip = ip;
-          }
-          ++normal_idx;
-        }
-
-        if (closest_normal_idx == -1)
-        {
-          std::cerr << "face normals:" << std::endl;
-          bounded_vector mom = subrange(ps.momenta, x_pstart, x_pend);
-          BOOST_FOREACH(const mesh_data::face_info &f, prev_el.m_faces)
-          {
-            std::cerr 
-              << f.m_normal 
-              << ", ip with momentum:" << inner_prod(f.m_normal, mom)
-              << std::endl;
-          }
-          throw std::runtime_error(
-              str(boost::format("no best normal found--weird (momentum=%1%)") % mom));
-        }
-
-        mesh_data::element_number possible_idx =
-          prev_el.m_faces[closest_normal_idx].m_neighbor;
+      // we're not: walk across faces towards the particle ---------------
+      {
+        unsigned steps;
+        const mesh_data::element_number walk_el =
+          mesh.walk_to_containing_element(prev, pt, max_find_walk_steps, steps);
 
-        if (possible_idx != mesh_data::INVALID_ELEMENT)
+        if (walk_el != mesh_data::INVALID_ELEMENT)
         {
-          const mesh_data::element_info &possible = 
-            mesh.m_element_info[possible_idx];
-
-          if (is_in_unit_simplex(possible.m_inverse_map(pt)))
-          {
+          if (steps <= 1)
             counters.find_by_neighbor.tick();
-            return possible.m_id;
-          }
+          else
+            counters.find_by_walk.tick();
+          return walk_el;
         }
       }
 
@@ -212,8 +302,9 @@ namespace pyrticle
         {
           double min_dist = std::numeric_limits<double>::infinity();
 
-          BOOST_FOREACH(mesh_data::vertex_number vi, prev_el.m_vertices)
+          for (unsigned i = 0; i < mesh.vertices_per_element(); ++i)
           {
+            const mesh_data::vertex_number vi = mesh.element_vertex(prev, i);
             double dist = norm_2(mesh.mesh_vertex(vi) - pt);
             if (dist < min_dist)
             {
@@ -233,13 +324,10 @@ namespace pyrticle
               )
             )
         {
-          const mesh_data::element_info &possible = 
-            mesh.m_element_info[possible_idx];
-
-          if (is_in_unit_simplex(possible.m_inverse_map(pt)))
+          if (is_in_unit_simplex(mesh.map_to_unit(possible_idx, pt)))
           {
             counters.find_by_vertex.tick();
-            return possible.m_id;
+            return possible_idx;
           }
         }
 
@@ -249,6 +337,7 @@ namespace pyrticle
 
     // last resort: global search ---------------------------------------
     {
+      PYRTICLE_PHASE(find_global);
       counters.find_global.tick();
 
       mesh_data::element_number new_el = 
@@ -271,27 +360,73 @@ namespace pyrticle
       find_event_counters &counters
       )
   {
-    for (particle_number pn = 0; pn < ps.particle_count;)
-    {
-      mesh_data::element_number prev = ps.containing_elements[pn];
+    PYRTICLE_PHASE(find_element);
+    PYRTICLE_PHASE_COUNT(find_element, ps.particle_count);
 
-      mesh_data::element_number new_el = 
-        find_new_containing_element(mesh, ps, pn, prev, counters);
+    const bool use_margins = has_margin_cache(ps);
+    const int particle_count = ps.particle_count;
 
-      // no element found? must be boundary
-      if (new_el == mesh_data::INVALID_ELEMENT)
-      {
-        /* INVARIANT: boundary_hit_listener *must* leave particles
-         * with particle number less than pn unchanged.
-         */
-        boundary_hit(mesh, ps, pn, bhit_listener, counters);
-      }
-      else
+    // phase 1: look up new elements ------------------------------------------
+    // This only writes per-particle data and runs in parallel if OpenMP is
+    // enabled. Particles that were not found keep their previous element
+    // and are collected in 'lost'. Nothing here touches Python objects, so
+    // it runs without the GIL.
+    std::vector<particle_number> lost;
+
+    {
+      gil_release no_gil;
+
+#pragma omp parallel
       {
-        ps.containing_elements[pn] = new_el;
-        ++pn;
+        find_event_counters thread_counters;
+        std::vector<particle_number> thread_lost;
+
+#pragma omp for schedule(dynamic, 256) nowait
+        for (int pn = 0; pn < particle_count; ++pn)
+        {
+          const mesh_data::element_number prev = ps.containing_elements[pn];
+
+          if (use_margins && prev != mesh_data::INVALID_ELEMENT
+              && is_within_margin(ps, pn, prev))
+          {
+            thread_counters.find_by_margin.tick();
+            continue;
+          }
+
+          const mesh_data::element_number new_el = 
+            find_new_containing_element(mesh, ps, pn, prev, thread_counters);
+
+          if (new_el == mesh_data::INVALID_ELEMENT)
+            thread_lost.push_back(pn);
+          else
+          {
+            ps.containing_elements[pn] = new_el;
+            if (use_margins)
+              update_margin(mesh, ps, pn, new_el);
+          }
+        }
+
+#pragma omp critical
+        {
+          counters.add(thread_counters);
+          lost.insert(lost.end(), thread_lost.begin(), thread_lost.end());
+        }
       }
     }
+
+    // phase 2: periodic wrap-around and particle removal ---------------------
+    // Killing a particle moves the last one into its place. Going through
+    // the lost particles from the highest number down, the particle moved
+    // in has always been dealt with already.
+    std::sort(lost.begin(), lost.end());
+
+    BOOST_REVERSE_FOREACH(particle_number pn, lost)
+    {
+      /* INVARIANT: boundary_hit_listener *must* leave particles
+       * with particle number less than pn unchanged.
+       */
+      boundary_hit(mesh, ps, pn, bhit_listener, counters);
+    }
   }
 
 
@@ -307,6 +442,8 @@ namespace pyrticle
       find_event_counters &counters
       )
   {
+    PYRTICLE_PHASE(boundary_hit);
+
     unsigned x_pstart = pn*ps.xdim();
     unsigned x_pend = (pn+1)*ps.xdim();
 
@@ -402,8 +539,17 @@ namespace pyrticle
     for (unsigned i = 0; i < vdim; i++)
       ps.momenta[to*vdim+i] = ps.momenta[from*vdim+i];
 
-    ps.charges[to] = ps.charges[from];
-    ps.masses[to] = ps.masses[from];
+    ps.species[to] = ps.species[from];
+    if (ps.is_weighted())
+      ps.weights[to] = ps.weights[from];
+
+    if (ps.margin_elements.size() > std::max(from, to))
+    {
+      ps.margin_elements[to] = ps.margin_elements[from];
+      for (unsigned i = 0; i < xdim; i++)
+        ps.margin_centers[to*xdim+i] = ps.margin_centers[from*xdim+i];
+      ps.margins[to] = ps.margins[from];
+    }
   }
 }
 
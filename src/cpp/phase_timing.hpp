@@ -0,0 +1,251 @@
+// Pyrticle - Particle in Cell in Python
+// Compile-time optional per-phase timers for the hot paths
+// Copyright (C) 2007 Andreas Kloeckner
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+
+
+#ifndef _AFJHDSA_PYRTICLE_PHASE_TIMING_HPP_INCLUDED
+#define _AFJHDSA_PYRTICLE_PHASE_TIMING_HPP_INCLUDED
+
+
+
+
+#include <ctime>
+#include <boost/preprocessor/cat.hpp>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+
+
+
+/* Phase timing
+ * ------------
+ * PYRTICLE_PHASE(name) starts timing phase_<name> until the end of the
+ * enclosing scope. Phases nest, and time is attributed exclusively: while
+ * a nested phase runs, the enclosing one is paused. This way, e.g. element
+ * finding is not charged with the global searches it falls back to.
+ *
+ * PYRTICLE_PHASE_COUNT(name, n) adds n to the item count of phase_<name>,
+ * e.g. the number of mesh nodes a shape function was evaluated on.
+ *
+ * Entering and leaving a phase each read the clock, which would distort
+ * the timings of short loop bodies. Phases therefore enclose whole
+ * kernels or rare code paths; inner loops, such as those over the
+ * elements of a particle's footprint, only count items. Kernels whose
+ * stages alternate per particle, like shape function deposition, run
+ * each stage as a separate pass over a batch of particles instead.
+ *
+ * Both expand to nothing unless PYRTICLE_PHASE_TIMING is defined, which
+ * setup.py does if PHASE_TIMING is turned on in siteconf.py. The timers
+ * keep global state and must only be used from one thread. Phases entered
+ * inside an OpenMP parallel region are therefore not recorded; their time
+ * is charged to the enclosing phase entered outside the region.
+ */
+
+
+
+
+namespace pyrticle
+{
+  enum phase
+  {
+    phase_none,
+
+    phase_find_element,
+    phase_find_search,
+    phase_find_global,
+    phase_boundary_hit,
+
+    phase_dep_footprint,
+    phase_dep_shape_eval,
+    phase_dep_scatter,
+    phase_dep_grid,
+    phase_dep_grid_remap,
+
+    phase_adv_activation,
+    phase_adv_fluxes,
+    phase_adv_local_div,
+    phase_adv_inverse_mass,
+
+    phase_interp_basis,
+    phase_interp_solve,
+    phase_interp_gather,
+    phase_avg_force,
+
+    phase_diag_moments,
+    phase_diag_histogram,
+
+    phase_count
+  };
+
+
+
+
+  inline const char *phase_name(phase p)
+  {
+    static const char *names[] = {
+      "none",
+
+      "find_element",
+      "find_search",
+      "find_global",
+      "boundary_hit",
+
+      "dep_footprint",
+      "dep_shape_eval",
+      "dep_scatter",
+      "dep_grid",
+      "dep_grid_remap",
+
+      "adv_activation",
+      "adv_fluxes",
+      "adv_local_div",
+      "adv_inverse_mass",
+
+      "interp_basis",
+      "interp_solve",
+      "interp_gather",
+      "avg_force",
+
+      "diag_moments",
+      "diag_histogram",
+    };
+
+    return names[p];
+  }
+
+
+
+
+  struct phase_statistics
+  {
+    double m_seconds;
+    unsigned long m_calls;
+    unsigned long m_items;
+  };
+
+
+
+
+  class phase_timing
+  {
+    public:
+      static phase_statistics m_statistics[phase_count];
+      static phase m_current;
+      static double m_last_switch;
+
+      static double now()
+      {
+        timespec ts;
+        clock_gettime(CLOCK_MONOTONIC, &ts);
+        return ts.tv_sec + 1e-9*ts.tv_nsec;
+      }
+
+      /** Charge the time since the last phase switch to the current phase. */
+      static void account(double t)
+      {
+        if (m_current != phase_none)
+          m_statistics[m_current].m_seconds += t - m_last_switch;
+        m_last_switch = t;
+      }
+
+      static void reset()
+      {
+        for (unsigned i = 0; i < phase_count; ++i)
+        {
+          m_statistics[i].m_seconds = 0;
+          m_statistics[i].m_calls = 0;
+          m_statistics[i].m_items = 0;
+        }
+      }
+
+      static bool enabled()
+      {
+#ifdef PYRTICLE_PHASE_TIMING
+        return true;
+#else
+        return false;
+#endif
+      }
+  };
+
+
+
+
+  inline bool phase_timing_suspended()
+  {
+#ifdef _OPENMP
+    return omp_in_parallel();
+#else
+    return false;
+#endif
+  }
+
+
+
+
+  class scoped_phase
+  {
+    private:
+      phase m_parent;
+      bool m_active;
+
+    public:
+      scoped_phase(phase p)
+        : m_active(!phase_timing_suspended())
+      {
+        if (!m_active)
+          return;
+
+        phase_timing::account(phase_timing::now());
+        m_parent = phase_timing::m_current;
+        phase_timing::m_current = p;
+        ++phase_timing::m_statistics[p].m_calls;
+      }
+
+      ~scoped_phase()
+      {
+        if (!m_active)
+          return;
+
+        phase_timing::account(phase_timing::now());
+        phase_timing::m_current = m_parent;
+      }
+  };
+}
+
+
+
+
+#ifdef PYRTICLE_PHASE_TIMING
+#define PYRTICLE_PHASE(NAME) \
+  ::pyrticle::scoped_phase BOOST_PP_CAT(pyrticle_phase__, __LINE__)( \
+      ::pyrticle::phase_##NAME)
+#define PYRTICLE_PHASE_COUNT(NAME, N) \
+  (::pyrticle::phase_timing_suspended() ? (void) 0 : (void) \
+   (::pyrticle::phase_timing::m_statistics[::pyrticle::phase_##NAME].m_items += (N)))
+#else
+#define PYRTICLE_PHASE(NAME) ((void) 0)
+#define PYRTICLE_PHASE_COUNT(NAME, N) ((void) 0)
+#endif
+
+
+
+
+#endif
@@ -28,6 +28,7 @@
 #include "bases.hpp"
 #include "dep_target.hpp"
 #include "particle_state.hpp"
+#include "phase_timing.hpp"
 
 
 
@@ -138,7 +139,7 @@ namespace pyrticle
           const RhoExpression &rho_contrib
           )
       {
-        const double jacobian = m_mesh_data.m_element_info[en].m_jacobian;
+        const double jacobian = m_mesh_data.jacobian(en);
 
         // Important: recall that these result in an average normalized
         // to the particle's charge.
@@ -216,14 +217,14 @@ namespace pyrticle
 
 
 
-  template <unsigned DimensionsVelocity, class FX, class FY, class FZ>
+  template <class ParticleState, class FX, class FY, class FZ>
   class el_force_averaging_target : 
-    public force_averaging_target<DimensionsVelocity, FX, FY, FZ>
+    public force_averaging_target<ParticleState::m_vdim, FX, FY, FZ>
   {
     private:
-      typedef force_averaging_target<DimensionsVelocity, FX, FY, FZ> super;
+      typedef force_averaging_target<ParticleState::m_vdim, FX, FY, FZ> super;
       stats_gatherer<double> *m_normalization_stats;
-      py_vector::const_iterator m_charges;
+      const ParticleState &m_ps;
       py_vector  &m_result;
 
     public:
@@ -234,7 +235,7 @@ namespace pyrticle
           py_vector particlewise_field,
           py_vector field_stddev,
           stats_gatherer<double> *normalization_stats,
-          const py_vector &charges,
+          const ParticleState &ps,
           py_vector &result
           )
         : 
@@ -242,7 +243,7 @@ namespace pyrticle
               fx, fy, fz, 
               particlewise_field, field_stddev),
           m_normalization_stats(normalization_stats),
-          m_charges(charges.begin()),
+          m_ps(ps),
           m_result(result)
       { }
 
@@ -251,13 +252,13 @@ namespace pyrticle
         super::end_particle(pn);
 
         unsigned 
-          pstart = pn*DimensionsVelocity,
-          pend = (pn+1)*DimensionsVelocity;
+          pstart = pn*ParticleState::m_vdim,
+          pend = (pn+1)*ParticleState::m_vdim;
 
         if (this->m_particle_charge == 0)
           return;
 
-        const double scale = m_charges[pn]/this->m_particle_charge;
+        const double scale = m_ps.charge(pn)/this->m_particle_charge;
 
         if (m_normalization_stats)
           m_normalization_stats->add(scale);
@@ -265,23 +266,23 @@ namespace pyrticle
         noalias(subrange(m_result, pstart, pend)) += 
           scale*subrange(
               this->m_qfield_accumulator,
-              0, DimensionsVelocity);
+              0, ParticleState::m_vdim);
       }
   };
 
 
 
 
-  template <unsigned DimensionsVelocity, class FX, class FY, class FZ>
+  template <class ParticleState, class FX, class FY, class FZ>
   class mag_force_averaging_target : 
-    public force_averaging_target<DimensionsVelocity, FX, FY, FZ>
+    public force_averaging_target<ParticleState::m_vdim, FX, FY, FZ>
   {
     private:
-      typedef force_averaging_target<DimensionsVelocity, FX, FY, FZ> super;
+      typedef force_averaging_target<ParticleState::m_vdim, FX, FY, FZ> super;
       const py_vector &m_velocities;
       
       stats_gatherer<double> *m_normalization_stats;
-      py_vector::const_iterator m_charges;
+      const ParticleState &m_ps;
       py_vector &m_result;
 
     public:
@@ -293,7 +294,7 @@ namespace pyrticle
           py_vector particlewise_field,
           py_vector field_stddev,
           stats_gatherer<double> *normalization_stats,
-          const py_vector &charges,
+          const ParticleState &ps,
           py_vector &result
           )
         : 
@@ -302,7 +303,7 @@ namespace pyrticle
               particlewise_field, field_stddev), 
           m_velocities(velocities),
           m_normalization_stats(normalization_stats),
-          m_charges(charges.begin()),
+          m_ps(ps),
           m_result(result)
       { }
 
@@ -311,13 +312,13 @@ namespace pyrticle
         super::end_particle(pn);
 
         unsigned 
-          pstart = pn*DimensionsVelocity,
-          pend = (pn+1)*DimensionsVelocity;
+          pstart = pn*ParticleState::m_vdim,
+          pend = (pn+1)*ParticleState::m_vdim;
 
         if (this->m_particle_charge == 0)
           return;
 
-        const double scale = m_charges[pn]/this->m_particle_charge;
+        const double scale = m_ps.charge(pn)/this->m_particle_charge;
 
         if (m_normalization_stats)
           m_normalization_stats->add(scale);
@@ -327,7 +328,7 @@ namespace pyrticle
               scale*cross<bounded_vector>(
                 subrange(m_velocities, pstart, pend), 
                 this->m_qfield_accumulator),
-              0, DimensionsVelocity);
+              0, ParticleState::m_vdim);
       }
   };
 
@@ -384,12 +385,15 @@ namespace pyrticle
           visualization_listener *vis_listener
           )
       {
+        PYRTICLE_PHASE(avg_force);
+        PYRTICLE_PHASE_COUNT(avg_force, ps.particle_count);
+
         const unsigned vdim = particle_state::vdim();
 
         typedef el_force_averaging_target
-          <particle_state::m_vdim, EX, EY, EZ> el_tgt_t;
+          <particle_state, EX, EY, EZ> el_tgt_t;
         typedef mag_force_averaging_target
-          <particle_state::m_vdim, BX, BY, BZ> mag_tgt_t;
+          <particle_state, BX, BY, BZ> mag_tgt_t;
 
         const unsigned field_components = el_tgt_t::field_components;
         const unsigned pcount = ps.particle_count;
@@ -418,11 +422,11 @@ namespace pyrticle
         el_tgt_t el_tgt(m_mesh_data, m_integral_weights,
             ex, ey, ez, vis_e, vis_e_stddev, 
             &pu_st.m_e_normalization_stats,
-            ps.charges, el_force);
+            ps, el_force);
         mag_tgt_t mag_tgt(m_mesh_data, m_integral_weights,
             bx, by, bz, velocities, vis_b, vis_b_stddev, 
             &pu_st.m_b_normalization_stats,
-            ps.charges, mag_force);
+            ps, mag_force);
 
         chained_deposition_target<el_tgt_t, mag_tgt_t> force_tgt(el_tgt, mag_tgt);
         dep.deposit_densities_on_target(ds, ps, force_tgt, boost::python::slice());
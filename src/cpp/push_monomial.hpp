@@ -33,6 +33,7 @@
 #include <boost/numeric/bindings/traits/ublas_matrix.hpp>
 #include <boost/numeric/bindings/traits/ublas_vector2.hpp>
 #include "tools.hpp"
+#include "phase_timing.hpp"
 #include "bases.hpp"
 #include "meshdata.hpp"
 #include "particle_state.hpp"
@@ -159,30 +160,34 @@ namespace pyrticle
         interpolator result(
             m_local_discretizations[0], ps.particle_count);
 
-        for (particle_number pn = 0; pn < ps.particle_count; pn++)
         {
-          mesh_data::mesh_data::element_number in_el = 
-            ps.containing_elements[pn];
-          const mesh_data::element_info &el_inf = 
-            m_mesh_data.m_element_info[in_el];
+          PYRTICLE_PHASE(interp_basis);
+          PYRTICLE_PHASE_COUNT(interp_basis, ps.particle_count);
+
+          for (particle_number pn = 0; pn < ps.particle_count; pn++)
+          {
+            mesh_data::mesh_data::element_number in_el = 
+              ps.containing_elements[pn];
         
-          if (m_ldis_indices[in_el] != 0)
-            throw std::runtime_error("more than one "
-                "local discretization is currently not "
-                "supported");
-
-          bounded_vector unit_pt = el_inf.m_inverse_map
-            .operator()<bounded_vector>(
-                subrange(ps.positions, xdim*pn, xdim*(pn+1))
-                );
-          unsigned base_idx = result.m_ldis.m_basis.size()*pn;
-
-          for (unsigned i = 0; i < result.m_ldis.m_basis.size(); i++)
-            result.m_interpolation_coefficients[base_idx+i] 
-              = result.m_ldis.m_basis[i](unit_pt);
+            if (m_ldis_indices[in_el] != 0)
+              throw std::runtime_error("more than one "
+                  "local discretization is currently not "
+                  "supported");
+
+            bounded_vector unit_pt = m_mesh_data.map_to_unit(in_el,
+                  subrange(ps.positions, xdim*pn, xdim*(pn+1)));
+            unsigned base_idx = result.m_ldis.m_basis.size()*pn;
+
+            for (unsigned i = 0; i < result.m_ldis.m_basis.size(); i++)
+              result.m_interpolation_coefficients[base_idx+i] 
+                = result.m_ldis.m_basis[i](unit_pt);
+          }
         }
 
         {
+          PYRTICLE_PHASE(interp_solve);
+          PYRTICLE_PHASE_COUNT(interp_solve, ps.particle_count);
+
           using namespace boost::numeric::bindings;
           
           const py_fortran_matrix &matrix = 
@@ -243,73 +248,82 @@ namespace pyrticle
           vis_mag_force = py_vector(2, dims);
         }
 
-        interpolator interp = make_interpolator(ps);
-
-        for (particle_number pn = 0; pn < ps.particle_count; pn++)
         {
-          const unsigned v_pstart = vdim*pn;
-          const unsigned v_pend = vdim*(pn+1);
+          // The interpolation only touches Python-owned memory through
+          // existing vectors, so other Python threads may run meanwhile.
+          gil_release no_gil;
 
-          mesh_data::mesh_data::element_number in_el = ps.containing_elements[pn];
+          interpolator interp = make_interpolator(ps);
 
-          bounded_vector e(3);
-          e[0] = interp(pn, in_el, ex);
-          e[1] = interp(pn, in_el, ey);
-          e[2] = interp(pn, in_el, ez);
+          PYRTICLE_PHASE(interp_gather);
+          PYRTICLE_PHASE_COUNT(interp_gather, ps.particle_count);
 
-          bounded_vector b(3);
-          b[0] = interp(pn, in_el, bx);
-          b[1] = interp(pn, in_el, by);
-          b[2] = interp(pn, in_el, bz);
+          for (particle_number pn = 0; pn < ps.particle_count; pn++)
+          {
+            const unsigned v_pstart = vdim*pn;
+            const unsigned v_pend = vdim*(pn+1);
 
-          const double charge = ps.charges[pn];
+            mesh_data::mesh_data::element_number in_el = ps.containing_elements[pn];
 
-          bounded_vector el_force(charge*e);
+            bounded_vector e(3);
+            e[0] = interp(pn, in_el, ex);
+            e[1] = interp(pn, in_el, ey);
+            e[2] = interp(pn, in_el, ez);
 
-          const bounded_vector v = subrange(velocities, v_pstart, v_pend);
-          bounded_vector mag_force = cross(v, charge*b);
+            bounded_vector b(3);
+            b[0] = interp(pn, in_el, bx);
+            b[1] = interp(pn, in_el, by);
+            b[2] = interp(pn, in_el, bz);
 
-#if 0
-          // code for debugging NaNs
-          if (isnan_any(el_force) || isnan_any(mag_force))
-          {
-            const unsigned x_pstart = ps.xdim()*pn;
-            const unsigned x_pend = ps.xdim()*(pn+1);
+            const double charge = ps.charge(pn);
 
-            const bounded_vector x = subrange(ps.positions, x_pstart, x_pend);
+            bounded_vector el_force(charge*e);
 
-            if (isnan_any(el_force))
-            {
-              std::cout << "EL FORCE HAD NAN" << std::endl;
-              interp.debug(pn, in_el, ex);
-              interp.debug(pn, in_el, ey);
-              interp.debug(pn, in_el, ez);
-            }
+            const bounded_vector v = subrange(velocities, v_pstart, v_pend);
+            bounded_vector mag_force = cross(v, charge*b);
 
-            if (isnan_any(mag_force))
+#if 0
+            // code for debugging NaNs
+            if (isnan_any(el_force) || isnan_any(mag_force))
             {
-              std::cout << "MAG FORCE HAD NAN" << std::endl;
-              interp.debug(pn, in_el, bx);
-              interp.debug(pn, in_el, by);
-              interp.debug(pn, in_el, bz);
+              const unsigned x_pstart = ps.xdim()*pn;
+              const unsigned x_pend = ps.xdim()*(pn+1);
+
+              const bounded_vector x = subrange(ps.positions, x_pstart, x_pend);
+
+              if (isnan_any(el_force))
+              {
+                std::cout << "EL FORCE HAD NAN" << std::endl;
+                interp.debug(pn, in_el, ex);
+                interp.debug(pn, in_el, ey);
+                interp.debug(pn, in_el, ez);
+              }
+
+              if (isnan_any(mag_force))
+              {
+                std::cout << "MAG FORCE HAD NAN" << std::endl;
+                interp.debug(pn, in_el, bx);
+                interp.debug(pn, in_el, by);
+                interp.debug(pn, in_el, bz);
+              }
+
+              std::cout
+                << el_force << " pn " << pn << " at " << x << " in el " << in_el 
+                << std::endl;
             }
-
-            std::cout
-              << el_force << " pn " << pn << " at " << x << " in el " << in_el 
-              << std::endl;
-          }
 #endif
 
-          // truncate forces to dimensions_velocity entries
-          subrange(result, v_pstart, v_pend) = subrange(
-              el_force + mag_force, 0, ps.vdim());
+            // truncate forces to dimensions_velocity entries
+            subrange(result, v_pstart, v_pend) = subrange(
+                el_force + mag_force, 0, ps.vdim());
 
-          if (vis_listener)
-          {
-            subrange(vis_e, 3*pn, 3*(pn+1)) = e;
-            subrange(vis_b, 3*pn, 3*(pn+1)) = b;
-            subrange(vis_el_force, 3*pn, 3*(pn+1)) = el_force;
-            subrange(vis_mag_force, 3*pn, 3*(pn+1)) = mag_force;
+            if (vis_listener)
+            {
+              subrange(vis_e, 3*pn, 3*(pn+1)) = e;
+              subrange(vis_b, 3*pn, 3*(pn+1)) = b;
+              subrange(vis_el_force, 3*pn, 3*(pn+1)) = el_force;
+              subrange(vis_mag_force, 3*pn, 3*(pn+1)) = mag_force;
+            }
           }
         }
 
@@ -20,6 +20,7 @@
 
 
 #include "tools.hpp"
+#include "phase_timing.hpp"
 #include <boost/math/tools/config.hpp>
 #include <boost/math/special_functions/gamma.hpp>
 #include <boost/math/special_functions/beta.hpp>
@@ -29,6 +30,11 @@
 
 pyrticle::warning_listener *pyrticle::warning_listener::m_singleton = 0;
 
+pyrticle::phase_statistics 
+  pyrticle::phase_timing::m_statistics[pyrticle::phase_count];
+pyrticle::phase pyrticle::phase_timing::m_current = pyrticle::phase_none;
+double pyrticle::phase_timing::m_last_switch = 0;
+
 
 
 
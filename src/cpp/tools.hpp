@@ -30,6 +30,7 @@
 #include <pyublas/numpy.hpp>
 #include <pyublas/elementwise_op.hpp>
 #include <boost/foreach.hpp>
+#include <boost/noncopyable.hpp>
 #include <boost/numeric/ublas/matrix_sparse.hpp>
 #include <boost/python/slice.hpp>
 
@@ -51,6 +52,13 @@
 #define FOR_ALL_SLICE_INDICES_LOOP \
   for (Py_ssize_t fsi__cnt = 0; fsi__cnt < fsi__length;  ++fsi__cnt)
 
+/* Loop over the FIRST-th through (END-1)-th index of the slice, to
+ * process it in batches. */
+#define FOR_ALL_SLICE_INDICES_RANGE(FIRST, END) \
+  for (Py_ssize_t fsi__cnt = (FIRST); fsi__cnt < (END);  ++fsi__cnt)
+
+#define FOR_ALL_SLICE_INDICES_COUNT fsi__length
+
 
 
 #define FOR_ALL_SLICE_INDICES(SLICE, LEN) \
@@ -67,6 +75,7 @@ namespace pyrticle
   // common types -------------------------------------------------------------
   typedef unsigned particle_number;
   static const particle_number INVALID_PARTICLE = UINT_MAX;
+  typedef npy_uint16 species_number;
 
 
 
@@ -214,6 +223,9 @@ namespace pyrticle
 
       void tick()
       { ++m_count; }
+
+      void add(unsigned n)
+      { m_count += n; }
   };
 
 
@@ -510,6 +522,52 @@ namespace pyrticle
 
 
 
+  // GIL handling -------------------------------------------------------------
+  /* Releases the global interpreter lock for its lifetime, so that Python
+   * threads (e.g. the background visualization writer) can run alongside
+   * a compute kernel. Only use this in code called from Python, around
+   * stretches that create, copy or destroy no Python objects. Releases
+   * must not nest--callbacks into Python reacquire the lock through
+   * gil_acquire.
+   */
+  class gil_release : boost::noncopyable
+  {
+    private:
+      PyThreadState *m_thread_state;
+
+    public:
+      gil_release()
+        : m_thread_state(PyEval_SaveThread())
+      { }
+
+      ~gil_release()
+      {
+        PyEval_RestoreThread(m_thread_state);
+      }
+  };
+
+
+
+
+  class gil_acquire : boost::noncopyable
+  {
+    private:
+      PyGILState_STATE m_state;
+
+    public:
+      gil_acquire()
+        : m_state(PyGILState_Ensure())
+      { }
+
+      ~gil_acquire()
+      {
+        PyGILState_Release(m_state);
+      }
+  };
+
+
+
+
   // shape functions ----------------------------------------------------------
   class polynomial_shape_function
   {
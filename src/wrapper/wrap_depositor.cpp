@@ -47,6 +47,8 @@ namespace
     def("deposit_densities", deposit_densities<Depositor>);
     def("deposit_j", deposit_j<Depositor>);
     def("deposit_rho", deposit_rho<Depositor>);
+    def("deposit_grouped_densities", deposit_grouped_densities<Depositor>);
+    def("deposit_grouped_rho", deposit_grouped_rho<Depositor>);
   }
 
 
@@ -96,6 +98,8 @@ namespace
       .DEF_SIMPLE_METHOD(deposit_grid_densities)
       .DEF_SIMPLE_METHOD(deposit_grid_j)
       .DEF_SIMPLE_METHOD(deposit_grid_rho)
+      .DEF_SIMPLE_METHOD(deposit_grouped_grid_densities)
+      .DEF_SIMPLE_METHOD(deposit_grouped_grid_rho)
       ;
 
     wrp.attr("DepositorState") = gdbs_wrap;
@@ -115,6 +119,7 @@ namespace
 
       wrp
         .DEF_RW_MEMBER(shape_function)
+        .DEF_RW_MEMBER(element_finder)
         ;
 
       scope cls_scope = wrp;
@@ -134,6 +139,7 @@ namespace
 
       wrp
         .DEF_RW_MEMBER(shape_function)
+        .DEF_RW_MEMBER(element_finder)
         ;
 
       scope cls_scope = wrp;
@@ -181,9 +187,25 @@ namespace
         .DEF_SIMPLE_METHOD(kill_advected_particle)
         .DEF_SIMPLE_METHOD(note_move)
         .DEF_SIMPLE_METHOD(note_change_size)
+
+        .DEF_SIMPLE_METHOD(get_checkpoint_data)
+        .DEF_SIMPLE_METHOD(set_checkpoint_data)
         ;
 
       scope cls_scope = wrp;
+      {
+        typedef typename cl::checkpoint_data cl;
+        class_<cl>("CheckpointData")
+          .DEF_BYVAL_RW_MEMBER(element_starts)
+          .DEF_BYVAL_RW_MEMBER(element_numbers)
+          .DEF_BYVAL_RW_MEMBER(start_indices)
+          .DEF_BYVAL_RW_MEMBER(min_lives)
+          .DEF_BYVAL_RW_MEMBER(connections)
+          .DEF_BYVAL_RW_MEMBER(freelist)
+          .DEF_BYVAL_RW_MEMBER(rho)
+          .DEF_RW_MEMBER(active_elements)
+          ;
+      }
       {
         typedef typename cl::depositor_state cl;
         class_<cl>("DepositorState")
@@ -226,6 +248,8 @@ namespace
         .DEF_SIMPLE_METHOD(deposit_densities)
         .DEF_SIMPLE_METHOD(deposit_j)
         .DEF_SIMPLE_METHOD(deposit_rho)
+        .DEF_SIMPLE_METHOD(deposit_grouped_densities)
+        .DEF_SIMPLE_METHOD(deposit_grouped_rho)
         ;
 
       wrp.attr("DepositorState") = gdbs_wrap;
@@ -238,6 +262,12 @@ namespace
 
 void expose_deposition()
 {
+  enum_<element_finder_kind>("ElementFinder")
+    .value("heuristic", finder_heuristic)
+    .value("face_based", finder_face_based)
+    .value("hyperplane", finder_hyperplane)
+    ;
+
   class_<grid_depositor_base_state> gdbs_wrap("GridDepositorBaseState");
   {
     typedef grid_depositor_base_state cl;
@@ -42,6 +42,8 @@ void expose_grid_find_pic();
 
 BOOST_PYTHON_MODULE(_internal)
 {
+  PyEval_InitThreads();
+
   expose_tools();
   expose_grid();
   expose_meshdata();
@@ -31,17 +31,17 @@ using namespace pyrticle;
 
 
 
+
 namespace
 {
-  py_vector get_normal(const mesh_data::face_info &fi)
-  { return fi.m_normal; }
-  void set_normal(mesh_data::face_info &fi, py_vector n)
-  { fi.m_normal = n; }
-  py_vector get_face_centroid(const mesh_data::face_info &fi)
-  { return fi.m_face_centroid; }
-  void set_face_centroid(mesh_data::face_info &fi, py_vector n)
-  { fi.m_face_centroid = n; }
-
+  python::object walk_to_containing_element(const mesh_data &md,
+      mesh_data::element_number en, const py_vector &pt, unsigned max_steps)
+  {
+    unsigned steps;
+    const mesh_data::element_number result =
+      md.walk_to_containing_element(en, pt, max_steps, steps);
+    return python::make_tuple(result, steps);
+  }
 }
 
 
@@ -57,9 +57,10 @@ void expose_meshdata()
 
       .DEF_RO_MEMBER(dimensions)
 
-      .DEF_RO_MEMBER(element_info)
+      .DEF_SIMPLE_METHOD(element_count)
       .DEF_SIMPLE_METHOD(set_vertices)
       .DEF_SIMPLE_METHOD(set_nodes)
+      .DEF_SIMPLE_METHOD(fill_from_arrays)
 
       .DEF_RO_MEMBER(vertex_adj_element_starts)
       .DEF_RO_MEMBER(vertex_adj_elements)
@@ -69,34 +70,8 @@ void expose_meshdata()
 
       .def("is_in_element", &cl::is_in_element<py_vector>)
       .def("find_containing_element", &cl::find_containing_element<py_vector>)
-      ;
-  }
-
-  {
-    typedef mesh_data::face_info cl;
-    python::class_<cl>("FaceInfo")
-      // PyUblas member-in-base-class issue: wrap by hand
-      .add_property("normal", get_normal, set_normal)
-      .DEF_RW_MEMBER(neighbor)
-      .DEF_RW_MEMBER(neighbor_periodicity_axis)
-
-      .DEF_RW_MEMBER(face_plane_eqn_rhs)
-
-      .add_property("face_centroid", get_face_centroid, set_face_centroid)
-      .DEF_RW_MEMBER(face_radius_from_centroid)
-      ;
-  }
-  {
-    typedef mesh_data::element_info cl;
-    python::class_<cl>("ElementInfo")
-      .DEF_RW_MEMBER(id)
-      .DEF_RW_MEMBER(inverse_map)
-      .DEF_RW_MEMBER(jacobian)
-      .DEF_RW_MEMBER(start)
-      .DEF_RW_MEMBER(end)
-      .DEF_RW_MEMBER(vertices)
-
-      .DEF_RW_MEMBER(faces)
+      .def("find_containing_elements", &cl::find_containing_elements<py_vector>)
+      .def("walk_to_containing_element", walk_to_containing_element)
       ;
   }
 
@@ -108,7 +83,5 @@ void expose_meshdata()
       ;
   }
 
-  expose_std_vector<mesh_data::face_info>("FaceInfo");
-  expose_std_vector<mesh_data::element_info>("ElementInfo");
   expose_std_vector<mesh_data::periodicity_axis>("PeriodicityAxis");
 }
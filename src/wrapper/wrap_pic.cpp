@@ -44,6 +44,11 @@ namespace
     python::def("rms_beam_size", rms_beam_size<ParticleState>);
     python::def("rms_beam_emittance", rms_beam_emittance<ParticleState>);
     python::def("rms_energy_spread", rms_energy_spread<ParticleState>);
+    python::def("get_beam_moments", get_beam_moments<ParticleState>);
+    python::def("position_histogram", position_histogram<ParticleState>);
+    python::def("energy_histogram", energy_histogram<ParticleState>);
+    python::def("trace_space_histogram",
+        trace_space_histogram<ParticleState>);
   }
 
 
@@ -63,8 +68,14 @@ namespace
       .SDEF_BYVAL_RW_MEMBER(containing_elements)
       .SDEF_BYVAL_RW_MEMBER(positions)
       .SDEF_BYVAL_RW_MEMBER(momenta)
-      .SDEF_BYVAL_RW_MEMBER(charges)
-      .SDEF_BYVAL_RW_MEMBER(masses)
+      .SDEF_BYVAL_RW_MEMBER(species)
+      .SDEF_BYVAL_RW_MEMBER(weights)
+      .SDEF_BYVAL_RW_MEMBER(species_charges)
+      .SDEF_BYVAL_RW_MEMBER(species_masses)
+
+      .SDEF_BYVAL_RW_MEMBER(margin_elements)
+      .SDEF_BYVAL_RW_MEMBER(margin_centers)
+      .SDEF_BYVAL_RW_MEMBER(margins)
 
       ;
 
@@ -88,10 +99,30 @@ void expose_pic()
   {
     typedef find_event_counters cl;
     class_<find_event_counters>("FindEventCounters")
+      .SDEF_RW_MEMBER(find_by_margin)
       .SDEF_RW_MEMBER(find_same)
       .SDEF_RW_MEMBER(find_by_neighbor)
+      .SDEF_RW_MEMBER(find_by_walk)
       .SDEF_RW_MEMBER(find_by_vertex)
       .SDEF_RW_MEMBER(find_global)
       ;
   }
+
+  {
+    typedef beam_moments cl;
+    class_<beam_moments>("BeamMoments")
+      .SDEF_RO_MEMBER(particle_count)
+      .SDEF_RO_MEMBER(total_charge)
+      .SDEF_RO_MEMBER(total_kinetic_energy)
+      .SDEF_BYVAL_RO_MEMBER(total_momentum)
+      .SDEF_BYVAL_RO_MEMBER(total_charge_velocity)
+      .SDEF_BYVAL_RO_MEMBER(mean_position)
+      .SDEF_BYVAL_RO_MEMBER(position_variance)
+      .SDEF_BYVAL_RO_MEMBER(mean_slope)
+      .SDEF_BYVAL_RO_MEMBER(slope_variance)
+      .SDEF_BYVAL_RO_MEMBER(position_slope_covariance)
+      .SDEF_RO_MEMBER(mean_kinetic_energy)
+      .SDEF_RO_MEMBER(kinetic_energy_variance)
+      ;
+  }
 }
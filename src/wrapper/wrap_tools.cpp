@@ -29,6 +29,7 @@
 #include <boost/numeric/bindings/traits/ublas_matrix.hpp>
 #include "wrap_tuples.hpp"
 #include "tools.hpp"
+#include "phase_timing.hpp"
 #include "wrap_helpers.hpp"
 
 
@@ -42,6 +43,7 @@ using namespace pyrticle;
 
 namespace
 {
+  // The core may call these with the GIL released, see gil_release.
   struct visualization_listener_wrap : 
     visualization_listener,
     python::wrapper<visualization_listener>
@@ -49,11 +51,13 @@ namespace
     void store_mesh_vis_vector(
         const char *name, const py_vector &vec) const
     {
+      gil_acquire gil;
       this->get_override("store_mesh_vis_vector")(name, vec);
     }
     void store_particle_vis_vector(
         const char *name, const py_vector &vec) const
     {
+      gil_acquire gil;
       this->get_override("store_particle_vis_vector")(name, vec);
     }
   };
@@ -66,6 +70,7 @@ namespace
   {
     void note_change_size(unsigned new_size) const
     {
+      gil_acquire gil;
       if (python::override f = this->get_override("note_change_size"))
         f(new_size);
       else
@@ -74,6 +79,7 @@ namespace
 
     void note_move(unsigned orig, unsigned dest, unsigned size) const
     {
+      gil_acquire gil;
       if (python::override f = this->get_override("note_move"))
         f(orig, dest, size);
       else
@@ -82,6 +88,7 @@ namespace
 
     void note_reset(unsigned start, unsigned size) const
     {
+      gil_acquire gil;
       if (python::override f = this->get_override("note_reset"))
         f(start, size);
       else
@@ -98,6 +105,7 @@ namespace
   {
       void note_boundary_hit(particle_number pn) const 
       {
+        gil_acquire gil;
         this->get_override("note_boundary_hit")(pn);
       }
   };
@@ -115,6 +123,7 @@ namespace
           unsigned lineno
           ) const 
       {
+        gil_acquire gil;
         this->get_override("note_warning")(message, filename, lineno);
       }
   };
@@ -182,6 +191,35 @@ namespace
 
 
 
+namespace
+{
+  python::list get_phase_names()
+  {
+    python::list result;
+    for (unsigned i = phase_none+1; i < phase_count; ++i)
+      result.append(phase_name(phase(i)));
+    return result;
+  }
+
+
+
+
+  python::dict get_phase_timings()
+  {
+    python::dict result;
+    for (unsigned i = phase_none+1; i < phase_count; ++i)
+    {
+      const phase_statistics &stats = phase_timing::m_statistics[i];
+      result[phase_name(phase(i))] = python::make_tuple(
+          stats.m_seconds, stats.m_calls, stats.m_items);
+    }
+    return result;
+  }
+}
+
+
+
+
 void expose_tools()
 {
   python::def("asinh", (double (*)(double)) boost::math::asinh);
@@ -190,6 +228,11 @@ void expose_tools()
 
   expose_box<bounded_vector>("Float");
   expose_box<bounded_int_vector>("Int");
+
+  python::def("phase_timing_enabled", phase_timing::enabled);
+  python::def("get_phase_names", get_phase_names);
+  python::def("get_phase_timings", get_phase_timings);
+  python::def("reset_phase_timings", phase_timing::reset);
   {
     typedef event_counter cl;
     python::class_<cl>("EventCounter")
@@ -422,6 +422,1155 @@ def test_shape_functions():
 
 
 
+def test_checkpoint_file_format():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    import os.path
+    from pyrticle.checkpoint import write_checkpoint, Checkpoint
+
+    tmpdir = mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, "test.pcp")
+
+        arrays = {
+                "positions": numpy.random.randn(1000, 3),
+                "containing_elements": numpy.arange(1000, dtype=numpy.uint32),
+                "empty": numpy.zeros((0,), dtype=numpy.float64),
+                }
+        write_checkpoint(fname, {"step": 17, "t": 0.5}, arrays)
+
+        ckpt = Checkpoint(fname)
+        assert ckpt.metadata == {"step": 17, "t": 0.5}
+        assert set(ckpt.array_names()) == set(arrays)
+
+        for name, ary in arrays.iteritems():
+            for mmap in [True, False]:
+                read_ary = ckpt.get_array(name, mmap)
+                assert read_ary.dtype == ary.dtype
+                assert read_ary.shape == ary.shape
+                assert (read_ary == ary).all()
+
+        # copy-on-write mapping must not modify the file
+        pos = ckpt.get_array("positions")
+        pos[:] = 0
+        assert (Checkpoint(fname).get_array("positions")
+                == arrays["positions"]).all()
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def test_background_vis_writer():
+    from pyrticle.vis_output import \
+            BackgroundVisualizationWriter, snapshot_field
+
+    field = numpy.empty((2,), dtype=object)
+    field[0] = numpy.ones(10)
+    field[1] = numpy.zeros(10)
+    snap = snapshot_field(field)
+    field[0][:] = 5
+    assert (snap[0] == 1).all()
+    assert (snap[1] == 0).all()
+
+    written = []
+    writer = BackgroundVisualizationWriter(max_pending=1)
+    for i in range(20):
+        writer.submit(lambda i=i: written.append(i))
+    writer.flush()
+    assert written == range(20)
+
+    def fail():
+        raise ValueError("write failed")
+
+    writer.submit(fail)
+    try:
+        writer.flush()
+    except ValueError:
+        pass
+    else:
+        assert False, "job exception was not propagated"
+
+    writer.submit(lambda: written.append(20))
+    writer.close()
+    assert written == range(21)
+
+
+
+
+def test_particle_history():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    import os.path
+    from pyrticle.particle_history import \
+            ParticleHistoryWriter, ParticleHistory
+
+    tmpdir = mkdtemp()
+    try:
+        for compress in [False, True]:
+            dirname = os.path.join(tmpdir, "hist-%s" % compress)
+            writer = ParticleHistoryWriter(dirname,
+                    compress=compress, block_size=7)
+
+            dumps = []
+            for step, count in enumerate([50, 0, 23, 49]):
+                dump = {
+                        "positions": numpy.random.randn(count, 3),
+                        "charges": numpy.random.randn(count),
+                        }
+                writer.append(step, 0.1*step, dump)
+                dumps.append(dump)
+
+            hist = ParticleHistory(dirname)
+            assert len(hist) == 4
+            assert set(hist.quantity_names()) == set(["positions", "charges"])
+            assert hist.dump_index(2) == 2
+
+            for i, dump in enumerate(dumps):
+                count = len(dump["charges"])
+                for particles in [None, slice(3, 20), slice(1, None, 5),
+                        numpy.arange(count)[::-3]]:
+                    for name, ary in dump.iteritems():
+                        if particles is None:
+                            ref = ary
+                        else:
+                            ref = ary[particles]
+                        assert (hist.read(name, i, particles) == ref).all()
+
+            # reopening for a restart drops dumps at or after the restart step
+            writer = ParticleHistoryWriter(dirname, discard_from_step=2)
+            writer.append(2, 0.2, dumps[3])
+
+            hist = ParticleHistory(dirname)
+            assert list(hist.steps) == [0, 1, 2]
+            assert (hist.read("positions", 2) == dumps[3]["positions"]).all()
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def test_particle_vtu():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from struct import unpack
+    from xml.dom.minidom import parseString
+    import os.path
+    from pyrticle.vtk_output import write_particle_vtu
+
+    tmpdir = mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, "particles.vtu")
+
+        positions = numpy.random.randn(100, 2)
+        momenta = numpy.random.randn(100, 2)
+        charges = numpy.random.randn(100)
+        write_particle_vtu(fname, positions,
+                [("momentum", momenta), ("charge", charges)],
+                time=0.25, step=3)
+
+        contents = open(fname, "rb").read()
+        xml_end = contents.index("<AppendedData")
+        data_start = contents.index("_", xml_end) + 1
+        dom = parseString(contents[:xml_end] + "</VTKFile>")
+
+        arrays = {}
+        for da in dom.getElementsByTagName("DataArray"):
+            offset = data_start + int(da.getAttribute("offset"))
+            nbytes, = unpack("<Q", contents[offset:offset+8])
+            dtype = {"Float64": numpy.float64, "Int64": numpy.int64,
+                    "UInt8": numpy.uint8}[da.getAttribute("type")]
+            ary = numpy.frombuffer(contents[offset+8:offset+8+nbytes],
+                    dtype=dtype)
+            ncomp = int(da.getAttribute("NumberOfComponents"))
+            arrays[da.getAttribute("Name")] = ary.reshape(-1, ncomp)
+
+        assert (arrays["points"][:, :2] == positions).all()
+        assert (arrays["points"][:, 2] == 0).all()
+        assert (arrays["momentum"] == momenta).all()
+        assert (arrays["charge"][:, 0] == charges).all()
+        assert (arrays["connectivity"][:, 0] == numpy.arange(100)).all()
+        assert arrays["TIME"][0, 0] == 0.25
+        assert arrays["CYCLE"][0, 0] == 3
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def test_mesh_arrays():
+    from hedge.mesh import make_rect_mesh, make_box_mesh
+    from pyrticle.meshdata import MeshData, get_element_vertices, \
+            make_mesh_arrays
+
+    for mesh in [
+            make_rect_mesh((-1,-1), (1,1), max_area=0.05,
+                periodicity=(True, False)),
+            make_box_mesh((-1,-1,-1), (1,1,1), max_volume=0.05),
+            ]:
+        arrays = make_mesh_arrays(mesh, get_element_vertices(mesh))
+
+        neighbor_map = {}
+        for face, (e2, f2) in mesh.both_interfaces():
+            neighbor_map[face] = e2.id
+
+        for el in mesh.elements:
+            inv_map = arrays["inverse_maps"][el.id]
+            assert la.norm(inv_map[:, :-1] - el.inverse_map.matrix) < 1e-10
+            assert la.norm(inv_map[:, -1] - el.inverse_map.vector) < 1e-10
+            assert abs(arrays["jacobians"][el.id] - abs(el.map.jacobian())) < 1e-12
+
+            for face_idx, normal in enumerate(el.face_normals):
+                assert la.norm(arrays["face_normals"][el.id, face_idx]
+                        - normal) < 1e-10
+                assert arrays["face_neighbors"][
+                        el.id*len(el.face_normals) + face_idx] == \
+                                neighbor_map.get((el, face_idx),
+                                    MeshData.INVALID_ELEMENT)
+
+
+
+
+def test_element_order():
+    from hedge.mesh import make_rect_mesh
+    from pyrticle.meshdata import get_element_vertices
+    from pyrticle.geometry import get_element_adjacency, \
+            get_element_order, ELEMENT_ORDERINGS
+
+    mesh = make_rect_mesh((-1,-1), (1,1), max_area=0.002)
+    el_count = len(mesh.elements)
+    starts, neighbors = get_element_adjacency(get_element_vertices(mesh))
+    el_numbers = numpy.arange(el_count)
+    rows = numpy.repeat(el_numbers, numpy.diff(starts))
+
+    def mean_neighbor_distance(order):
+        new_numbers = numpy.empty_like(order)
+        new_numbers[order] = el_numbers
+        return numpy.average(numpy.abs(
+            new_numbers[rows] - new_numbers[neighbors]))
+
+    from random import seed, shuffle
+    seed(0)
+    shuffled = list(el_numbers)
+    shuffle(shuffled)
+    shuffled_distance = mean_neighbor_distance(numpy.array(shuffled))
+
+    for method in ELEMENT_ORDERINGS:
+        order = get_element_order(mesh, method)
+        assert sorted(order) == list(el_numbers)
+        assert mean_neighbor_distance(order) < 0.2*shuffled_distance
+
+
+
+
+def test_element_finder_autotune():
+    from random import seed
+    seed(0)
+
+    from pyrticle.units import SIUnitsWithNaturalConstants
+    units = SIUnitsWithNaturalConstants()
+
+    from hedge.mesh import make_cylinder_mesh
+    from hedge.backends import guess_run_context
+
+    rcon = guess_run_context([])
+
+    tube_length = 100*units.MM
+    mesh = make_cylinder_mesh(radius=25*units.MM, height=tube_length, periodic=True)
+    discr = rcon.make_discretization(mesh, order=3)
+
+    from pyrticle.cloud import PicMethod, guess_shape_bandwidth
+    from pyrticle.deposition.shape import ShapeFunctionDepositor, \
+            ELEMENT_FINDERS
+    from pyrticle.pusher import MonomialParticlePusher
+
+    depositor = ShapeFunctionDepositor(element_finder="autotune",
+            autotune_sample=500)
+    method = PicMethod(discr, units, depositor, MonomialParticlePusher(), 3, 3)
+
+    nparticles = 2000
+    cloud_charge = 1e-9 * units.C
+    electrons_per_particle = cloud_charge/nparticles/units.EL_CHARGE
+
+    from pyrticle.distribution import KVZIntervalBeam
+    beam = KVZIntervalBeam(units,
+            total_charge=cloud_charge,
+            p_charge=cloud_charge/nparticles,
+            p_mass=electrons_per_particle*units.EL_MASS,
+            radii=2*[2.5*units.MM],
+            emittances=2*[5 * units.MM * units.MRAD],
+            z_length=5*units.MM,
+            z_pos=10*units.MM,
+            beta=0.5)
+
+    state = method.make_state()
+    method.add_particles(state, beam.generate_particles(), nparticles)
+    guess_shape_bandwidth(method, state, 2)
+
+    depositor.tune(state)
+    assert "face_based" in depositor.finder_timings
+    chosen = depositor.log_constants["element_finder"]
+    assert chosen in ELEMENT_FINDERS
+    assert chosen in depositor.finder_timings
+
+    rho_chosen = depositor.deposit_rho(state)
+    depositor.set_element_finder("face_based")
+    rho_face_based = depositor.deposit_rho(state)
+    assert la.norm(rho_chosen-rho_face_based) <= 1e-8*la.norm(rho_face_based)
+
+
+
+
+def test_make_particles():
+    from pyrticle.units import SIUnitsWithNaturalConstants
+    units = SIUnitsWithNaturalConstants()
+
+    from pyrticle.distribution import KVZIntervalBeam
+    beam = KVZIntervalBeam(units, total_charge=1e-9, p_charge=1e-13,
+            p_mass=units.EL_MASS, radii=[2e-3, 3e-3], emittances=[5e-6, 4e-6],
+            beta=0.5, z_length=5e-3, z_pos=1e-2)
+
+    count = 10000
+    x, v, q, m = beam.make_particles(count, rng=17)
+    assert x.shape == (count, 3)
+    assert v.shape == (count, 3)
+    assert q.shape == m.shape == (count, 1)
+    assert (q == 1e-13).all() and (m == units.EL_MASS).all()
+
+    # every KV particle lies on the boundary of the 4D phase space ellipsoid
+    radii = numpy.array(beam.radii)
+    emittances = numpy.array(beam.emittances)
+    xp = v[:, :2]/v[:, 2:3]
+    ellipse = (numpy.sum((x[:, :2]/radii)**2, axis=1)
+            + numpy.sum((xp*radii/emittances)**2, axis=1))
+    assert la.norm(ellipse-1, numpy.inf) < 1e-12
+
+    assert (7.5e-3 <= x[:, 2]).all() and (x[:, 2] <= 12.5e-3).all()
+
+    assert (beam.make_particles(count, rng=17)[0] == x).all()
+
+    pos, vel, charge, mass = beam.generate_particles(
+            seed=17, chunk_size=count).next()
+    assert (pos == x[0]).all() and charge == 1e-13
+
+
+
+
+def test_quiet_start():
+    from math import erfc, sqrt
+    from pyrticle.tools import inverse_normal_cdf
+    p = numpy.linspace(1e-9, 0.5, 1001)
+    x = inverse_normal_cdf(p)
+    cdf = numpy.array([0.5*erfc(-x_i/sqrt(2)) for x_i in x])
+    assert la.norm((cdf-p)/p, numpy.inf) < 1e-7
+
+    from pyrticle.units import SIUnitsWithNaturalConstants
+    units = SIUnitsWithNaturalConstants()
+
+    from pyrticle.distribution import KVZIntervalBeam, QuietStart
+    beam = KVZIntervalBeam(units, total_charge=1e-9, p_charge=1e-13,
+            p_mass=units.EL_MASS, radii=[2e-3, 3e-3], emittances=[5e-6, 4e-6],
+            beta=0.5, z_length=5e-3, z_pos=1e-2)
+
+    x, v, q, m = QuietStart(beam).make_particles(10000, rng=0)
+
+    # mirrored loading centers the beam exactly
+    assert la.norm(numpy.average(x[:, :2], axis=0), numpy.inf) < 1e-15
+    assert la.norm(numpy.average(v[:, :2], axis=0), numpy.inf) < 1e-6
+
+    rms_x = numpy.average(x[:, 0]**2)**0.5
+    assert abs(rms_x-beam.rms_radii[0]) < 2e-3*beam.rms_radii[0]
+
+
+
+
+def test_particle_file():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    import os.path
+
+    from pyrticle.distribution import ParticleFile, write_particle_file, \
+            make_particle_record_dtype
+
+    rng = numpy.random.RandomState(0)
+    count = 2500
+    positions = rng.normal(size=(count, 3))
+    velocities = rng.normal(size=(count, 3))
+    charges = rng.normal(size=count)
+    masses = rng.normal(size=count)
+
+    tmpdir = mkdtemp()
+    try:
+        npy_name = os.path.join(tmpdir, "particles.npy")
+        write_particle_file(npy_name, positions, velocities, charges, masses)
+
+        # the same data as a raw file of big-endian singles after a header
+        raw_dtype = make_particle_record_dtype(3, 3, ">f4")
+        records = numpy.empty((count,), dtype=raw_dtype)
+        records["position"] = positions
+        records["velocity"] = velocities
+        records["charge"] = charges
+        records["mass"] = masses
+        raw_name = os.path.join(tmpdir, "particles.bin")
+        outf = open(raw_name, "wb")
+        outf.write("12345678")
+        records.tofile(outf)
+        outf.close()
+
+        for pfile, tolerance in [
+                (ParticleFile(npy_name), 0),
+                (ParticleFile(raw_name, dtype=raw_dtype, offset=8), 1e-6)]:
+            assert len(pfile) == count
+            assert pfile.count_axes() == (3, 3, 1, 1)
+
+            chunks = list(pfile.generate_particle_chunks(chunk_size=1000))
+            assert [len(chunk[0]) for chunk in chunks] == [1000, 1000, 500]
+
+            for component, data in enumerate(
+                    [positions, velocities, charges, masses]):
+                read = numpy.vstack([chunk[component] for chunk in chunks])
+                assert read.shape == (count, (3, 3, 1, 1)[component])
+                assert la.norm(read.reshape(data.shape)-data, numpy.inf) \
+                        <= tolerance*la.norm(data, numpy.inf)
+
+            assert abs(pfile.mean()[2][0]-numpy.average(charges)) < 1e-6
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def make_2d_test_method(order=1, units=None, depositor=None, pusher=None,
+        mesh=None, **kwargs):
+    """Return a tuple C{(units, discr, method)}: a L{PicMethod} for two
+    position and two velocity dimensions on an unstructured mesh of the
+    square M{[-1,1]^2} (unless C{mesh} is given), by default with a shape
+    function depositor and a monomial pusher. C{kwargs} are passed on to
+    L{PicMethod}.
+    """
+    if units is None:
+        from pyrticle.units import SIUnitsWithNaturalConstants
+        units = SIUnitsWithNaturalConstants()
+
+    from hedge.backends import guess_run_context
+    rcon = guess_run_context([])
+
+    if mesh is None:
+        from hedge.mesh import make_rect_mesh
+        mesh = make_rect_mesh((-1,-1), (1,1), max_area=0.05)
+    discr = rcon.make_discretization(mesh, order=order)
+
+    if depositor is None:
+        from pyrticle.deposition.shape import ShapeFunctionDepositor
+        depositor = ShapeFunctionDepositor()
+    if pusher is None:
+        from pyrticle.pusher import MonomialParticlePusher
+        pusher = MonomialParticlePusher()
+
+    from pyrticle.cloud import PicMethod
+    method = PicMethod(discr, units, depositor, pusher, 2, 2, **kwargs)
+
+    return units, discr, method
+
+
+
+
+def test_emitters():
+    from pyrticle.units import SIUnitsWithNaturalConstants
+    units = SIUnitsWithNaturalConstants()
+
+    from hedge.mesh import TAG_ALL
+    from pyrticle.emission import SurfaceEmitter, VolumeEmitter
+
+    surface = SurfaceEmitter(TAG_ALL, 2.5, units.EL_CHARGE, units.EL_MASS,
+            normal_velocity=1e5, seed=0)
+    volume = VolumeEmitter(TAG_ALL, 10, units.EL_CHARGE, units.EL_MASS,
+            thermal_velocity=1e4, seed=1)
+    units, discr, method = make_2d_test_method(units=units,
+            emitters=[surface, volume])
+
+    state = method.make_state()
+    for step in range(4):
+        method.upkeep(state)
+
+    assert len(state) == 4*10 + 10
+    method.check_containment(state)
+
+    assert (numpy.abs(state.positions) < 1).all()
+
+    # particles from the boundary start there and move inward
+    positions, velocities, charges, masses, cont_els = \
+            surface.make_particles(100)
+    assert (numpy.abs(positions).max(axis=1) > 0.99).all()
+    assert (numpy.sum(positions*velocities, axis=1) < 0).all()
+
+
+
+
+def test_species_table():
+    import pyrticle._internal as _internal
+
+    units, discr, method = make_2d_test_method()
+    state = method.make_state()
+
+    count = 100
+    rng = numpy.random.RandomState(0)
+    positions = rng.uniform(-0.9, 0.9, (count, 2))
+    velocities = numpy.zeros((count, 2))
+    electron = rng.uniform(size=count) < 0.5
+    charges = numpy.where(electron, -units.EL_CHARGE, units.EL_CHARGE)
+    masses = numpy.where(electron, units.EL_MASS, 1836*units.EL_MASS)
+
+    method.add_particle_arrays(state, positions, velocities, charges, masses)
+    assert len(state.particle_state.species_charges) == 2
+    assert state.weights is None
+    assert (state.charges == charges).all()
+    assert (state.masses == masses).all()
+
+    weights = rng.uniform(1, 2, count)
+    method.add_particle_arrays(state, positions, velocities, charges, masses,
+            weights=weights)
+    assert len(state.particle_state.species_charges) == 2
+    assert (state.weights == numpy.hstack((numpy.ones(count), weights))).all()
+    assert la.norm(state.charges - numpy.hstack((charges, weights*charges))) \
+            <= 1e-12*la.norm(charges)
+    assert abs(_internal.total_charge(state.particle_state)
+            - numpy.sum(state.charges)) <= 1e-12*la.norm(charges)
+
+
+
+
+def test_grouped_deposition():
+    from pyrticle.cloud import guess_shape_bandwidth
+
+    units, discr, method = make_2d_test_method(order=3)
+    state = method.make_state()
+
+    count = 200
+    rng = numpy.random.RandomState(0)
+    electron = rng.uniform(size=count) < 0.5
+    method.add_particle_arrays(state,
+            rng.uniform(-0.5, 0.5, (count, 2)),
+            1e6*rng.normal(size=(count, 2)),
+            numpy.where(electron, -units.EL_CHARGE, units.EL_CHARGE),
+            numpy.where(electron, units.EL_MASS, 1836*units.EL_MASS))
+    guess_shape_bandwidth(method, state, 2)
+
+    rho, j = method.deposit_grouped_densities(state)
+    assert rho.shape == (2, len(discr))
+    assert j.shape == (2, 2, len(discr))
+
+    total_rho = method.deposit_rho(state)
+    total_j = method.deposit_j(state)
+    assert la.norm(rho.sum(axis=0) - total_rho) <= 1e-12*la.norm(total_rho)
+    assert la.norm((j.sum(axis=0) - total_j).ravel()) \
+            <= 1e-12*la.norm(total_j.ravel())
+
+    # groups beyond group_count are left out
+    halves = numpy.arange(count) >= count//2
+    rho_halves = method.deposit_grouped_rho(state, halves)
+    first_half = method.deposit_grouped_rho(state, halves, 1)
+    assert la.norm(rho_halves.sum(axis=0) - total_rho) \
+            <= 1e-12*la.norm(total_rho)
+    assert la.norm(first_half[0] - rho_halves[0]) == 0
+
+
+
+
+def test_beam_moments():
+    import pyrticle._internal as _internal
+
+    units, discr, method = make_2d_test_method()
+    state = method.make_state()
+
+    count = 200
+    rng = numpy.random.RandomState(0)
+    positions = rng.uniform(-0.9, 0.9, (count, 2))
+    velocities = rng.uniform(0.1, 0.5, (count, 2))*units.VACUUM_LIGHT_SPEED()
+    charges = numpy.repeat(-units.EL_CHARGE, count)
+    masses = numpy.repeat(units.EL_MASS, count)
+    method.add_particle_arrays(state, positions, velocities, charges, masses)
+
+    ps = state.particle_state
+    c = units.VACUUM_LIGHT_SPEED()
+    moments = _internal.get_beam_moments(ps, c, 1)
+
+    def rel_error(a, b):
+        return la.norm(numpy.asarray(a)-b)/la.norm(b)
+
+    energies = _internal.kinetic_energies(ps, c)
+    assert rel_error(moments.total_kinetic_energy, numpy.sum(energies)) < 1e-12
+    assert rel_error(moments.kinetic_energy_variance**0.5,
+            numpy.std(energies)) < 1e-8
+    assert rel_error(moments.total_charge, numpy.sum(charges)) < 1e-12
+    assert rel_error(moments.total_momentum,
+            _internal.particle_momentum(ps)) < 1e-12
+    assert rel_error(moments.total_charge_velocity,
+            _internal.particle_current(ps, method.velocities(state), 1)) < 1e-12
+
+    for axis in range(2):
+        assert rel_error(
+                (moments.position_variance[axis]
+                    + moments.mean_position[axis]**2)**0.5,
+                _internal.rms_beam_size(ps, axis)) < 1e-12
+    assert rel_error(
+            (moments.position_variance[0]*moments.slope_variance[0]
+                - moments.position_slope_covariance[0]**2)**0.5,
+            _internal.rms_beam_emittance(ps, 0, 1)) < 1e-8
+
+
+
+
+def test_phase_space_histograms():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    import os.path
+
+    from pyrticle.log import StateObserver
+    from pyrticle.phase_space import PhaseSpaceHistoryWriter, \
+            PhaseSpaceHistory, PositionHistogram, EnergyHistogram, \
+            TraceSpaceHistogram
+
+    units, discr, method = make_2d_test_method()
+    observer = StateObserver(method, None)
+
+    count = 500
+    rng = numpy.random.RandomState(0)
+    positions = rng.uniform(-0.9, 0.9, (count, 2))
+    velocities = rng.uniform(0.1, 0.5, (count, 2))*units.VACUUM_LIGHT_SPEED()
+
+    def make_histograms():
+        return [
+                PositionHistogram(1, bins=10, range=(-1, 1)),
+                EnergyHistogram(bins=20),
+                TraceSpaceHistogram(0, 1, bins=(8, 6)),
+                ]
+
+    tmpdir = mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "phase_space.psh")
+        writer = PhaseSpaceHistoryWriter(path, make_histograms())
+
+        state = method.make_state()
+        for step in range(3):
+            observer.set_fields_and_state(None, state)
+            writer.append(writer.make_record(step, 0.1*step, observer))
+            method.add_particle_arrays(state, positions, velocities,
+                    numpy.repeat(-units.EL_CHARGE, count),
+                    numpy.repeat(units.EL_MASS, count))
+
+        history = PhaseSpaceHistory(path)
+        assert len(history) == 3
+        assert (history.particle_counts == [0, count, 2*count]).all()
+
+        density = history.read("n_y")
+        assert density.shape == (3, 10)
+        assert (density[0] == 0).all()
+        assert (density[2] == 2*numpy.histogram(
+            positions[:, 1], 10, (-1, 1))[0]).all()
+        assert history.read("n_x_xp").shape == (3, 8, 6)
+        assert history.get_bin_edges("n_x_xp")[1].shape == (7,)
+
+        # restarting reuses the ranges and drops later dumps
+        histograms = make_histograms()
+        writer = PhaseSpaceHistoryWriter(path, histograms, discard_from_step=2)
+        assert histograms[1].axes == history.axes["n_W"]
+        assert len(PhaseSpaceHistory(path)) == 2
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def test_checkpoint_element_order():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    import os.path
+
+    from hedge.mesh import make_rect_mesh
+    from pyrticle.geometry import reorder_mesh
+    from pyrticle.cloud import guess_shape_bandwidth
+    from pyrticle.checkpoint import \
+            write_pic_checkpoint, read_pic_checkpoint, Checkpoint
+
+    mesh = make_rect_mesh((-1,-1), (1,1), max_area=0.05)
+    units, discr, method = make_2d_test_method(mesh=mesh)
+    state = method.make_state()
+
+    count = 50
+    rng = numpy.random.RandomState(0)
+    method.add_particle_arrays(state,
+            rng.uniform(-0.9, 0.9, (count, 2)),
+            1e6*rng.normal(size=(count, 2)),
+            numpy.repeat(-units.EL_CHARGE, count),
+            numpy.repeat(units.EL_MASS, count))
+    guess_shape_bandwidth(method, state, 2)
+
+    tmpdir = mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, "test.pcp")
+        write_pic_checkpoint(fname, method, state,
+                [numpy.zeros(len(discr))], 17, 0.5)
+
+        new_state = method.make_state()
+        fields, step, t = read_pic_checkpoint(Checkpoint(fname),
+                method, new_state)
+        assert (step, t) == (17, 0.5)
+        assert len(new_state) == count
+        assert (new_state.particle_state.containing_elements[:count]
+                == state.particle_state.containing_elements[:count]).all()
+
+        # the same mesh with its elements renumbered must be refused
+        units, discr, method = make_2d_test_method(
+                mesh=reorder_mesh(mesh, "rcm"))
+        try:
+            read_pic_checkpoint(Checkpoint(fname),
+                    method, method.make_state())
+        except ValueError:
+            pass
+        else:
+            assert False, "restart with different element order accepted"
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def test_restart_steps():
+    from hedge.timestep import times_and_steps
+    from pyrticle.driver import \
+            continue_times_and_steps, extract_restart_argument
+
+    argv = ["setup.cpy", "--restart", "checkpoint.pcp", "--other"]
+    assert extract_restart_argument(argv) == "checkpoint.pcp"
+    assert argv == ["setup.cpy", "--other"]
+    assert extract_restart_argument(["--restart=x.pcp"]) == "x.pcp"
+    assert extract_restart_argument(argv) is None
+
+    dt = 0.1
+    nsteps = 10
+    start_step = 4
+
+    full_run = list(times_and_steps(
+        max_steps=nsteps, max_dt_getter=lambda t: dt))
+    restarted_run = list(continue_times_and_steps(
+        times_and_steps(
+            max_steps=nsteps-start_step, max_dt_getter=lambda t: dt),
+        start_step, full_run[start_step][1]))
+
+    assert [step for step, t, step_dt in restarted_run] \
+            == [step for step, t, step_dt in full_run[start_step:]]
+    for (step, t, step_dt), (full_step, full_t, full_dt) in zip(
+            restarted_run, full_run[start_step:]):
+        assert abs(t - full_t) < 1e-12
+
+
+
+
+def test_diagnostic_capture():
+    units, discr, method = make_2d_test_method()
+    state = method.make_state()
+    other_state = method.make_state()
+
+    assert method.get_vis_listener(state) is state.vis_listener
+    method.set_diagnostic_capture(state, False)
+    assert method.get_vis_listener(state) is None
+    assert method.get_vis_listener(other_state) is other_state.vis_listener
+
+    # states advanced in time inherit the setting
+    method.add_particle_arrays(state,
+            numpy.zeros((1, 2)), numpy.zeros((1, 2)),
+            [-units.EL_CHARGE], [units.EL_MASS])
+    new_state = method.advance_state(state,
+            numpy.zeros((1, 2)), numpy.zeros((1, 2)), 0)
+    assert method.get_vis_listener(new_state) is None
+
+    assert not method.log_needs_diagnostics
+    method.note_logged_diagnostics()
+    assert method.log_needs_diagnostics
+
+
+
+
+def test_advective_depositor():
+    from pytools.log import LogManager
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+    from pyrticle.log import StateObserver
+    from pyrticle.meshdata import MeshData
+    from pyrticle.deposition.advective import AdvectiveDepositor
+    from pyrticle.cloud import guess_shape_bandwidth, \
+            TimesteppablePicState, ParticleRhsCalculator
+
+    units, discr, method = make_2d_test_method(order=3,
+            depositor=AdvectiveDepositor())
+    depositor = method.depositor
+    state = method.make_state()
+
+    count = 5
+    rng = numpy.random.RandomState(0)
+    positions = numpy.column_stack((
+        rng.uniform(-0.3, -0.1, count),
+        rng.uniform(-0.2, 0.2, count)))
+    velocities = numpy.repeat([[1., 0.]], count, axis=0)
+    charges = numpy.repeat(-units.EL_CHARGE, count)
+    method.add_particle_arrays(state, positions, velocities, charges,
+            numpy.repeat(units.EL_MASS, count))
+    guess_shape_bandwidth(method, state, 2)
+
+    logmgr = LogManager(mode="w")
+    method.add_instrumentation(logmgr, StateObserver(method, None))
+
+    def check_connectivity(state):
+        """Every connection between two elements of a particle must be
+        recorded on both of them."""
+        cd = depositor.get_checkpoint_data(state)
+        starts = cd["element_starts"]
+        element_numbers = cd["element_numbers"]
+        connections = cd["connections"].reshape(len(element_numbers), -1)
+        assert len(element_numbers) == state.depositor_state.active_elements
+
+        for pn in range(len(state)):
+            own = dict((element_numbers[i], i)
+                    for i in range(starts[pn], starts[pn+1]))
+            for i in own.itervalues():
+                for neighbor in connections[i]:
+                    if neighbor == MeshData.INVALID_ELEMENT:
+                        continue
+                    assert neighbor in own
+                    assert element_numbers[i] in connections[own[neighbor]]
+
+    def deposited_charge(state):
+        return discr.integral(method.deposit_rho(state))
+
+    check_connectivity(state)
+    initial_elements = state.depositor_state.active_elements
+    total_charge = numpy.sum(charges)
+    assert abs(deposited_charge(state) - total_charge) \
+            < 1e-10*abs(total_charge)
+
+    particle_rhs = ParticleRhsCalculator(method, None)
+    def rhs(t, y):
+        return particle_rhs(t, None, lambda: y.state)
+
+    stepper = LSRK4TimeStepper()
+    ts_state = TimesteppablePicState(method, state)
+    dt = 0.004
+    activations = 0
+    kills = 0
+    for step in xrange(100):
+        ts_state = stepper(ts_state, step*dt, dt, rhs)
+        method.upkeep(ts_state.state)
+        check_connectivity(ts_state.state)
+
+        activations += depositor.element_activation_counter()
+        kills += depositor.element_kill_counter()
+
+    # the counters are transferred on the next rhs evaluation, collect
+    # what the last step left behind
+    state = ts_state.state
+    activations += state.depositor_state.element_activation_counter.get()
+    kills += state.depositor_state.element_kill_counter.get()
+
+    assert activations > initial_elements
+    assert kills > 0
+    assert state.depositor_state.active_elements == activations - kills
+
+    # charge only leaves through retired elements and sub-threshold
+    # outflow, both of which are small
+    assert abs(deposited_charge(state) - total_charge) \
+            < 5e-2*abs(total_charge)
+
+
+
+
+def test_update_containing_elements():
+    from hedge.mesh import make_rect_mesh
+    from pyrticle.meshdata import MeshData
+
+    units, discr, method = make_2d_test_method(
+            mesh=make_rect_mesh((-1,-1), (1,1), max_area=0.05,
+                periodicity=(True, False)))
+    state = method.make_state()
+
+    count = 100
+    rng = numpy.random.RandomState(0)
+    positions = rng.uniform(-0.9, 0.9, (count, 2))
+    # tell the particles apart by their speed, which survives renumbering
+    velocities = numpy.zeros((count, 2))
+    velocities[:, 0] = 1e3*(numpy.arange(count)+1)
+    method.add_particle_arrays(state, positions, velocities,
+            numpy.repeat(-units.EL_CHARGE, count),
+            numpy.repeat(units.EL_MASS, count))
+    momenta = state.momenta[:, 0].copy()
+
+    # several element widths, leaving through both the periodic x and
+    # the non-periodic y boundaries
+    dx = rng.uniform(-1.5, 1.5, (count, 2))
+    new_positions = positions + dx
+    new_positions[:, 0] = (new_positions[:, 0]+1) % 2 - 1
+    survives = numpy.abs(new_positions[:, 1]) < 1
+    assert (numpy.abs(positions[:, 0]+dx[:, 0]) > 1)[survives].any()
+    assert not survives.all()
+
+    state = method.advance_state(state, dx, numpy.zeros((count, 2)), 0)
+
+    assert len(state) == numpy.sum(survives)
+    particle_numbers = [list(momenta).index(p) for p in state.momenta[:, 0]]
+    assert sorted(particle_numbers) == list(numpy.nonzero(survives)[0])
+    # survivors were moved into the slots of killed particles
+    assert particle_numbers != sorted(particle_numbers)
+
+    containing_elements = state.particle_state.containing_elements
+    for pn, orig_pn in enumerate(particle_numbers):
+        pos = state.positions[pn]
+        assert la.norm(pos - new_positions[orig_pn]) < 1e-12
+        assert containing_elements[pn] != MeshData.INVALID_ELEMENT
+        assert containing_elements[pn] \
+                == method.mesh_data.find_containing_element(pos)
+
+
+
+
+def test_margin_cache():
+    import pyrticle._internal as _internal
+
+    units, discr, method = make_2d_test_method()
+    state = method.make_state()
+
+    count = 100
+    rng = numpy.random.RandomState(0)
+    method.add_particle_arrays(state,
+            rng.uniform(-0.8, 0.8, (count, 2)),
+            numpy.zeros((count, 2)),
+            numpy.repeat(-units.EL_CHARGE, count),
+            numpy.repeat(units.EL_MASS, count))
+    ps = state.particle_state
+
+    class BHitListener(_internal.BoundaryHitListener):
+        def note_boundary_hit(self, pn):
+            assert False, "particle %d left the mesh" % pn
+
+    def update(dx=0):
+        positions = ps.positions
+        positions[:len(state)] += dx
+        ps.positions = positions
+
+        counters = _internal.FindEventCounters()
+        _internal.update_containing_elements(
+                method.mesh_data, ps, BHitListener(), counters)
+
+        containing_elements = ps.containing_elements[:len(state)]
+        for pn in range(len(state)):
+            assert containing_elements[pn] \
+                    == method.mesh_data.find_containing_element(
+                            state.positions[pn])
+        return containing_elements, counters.find_by_margin.get()
+
+    def small_step():
+        return 1e-4*rng.normal(size=(len(state), 2))
+
+    update(small_step())
+    elements, n_find_margin = update(small_step())
+    assert n_find_margin > 0
+
+    # the cache must not change the outcome
+    state.reset_margin_cache()
+    uncached_elements, n_find_margin = update()
+    assert n_find_margin == 0
+    assert (uncached_elements == elements).all()
+
+    # the cache follows particles that are renumbered ...
+    for pn in [0, 10, 20]:
+        _internal.kill_particle(ps, pn, state.particle_number_shift_signaller)
+    update(small_step())
+    assert update(small_step())[1] > 0
+
+    # ... and is rebuilt when the particle arrays are resized
+    state.resize(2*len(ps.containing_elements))
+    update(small_step())
+    assert update(small_step())[1] > 0
+
+
+
+
+def test_walk_to_containing_element():
+    import pyrticle._internal as _internal
+    from hedge.mesh import make_rect_mesh
+    from pyrticle.meshdata import MeshData
+
+    units, discr, method = make_2d_test_method(
+            mesh=make_rect_mesh((-1,-1), (1,1), max_area=0.05,
+                periodicity=(True, False)))
+    mesh_data = method.mesh_data
+    max_steps = 16
+
+    start = numpy.array([0.013, 0.021])
+    start_el = mesh_data.find_containing_element(start)
+
+    # find a point two or three elements away
+    rng = numpy.random.RandomState(0)
+    for i in xrange(1000):
+        target = start + rng.uniform(-0.6, 0.6, 2)
+        target_el, steps = mesh_data.walk_to_containing_element(
+                start_el, target, max_steps)
+        if target_el != MeshData.INVALID_ELEMENT and 2 <= steps <= 3:
+            break
+    else:
+        assert False, "no point two or three elements away found"
+    assert target_el == mesh_data.find_containing_element(target)
+
+    # a particle moving there is found by walking
+    state = method.make_state()
+    method.add_particle_arrays(state,
+            numpy.array([start]), numpy.zeros((1, 2)),
+            [-units.EL_CHARGE], [units.EL_MASS])
+    ps = state.particle_state
+    assert ps.containing_elements[0] == start_el
+
+    class BHitListener(_internal.BoundaryHitListener):
+        def note_boundary_hit(self, pn):
+            assert False, "particle %d left the mesh" % pn
+
+    positions = ps.positions
+    positions[0] = target
+    ps.positions = positions
+    counters = _internal.FindEventCounters()
+    _internal.update_containing_elements(
+            mesh_data, ps, BHitListener(), counters)
+
+    assert ps.containing_elements[0] == target_el
+    assert counters.find_by_walk.get() == 1
+    assert counters.find_by_neighbor.get() == 0
+    assert counters.find_by_vertex.get() == 0
+    assert counters.find_global.get() == 0
+
+    # the walk gives up at boundary faces, and at periodic faces
+    # instead of wrapping around
+    for outside in [(0, 1.5), (1.5, 0)]:
+        el, steps = mesh_data.walk_to_containing_element(
+                start_el, numpy.array(outside), max_steps)
+        assert el == MeshData.INVALID_ELEMENT
+        assert steps < max_steps
+
+
+
+
+def test_phase_timings():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from json import loads
+    import os.path
+    import warnings
+
+    import pyrticle._internal as _internal
+    from pytools.log import LogManager
+    from pyrticle.log import PhaseTimings, add_phase_timing_quantities
+
+    # feed known cumulative (seconds, calls, items) readings
+    phases = ["find_element", "dep_scatter"]
+    readings = [
+            {"find_element": (0.5, 10, 100), "dep_scatter": (0.25, 4, 0)},
+            {"find_element": (1.5, 12, 150), "dep_scatter": (0.25, 4, 0)},
+            {"find_element": (1.75, 20, 160), "dep_scatter": (1.25, 6, 30)},
+            ]
+    core_functions = ["phase_timing_enabled", "get_phase_names",
+            "get_phase_timings"]
+    saved = dict((name, getattr(_internal, name)) for name in core_functions)
+    saved_filters = warnings.filters[:]
+
+    tmpdir = mkdtemp()
+    try:
+        _internal.phase_timing_enabled = lambda: True
+        _internal.get_phase_names = lambda: phases
+        _internal.get_phase_timings = lambda: readings.pop(0)
+
+        json_filename = os.path.join(tmpdir, "phases.json")
+        timings = PhaseTimings(json_filename, start_step=7)
+        assert timings.names == ["t_ph_find_element", "n_ph_find_element",
+                "t_ph_dep_scatter", "n_ph_dep_scatter"]
+
+        # each step logs the difference to the previous reading
+        assert timings() == [1.0, 2, 0.0, 0]
+        assert timings() == [0.25, 8, 1.0, 2]
+
+        steps = [loads(line) for line in open(json_filename)]
+        assert [step["step"] for step in steps] == [7, 8]
+        assert steps[0]["phases"] == {
+                "find_element": {"t": 1.0, "calls": 2, "items": 50},
+                "dep_scatter": {"t": 0.0, "calls": 0, "items": 0},
+                }
+        assert steps[1]["phases"]["dep_scatter"] == \
+                {"t": 1.0, "calls": 2, "items": 30}
+
+        readings.append({"find_element": (0, 0, 0), "dep_scatter": (0, 0, 0)})
+        mgr = LogManager(None, "w")
+        add_phase_timing_quantities(mgr)
+        assert "t_ph_dep_scatter" in mgr.quantity_data
+
+        # asking for timings from a core built without them warns
+        _internal.phase_timing_enabled = lambda: False
+        mgr = LogManager(None, "w")
+        warnings.simplefilter("error")
+        try:
+            add_phase_timing_quantities(mgr, json_filename)
+        except UserWarning, e:
+            assert "PHASE_TIMING" in str(e)
+        else:
+            assert False, "missing phase timing not reported"
+        warnings.filters[:] = saved_filters
+
+        add_phase_timing_quantities(mgr)
+        assert "t_ph_dep_scatter" not in mgr.quantity_data
+    finally:
+        warnings.filters[:] = saved_filters
+        for name, function in saved.iteritems():
+            setattr(_internal, name, function)
+        rmtree(tmpdir)
+
+
+
+
+def test_startup_timer():
+    import time
+    from pytools.log import LogManager
+    import pyrticle.log as log
+
+    # feed known clock and peak memory readings
+    clock = [10.0, 12.5, 13.0, 20.0]
+    memory = [100.0, 150.0]
+    saved_time = time.time
+    saved_get_peak_memory = log.get_peak_memory
+
+    try:
+        time.time = lambda: clock.pop(0)
+        log.get_peak_memory = lambda: memory.pop(0)
+
+        timer = log.StartupTimer()
+        timer.start("mesh")
+        timer.start("particles")
+        assert timer.current == "particles"
+        assert timer.phases == [("mesh", 2.5, 100.0)]
+
+        # add_to_log ends the running phase
+        mgr = LogManager(None, "w")
+        timer.add_to_log(mgr)
+        assert timer.current is None
+        assert [name for name, seconds, peak_mem in timer.phases] \
+                == ["mesh", "particles"]
+
+        assert mgr.constants["t_setup_mesh"] == 2.5
+        assert mgr.constants["mem_setup_mesh"] == 100.0
+        assert mgr.constants["t_setup_particles"] == 7.0
+        assert mgr.constants["mem_setup_particles"] == 150.0
+        assert mgr.constants["t_setup"] == 9.5
+        assert not clock and not memory
+    finally:
+        time.time = saved_time
+        log.get_peak_memory = saved_get_peak_memory
+
+
+
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1: